@@ -0,0 +1,205 @@
+"""
+Spreadsheet reader/writer backends for the Excel Merge Tool.
+The format of an input file is detected from its leading bytes rather than
+its extension. Each format has a list of pandas engines in order of
+preference; the first installed one is used, a failing backend falls back
+to the next, and a backend can be forced with EXCEL_MERGE_READER /
+EXCEL_MERGE_WRITER (cli.py --reader / --writer).
+Results can also be written as columnar tables (Parquet, Arrow IPC or a
+SQLite table) chosen by the output file's extension.
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
+
+# pandas, zipfile and sqlite3 are imported where they are used, so the command-line parsers can be built without them
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+ZIP_MAGIC = b'PK\x03\x04'
+OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# Module that must be importable for each pandas engine
+BACKEND_MODULES = {
+    'calamine': 'python_calamine',
+    'openpyxl': 'openpyxl',
+    'xlrd': 'xlrd',
+    'pyxlsb': 'pyxlsb',
+    'odf': 'odf',
+    'xlsxwriter': 'xlsxwriter',
+}
+
+# Engines per format, fastest first. calamine (Rust) parses .xlsx several times faster than openpyxl.
+READERS: Dict[str, List[str]] = {
+    'xlsx': ['calamine', 'openpyxl'],
+    'xls': ['calamine', 'xlrd'],
+    'xlsb': ['calamine', 'pyxlsb'],
+    'ods': ['calamine', 'odf'],
+}
+WRITERS: Dict[str, List[str]] = {
+    'xlsx': ['xlsxwriter', 'openpyxl'],
+    'ods': ['odf'],
+}
+WRITE_FORMATS = {'.xlsx': 'xlsx', '.xlsm': 'xlsx', '.ods': 'ods', '.xls': 'xls'}
+
+# Columnar output targets by extension; parquet and arrow need pyarrow
+TABLE_FORMATS = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow',
+                 '.sqlite': 'sqlite', '.sqlite3': 'sqlite', '.db': 'sqlite'}
+SQLITE_RESULT_TABLE = 'orders'
+
+READER_ENV = 'EXCEL_MERGE_READER'
+WRITER_ENV = 'EXCEL_MERGE_WRITER'
+
+
+def register_backend(kind: str, file_format: str, engine: str, module: Optional[str] = None,
+                     first: bool = False) -> None:
+    """
+    Add a pandas engine for reading ('reader') or writing ('writer') a format;
+    first=True puts it ahead of the built-in choices
+    """
+    registry = READERS if kind == 'reader' else WRITERS
+    engines = registry.setdefault(file_format, [])
+    if engine in engines:
+        engines.remove(engine)
+    engines.insert(0 if first else len(engines), engine)
+    if module is not None:
+        BACKEND_MODULES[engine] = module
+
+
+def is_available(engine: str) -> bool:
+    return importlib.util.find_spec(BACKEND_MODULES.get(engine, engine)) is not None
+
+
+def detect_format(file_path: str) -> str:
+    """
+    'xlsx', 'xlsb', 'ods', 'xls' or 'csv' (anything that is not a known binary container)
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(8)
+    if magic.startswith(OLE2_MAGIC):
+        return 'xls'
+    if magic.startswith(ZIP_MAGIC):
+        import zipfile
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                names = set(archive.namelist())
+        except zipfile.BadZipFile:
+            return 'csv'
+        if 'xl/workbook.bin' in names:
+            return 'xlsb'
+        if 'content.xml' in names and 'mimetype' in names:
+            return 'ods'
+        return 'xlsx'
+    return 'csv'
+
+
+def _candidates(registry: Dict[str, List[str]], file_format: str, forced: Optional[str]) -> List[str]:
+    if forced:
+        return [forced]
+    engines = [engine for engine in registry.get(file_format, []) if is_available(engine)]
+    if not engines:
+        raise ValueError(f"No installed backend can handle {file_format} files; install one of "
+                         f"{', '.join(BACKEND_MODULES.get(e, e) for e in registry.get(file_format, [])) or 'nothing'}")
+    return engines
+
+
+def _with_fallback(engines: List[str], action: Callable[[str], Any], description: str) -> Any:
+    for position, engine in enumerate(engines):
+        try:
+            return action(engine)
+        except Exception as e:
+            if position == len(engines) - 1:
+                raise
+            logger.warning("%s with %s failed (%s), trying %s", description, engine, e, engines[position + 1])
+
+
+def read_spreadsheet(file_path: str, file_format: str, **options: Any) -> 'pd.DataFrame':
+    """
+    pd.read_excel with the preferred installed engine for file_format
+    """
+    import pandas as pd
+    engines = _candidates(READERS, file_format, os.environ.get(READER_ENV))
+    return _with_fallback(engines, lambda engine: pd.read_excel(file_path, engine=engine, **options),
+                          f"Reading {file_path}")
+
+
+def write_spreadsheet(df: Union['pd.DataFrame', Dict[str, 'pd.DataFrame']], file_path: Path) -> None:
+    """
+    DataFrame.to_excel with the preferred installed engine for the extension
+    of file_path; a dict of sheet name -> DataFrame is written as one workbook
+    """
+    file_format = WRITE_FORMATS.get(Path(file_path).suffix.lower(), 'xlsx')
+    if file_format not in WRITERS:
+        raise ValueError(f"Cannot write {file_format} files; choose an .xlsx output file instead")
+    engines = _candidates(WRITERS, file_format, os.environ.get(WRITER_ENV))
+    _with_fallback(engines, lambda engine: _to_excel(df, file_path, engine), f"Writing {file_path}")
+
+
+def _to_excel(df: Union['pd.DataFrame', Dict[str, 'pd.DataFrame']], file_path: Path, engine: str) -> None:
+    if not isinstance(df, dict):
+        df.to_excel(file_path, index=False, engine=engine)
+        return
+    import pandas as pd
+    with pd.ExcelWriter(file_path, engine=engine) as writer:
+        for sheet_name, sheet in df.items():
+            sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+
+
+def _arrow_compatible(df: 'pd.DataFrame') -> 'pd.DataFrame':
+    import pandas as pd
+    # Arrow columns have one type, so object columns mixing e.g. numbers and text are written as text
+    mixed = [column for column in df.columns if df[column].dtype == object
+             and pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed')]
+    if not mixed and isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1:
+        return df
+    df = df.reset_index(drop=True)
+    for column in mixed:
+        df[column] = df[column].map(str, na_action='ignore')
+    return df
+
+
+def write_table(df: 'pd.DataFrame', file_path: Path, table: str = SQLITE_RESULT_TABLE) -> None:
+    """
+    Write df as a Parquet file, an Arrow IPC (Feather v2) file or, for a
+    SQLite database, into table (replacing it), by the extension of file_path
+    """
+    file_format = TABLE_FORMATS[Path(file_path).suffix.lower()]
+    if file_format == 'sqlite':
+        import sqlite3
+        connection = sqlite3.connect(file_path)
+        try:
+            with connection:
+                df.to_sql(table, connection, if_exists='replace', index=False, chunksize=50_000)
+        finally:
+            connection.close()
+        return
+    if importlib.util.find_spec('pyarrow') is None:
+        raise ImportError(f"Writing {file_format} files needs pyarrow (pip install pyarrow)")
+    if file_format == 'parquet':
+        _arrow_compatible(df).to_parquet(file_path, index=False)
+    else:
+        _arrow_compatible(df).to_feather(file_path)
+
+
+def add_backend_arguments(parser: argparse.ArgumentParser) -> None:
+    readers = sorted({engine for engines in READERS.values() for engine in engines})
+    writers = sorted({engine for engines in WRITERS.values() for engine in engines})
+    parser.add_argument('--reader', choices=readers, default=None,
+                        help=f'Force the spreadsheet reader (default: fastest installed, ${READER_ENV})')
+    parser.add_argument('--writer', choices=writers, default=None,
+                        help=f'Force the spreadsheet writer (default: fastest installed, ${WRITER_ENV})')
+
+
+def apply_backend_args(args: argparse.Namespace) -> None:
+    # Set through the environment so worker processes inherit the choice
+    if args.reader:
+        os.environ[READER_ENV] = args.reader
+    if args.writer:
+        os.environ[WRITER_ENV] = args.writer
@@ -0,0 +1,200 @@
+"""
+Batch reconciliation for the Excel Merge Tool.
+Loads and indexes every payment statement once, then reconciles any number of
+order files against that shared index.
+"""
+
+import argparse
+import glob
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional, Tuple
+
+# pandas and the matching code load when a batch runs, so 'cli.py batch --help' stays fast
+from backends import add_backend_arguments, apply_backend_args
+from cache import add_cache_arguments, cache_from_args
+from constants import PAYMENT_CHUNK_ROWS
+from matchlog import add_logging_arguments, configure_logging
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from utils import PaymentIndex
+
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+# Input files parsed at the same time; parsing is mostly I/O, decompression and C code
+DEFAULT_IO_THREADS = 4
+
+
+def collect_files(patterns: List[str]) -> List[Path]:
+    """
+    Expand directories and glob patterns into a sorted, de-duplicated list of
+    spreadsheet files. A directory contributes every .csv/.xlsx/.xls file in it.
+    """
+    files = []
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            candidates = path.iterdir()
+        else:
+            candidates = (Path(match) for match in glob.glob(pattern))
+        files.extend(candidate for candidate in candidates
+                     if candidate.is_file() and candidate.suffix.lower() in SUPPORTED_EXTENSIONS)
+    return sorted(set(files))
+
+
+def _index_statement(payment_file: Path, chunksize: int, cache: Any) -> 'PaymentIndex':
+    from utils import PaymentIndex, iter_payment_chunks
+    if cache is not None:
+        from cache import cached_payment_index
+        return cached_payment_index(str(payment_file), cache, chunksize)
+    statement_index = PaymentIndex()
+    for chunk in iter_payment_chunks(str(payment_file), chunksize):
+        statement_index.add(chunk)
+    return statement_index
+
+
+def build_shared_payment_index(payment_files: List[Path], chunksize: int = PAYMENT_CHUNK_ROWS,
+                               cache: Any = None, io_threads: int = DEFAULT_IO_THREADS) -> Dict[str, Any]:
+    """
+    Index every payment statement into one PaymentIndex, in the given order,
+    so an earlier statement wins when several contain a match.
+    Statements are loaded concurrently, io_threads at a time, each into its
+    own scratch index, and merged in order afterwards.
+    A statement that fails to load is reported and left out. Given a
+    cache.ParseCache, each statement's index is reused while it is unchanged.
+    """
+    from utils import PaymentIndex
+    payment_index = PaymentIndex()
+    loaded, failed = [], {}
+    with ThreadPoolExecutor(max_workers=max(io_threads, 1)) as executor:
+        # A scratch index per statement means one failing halfway leaves no partial rows behind
+        futures = [executor.submit(_index_statement, payment_file, chunksize, cache) for payment_file in payment_files]
+        for payment_file, future in zip(payment_files, futures):
+            try:
+                statement_index = future.result()
+            except Exception as e:
+                failed[str(payment_file)] = f"{type(e).__name__}: {e}"
+                continue
+            payment_index.merge(statement_index)
+            loaded.append(str(payment_file))
+            print(f"Indexed payment file: {payment_file} ({statement_index.row_count} rows)")
+    return {'index': payment_index, 'loaded': loaded, 'failed': failed}
+
+
+def reconcile_file(order_file: Path, payment_index: 'PaymentIndex', output_dir: Optional[Path] = None,
+                   order_df: Optional['pd.DataFrame'] = None) -> Dict[str, Any]:
+    """
+    Reconcile one order file against a shared index and write the result,
+    either in place or into output_dir under the same name. order_df is the
+    already parsed order file, if it was read ahead.
+    """
+    from reconciler import Reconciler
+    from utils import read_file_with_appropriate_method, write_result_file
+    if order_df is None:
+        order_df = read_file_with_appropriate_method(str(order_file))
+    counts = Reconciler.from_index(payment_index).fill(order_df)
+    output_path = output_dir / order_file.name if output_dir else order_file
+    write_result_file(order_df, output_path)
+    return {'output': str(output_path), 'counts': counts}
+
+
+def run_batch(order_files: List[Path], payment_files: List[Path], output_dir: Optional[Path] = None,
+              chunksize: int = PAYMENT_CHUNK_ROWS, workers: int = 1, cache: Any = None,
+              io_threads: int = DEFAULT_IO_THREADS) -> List[Dict[str, Any]]:
+    """
+    Reconcile every order file against all payment statements. Each file's
+    outcome is recorded; a file that fails does not stop the others.
+    With workers other than 1, files are reconciled in separate processes.
+    Otherwise up to io_threads order files are read ahead in threads,
+    starting while the payment statements are still being indexed.
+    """
+    from utils import read_file_with_appropriate_method
+    if output_dir:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    
+    if workers != 1:
+        shared = build_shared_payment_index(payment_files, chunksize, cache, io_threads)
+        for payment_file, error in shared['failed'].items():
+            print(f"Error loading payment file {payment_file}: {error}")
+        from parallel import reconcile_files_parallel
+        results = reconcile_files_parallel(order_files, shared['index'], output_dir, workers)
+        for result in results:
+            print_result(result)
+        return results
+    
+    results = []
+    with ThreadPoolExecutor(max_workers=max(io_threads, 1)) as executor:
+        # A bounded window of parsed order files, so memory stays at io_threads files
+        reads: Deque[Tuple[Path, Future]] = deque()
+        upcoming = iter(order_files)
+        
+        def read_ahead() -> None:
+            while len(reads) < max(io_threads, 1):
+                order_file = next(upcoming, None)
+                if order_file is None:
+                    return
+                reads.append((order_file, executor.submit(read_file_with_appropriate_method, str(order_file))))
+        
+        read_ahead()
+        shared = build_shared_payment_index(payment_files, chunksize, cache, io_threads)
+        for payment_file, error in shared['failed'].items():
+            print(f"Error loading payment file {payment_file}: {error}")
+        
+        while reads:
+            order_file, order_read = reads.popleft()
+            read_ahead()
+            try:
+                result = reconcile_file(order_file, shared['index'], output_dir, order_df=order_read.result())
+                result.update(file=str(order_file), status='ok')
+            except Exception as e:
+                result = {'file': str(order_file), 'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    if result['status'] == 'ok':
+        counts = result['counts']
+        print(f"[ok]    {result['file']} -> {result['output']}: matched {counts['matched']}, zero amount {counts['zero']}, "
+              f"unmatched {counts['unmatched']}, skipped {counts['skipped']}")
+    else:
+        print(f"[error] {result['file']}: {result['error']}")
+
+
+def main_batch(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='cli.py batch',
+                                     description='Reconcile many order files against many payment statements in one run.')
+    parser.add_argument('--orders', nargs='+', required=True, help='Order files, glob patterns or directories')
+    parser.add_argument('--payments', nargs='+', required=True, help='Payment/refund files, glob patterns or directories')
+    parser.add_argument('--output-dir', type=str, default=None, help='Directory for results (default: modify order files in place)')
+    parser.add_argument('--chunksize', type=int, default=PAYMENT_CHUNK_ROWS,
+                        help=f'Rows of each payment CSV read at a time (default: {PAYMENT_CHUNK_ROWS})')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes reconciling files concurrently; 0 uses every CPU core (default: 1)')
+    parser.add_argument('--io-threads', type=int, default=DEFAULT_IO_THREADS,
+                        help=f'Files read concurrently, payment statements and read-ahead order files (default: {DEFAULT_IO_THREADS})')
+    add_cache_arguments(parser)
+    add_logging_arguments(parser, match_log=False)
+    add_backend_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+    apply_backend_args(args)
+    
+    order_files = collect_files(args.orders)
+    payment_files = collect_files(args.payments)
+    if not order_files:
+        print("Error: No order files found.")
+        return
+    if not payment_files:
+        print("Error: No payment files found.")
+        return
+    
+    print(f"Batch: {len(order_files)} order file(s) against {len(payment_files)} payment file(s)")
+    results = run_batch(order_files, payment_files, Path(args.output_dir) if args.output_dir else None,
+                        args.chunksize, args.workers, cache_from_args(args), args.io_threads)
+    failed = sum(1 for result in results if result['status'] != 'ok')
+    print(f"Batch completed: {len(results) - failed} succeeded, {failed} failed")
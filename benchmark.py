@@ -0,0 +1,259 @@
+"""
+Benchmark harness for the Excel Merge Tool.
+Generates synthetic order/payment pairs with generate_large_data, then times
+the read, match and write stages of each matching engine plus an end-to-end
+process_excel_files + write_result_file run. Every measurement runs in a
+fresh process so peak memory is not inherited from earlier sizes. Results are
+printed as a table and appended as JSON lines for comparison across commits.
+With --startup, it instead guards the start-up latency of cli.py and its subcommands for --help
+and argument errors, and exits with status 1 when it exceeds the budget.
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from generate_large_data import generate_pair, write_alipay_csv, write_orders
+from utils import (process_excel_files, read_file_with_appropriate_method, load_payment_index, fill_fees_from_index,
+                   match_orders_vectorized, write_result_file, MATCH_ENGINES)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# cli.py command lines that must return without loading the heavy modules below
+STARTUP_CASES = {
+    'help': ['--help'],
+    'missing_file': ['missing_order.csv', 'missing_payment.csv'],
+    'bad_argument': ['order.csv', 'payment.csv', '--engine', 'unknown'],
+    'batch_help': ['batch', '--help'],
+    'batch_bad_argument': ['batch', '--orders', 'order.csv'],
+    'serve_help': ['serve', '--help'],
+    'serve_bad_argument': ['serve', '--port', 'unknown'],
+    'history_help': ['history', '--help'],
+    'history_bad_argument': ['history', 'unknown'],
+    'watch_help': ['watch', '--help'],
+    'watch_bad_argument': ['watch', '--settle', 'unknown'],
+}
+HEAVY_MODULES = {'pandas', 'numpy', 'openpyxl', 'xlrd', 'python_calamine', 'xlsxwriter'}
+# Allowed start-up time on top of a bare interpreter
+DEFAULT_STARTUP_BUDGET_MS = 150
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of this process in MB, where the platform reports it
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _timed(stages: Dict[str, Dict[str, float]], name: str, rows: int, trace: bool, func: Callable, *args: Any) -> Any:
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    value = func(*args)
+    seconds = time.perf_counter() - start
+    stage = {'seconds': round(seconds, 4), 'rows_per_second': round(rows / seconds) if seconds else None}
+    if trace:
+        stage['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1)
+        tracemalloc.stop()
+    stages[name] = stage
+    return value
+
+
+def run_case(order_file: str, payment_file: str, rows: int, engine: str, chunksize: int, trace: bool) -> Dict[str, Any]:
+    """
+    Time one engine on one order/payment pair; meant to run in its own process
+    """
+    stages: Dict[str, Dict[str, float]] = {}
+    output_dir = Path(tempfile.mkdtemp(prefix='excel-merge-bench-'))
+    output_file = output_dir / f"result{Path(order_file).suffix}"
+
+    order_df = _timed(stages, 'read_orders', rows, trace, read_file_with_appropriate_method, order_file)
+    if engine == 'vectorized':
+        payment_df = _timed(stages, 'read_payments', rows, trace, read_file_with_appropriate_method, payment_file)
+        _timed(stages, 'match', rows, trace, match_orders_vectorized, order_df, payment_df)
+    else:
+        payment_index = _timed(stages, 'read_payments', rows, trace, load_payment_index, payment_file, chunksize)
+        _timed(stages, 'match', rows, trace, fill_fees_from_index, order_df, payment_index)
+    _timed(stages, 'write', rows, trace, write_result_file, order_df, output_file)
+
+    def end_to_end() -> None:
+        write_result_file(process_excel_files(order_file, payment_file, engine=engine, chunksize=chunksize), output_file)
+    _timed(stages, 'end_to_end', rows, trace, end_to_end)
+
+    output_file.unlink()
+    output_dir.rmdir()
+    return {'stages': stages, 'peak_rss_mb': peak_rss_mb()}
+
+
+def _run_case_in_child(queue: multiprocessing.Queue, *args: Any) -> None:
+    try:
+        queue.put(run_case(*args))
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+
+
+def run_isolated(*args: Any) -> Dict[str, Any]:
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_case_in_child, args=(queue, *args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def _median_ms(command: List[str], repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1000, 1)
+
+
+def measure_startup(repeats: int) -> Dict[str, Any]:
+    """
+    Median wall time of a bare interpreter and of cli.py for each of
+    STARTUP_CASES, each run in a fresh process, plus the HEAVY_MODULES every
+    case imported according to python -X importtime
+    """
+    cli = str(Path(__file__).parent / 'cli.py')
+    result: Dict[str, Any] = {'interpreter_ms': _median_ms([sys.executable, '-c', 'pass'], repeats), 'cases': {}}
+    for name, argv in STARTUP_CASES.items():
+        trace = subprocess.run([sys.executable, '-X', 'importtime', cli, *argv], capture_output=True, text=True).stderr
+        imported = {line.rsplit('|', 1)[1].strip() for line in trace.splitlines() if line.startswith('import time:')}
+        result['cases'][name] = {'median_ms': _median_ms([sys.executable, cli, *argv], repeats),
+                                 'heavy_imports': sorted(imported & HEAVY_MODULES)}
+    return result
+
+
+def check_startup(result: Dict[str, Any], budget_ms: float) -> List[str]:
+    """
+    Printable failures: cases over budget_ms beyond the bare interpreter, or loading a heavy module
+    """
+    failures = []
+    for name, case in result['cases'].items():
+        overhead = case['median_ms'] - result['interpreter_ms']
+        print(f"{name:<20} {case['median_ms']:>7.1f} ms  (+{overhead:.1f} ms over the interpreter)"
+              + (f"  imports {', '.join(case['heavy_imports'])}" if case['heavy_imports'] else ""))
+        if overhead > budget_ms:
+            failures.append(f"{name}: {overhead:.1f} ms over the interpreter, budget {budget_ms} ms")
+        if case['heavy_imports']:
+            failures.append(f"{name}: imports {', '.join(case['heavy_imports'])}")
+    return failures
+
+
+def prepare_data(rows: int, data_dir: Path, order_format: str, seed: int) -> Tuple[str, str, Dict[str, int]]:
+    order_file = data_dir / f"order_synthetic_{rows}.{order_format}"
+    payment_file = data_dir / f"payment_synthetic_{rows}.csv"
+    orders, payments, counts = generate_pair(rows, seed)
+    write_orders(orders, order_file)
+    write_alipay_csv(payments, payment_file)
+    return str(order_file), str(payment_file), counts
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    header = f"{result['rows']:>9} rows  {result['engine']:<10}"
+    if 'error' in result:
+        print(f"{header}  ERROR {result['error']}")
+        return
+    stages = "  ".join(f"{name} {stage['seconds']:.3f}s" for name, stage in result['stages'].items())
+    rss = f"  peak RSS {result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else ""
+    print(f"{header}  {stages}{rss}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark read, match and write throughput on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help=f'Order row counts to benchmark (default: {" ".join(map(str, DEFAULT_SIZES))})')
+    parser.add_argument('--engines', nargs='+', choices=MATCH_ENGINES, default=list(MATCH_ENGINES),
+                        help='Matching engines to benchmark (default: all)')
+    parser.add_argument('--order-format', choices=['csv', 'xlsx'], default='csv', help='Order file format (default: csv)')
+    parser.add_argument('--chunksize', type=int, default=100_000, help='Payment rows per chunk for the row engine')
+    parser.add_argument('--data-dir', type=str, default=None,
+                        help='Keep the generated files here instead of a temporary directory')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data (default: 0)')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='Also record the traced Python allocation peak per stage (slows every stage down)')
+    parser.add_argument('--results', type=str, default='benchmark_results.jsonl',
+                        help='JSON lines file the results are appended to (default: benchmark_results.jsonl)')
+    parser.add_argument('--startup', action='store_true',
+                        help='Only measure cli.py start-up for --help and argument errors, failing over the budget')
+    parser.add_argument('--startup-budget-ms', type=float, default=DEFAULT_STARTUP_BUDGET_MS,
+                        help=f'Start-up time allowed on top of a bare interpreter (default: {DEFAULT_STARTUP_BUDGET_MS})')
+    parser.add_argument('--repeats', type=int, default=7, help='Runs per start-up case, the median is kept (default: 7)')
+    args = parser.parse_args()
+
+    if args.startup:
+        result = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': _git_revision(),
+                  'python': platform.python_version(), 'benchmark': 'startup', **measure_startup(args.repeats)}
+        failures = check_startup(result, args.startup_budget_ms)
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+        print(f"Results appended to {args.results}")
+        if failures:
+            print("Start-up check failed:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        return
+
+    temp_dir = None if args.data_dir else tempfile.TemporaryDirectory(prefix='excel-merge-data-')
+    data_dir = Path(args.data_dir or temp_dir.name)
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    run_info = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'order_format': args.order_format,
+        'chunksize': args.chunksize,
+    }
+    results: List[Dict[str, Any]] = []
+    try:
+        for rows in args.sizes:
+            order_file, payment_file, counts = prepare_data(rows, data_dir, args.order_format, args.seed)
+            for engine in args.engines:
+                result = {**run_info, 'rows': rows, 'engine': engine, 'cases': counts}
+                result.update(run_isolated(order_file, payment_file, rows, engine, args.chunksize, args.tracemalloc))
+                print_result(result)
+                results.append(result)
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    with open(args.results, 'a', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Persistent cache of parsed payment files for the Excel Merge Tool.
+Entries are keyed by the file's content hash; the path, size and mtime are
+remembered so an unchanged file is recognised without re-hashing it. The
+cache is capped in size and evicts the least recently used entries first.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from constants import PAYMENT_CHUNK_ROWS
+
+# utils (and with it pandas) is imported by the functions that parse files, so add_cache_arguments() stays cheap
+if TYPE_CHECKING:
+    import pandas as pd
+    from utils import PaymentIndex
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when the layout of cached objects changes so old entries are ignored
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = Path.home() / '.cache' / 'excel-merge'
+DEFAULT_CACHE_BYTES = 1024 ** 3
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed DataFrames and built payment indexes, stored as
+    pickles under cache_dir with a JSON manifest. Safe to share between the
+    threads of one run; the manifest is only touched under a lock.
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.cache_dir = Path(cache_dir or os.environ.get('EXCEL_MERGE_CACHE_DIR', DEFAULT_CACHE_DIR))
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.cache_dir / 'manifest.json'
+        self.manifest = self._load_manifest()
+        self.lock = threading.RLock()
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == CACHE_VERSION:
+                return manifest
+        except (OSError, ValueError):
+            pass
+        return {'version': CACHE_VERSION, 'files': {}, 'entries': {}}
+
+    def _save_manifest(self) -> None:
+        fd, temp_path = tempfile.mkstemp(suffix='.json', dir=self.cache_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(temp_path, self.manifest_path)
+
+    def content_hash(self, file_path: str) -> str:
+        """
+        Hash of the file's bytes; reused without reading the file while its
+        path, size and mtime are unchanged
+        """
+        path = str(Path(file_path).resolve())
+        stat = os.stat(path)
+        with self.lock:
+            known = self.manifest['files'].get(path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['hash']
+
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+        with self.lock:
+            self.manifest['files'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': content_hash}
+        return content_hash
+
+    def _entry_key(self, file_path: str, kind: str) -> str:
+        return f"{kind}-{self.content_hash(file_path)}"
+
+    def load(self, file_path: str, kind: str) -> Optional[Any]:
+        """
+        Return the cached object of the given kind for file_path, or None
+        """
+        key = self._entry_key(file_path, kind)
+        with self.lock:
+            entry = self.manifest['entries'].get(key)
+        if entry is None:
+            return None
+        try:
+            with open(self.cache_dir / entry['name'], 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logger.warning("Dropping unreadable cache entry for %s (%s)", file_path, e)
+            with self.lock:
+                if key in self.manifest['entries']:
+                    self._remove(key)
+                self._save_manifest()
+            return None
+        with self.lock:
+            entry['last_used'] = time.time()
+            self._save_manifest()
+        logger.info("Cache hit for %s (%s)", file_path, kind)
+        return value
+
+    def store(self, file_path: str, kind: str, value: Any) -> None:
+        """
+        Save an object for file_path, then evict least recently used entries
+        until the cache fits in max_bytes
+        """
+        key = self._entry_key(file_path, kind)
+        name = f"{key}.pkl"
+        fd, temp_path = tempfile.mkstemp(suffix='.pkl', dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.cache_dir / name)
+        with self.lock:
+            self.manifest['entries'][key] = {
+                'name': name,
+                'file': str(Path(file_path).resolve()),
+                'bytes': (self.cache_dir / name).stat().st_size,
+                'last_used': time.time(),
+            }
+            self._evict()
+            self._save_manifest()
+
+    def _remove(self, key: str) -> None:
+        entry = self.manifest['entries'].pop(key)
+        # The remembered size, mtime and hash of a file go with its last entry
+        if not any(other['file'] == entry['file'] for other in self.manifest['entries'].values()):
+            self.manifest['files'].pop(entry['file'], None)
+        try:
+            os.remove(self.cache_dir / entry['name'])
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        entries = self.manifest['entries']
+        total = sum(entry['bytes'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= entries[key]['bytes']
+            logger.info("Evicting cache entry for %s", entries[key]['file'])
+            self._remove(key)
+
+
+def cached_payment_index(payment_file: str, cache: ParseCache, chunksize: int = PAYMENT_CHUNK_ROWS) -> 'PaymentIndex':
+    """
+    PaymentIndex for payment_file, built and cached on the first run
+    """
+    from utils import load_payment_index
+    payment_index = cache.load(payment_file, 'index')
+    if payment_index is None:
+        payment_index = load_payment_index(payment_file, chunksize)
+        cache.store(payment_file, 'index', payment_index)
+    return payment_index
+
+
+def cached_read(file_path: str, cache: ParseCache) -> 'pd.DataFrame':
+    """
+    read_file_with_appropriate_method, served from the cache when the file is unchanged
+    """
+    from utils import read_file_with_appropriate_method
+    df = cache.load(file_path, 'frame')
+    if df is None:
+        df = read_file_with_appropriate_method(file_path)
+        cache.store(file_path, 'frame', df)
+    return df
+
+
+def cached_payment_frame(payment_file: str, cache: ParseCache) -> 'pd.DataFrame':
+    """
+    read_payment_frame, served from the cache when the file is unchanged
+    """
+    from utils import read_payment_frame
+    df = cache.load(payment_file, 'payment-frame')
+    if df is None:
+        df = read_payment_frame(payment_file)
+        cache.store(payment_file, 'payment-frame', df)
+    return df
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--cache', action='store_true',
+                        help='Reuse parsed payment files across runs while their content is unchanged')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help=f'Cache directory (default: $EXCEL_MERGE_CACHE_DIR or {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-size-mb', type=int, default=DEFAULT_CACHE_BYTES // 1024 ** 2,
+                        help=f'Cache size limit before least recently used entries are evicted (default: {DEFAULT_CACHE_BYTES // 1024 ** 2})')
+
+
+def cache_from_args(args: argparse.Namespace) -> Optional[ParseCache]:
+    if not args.cache:
+        return None
+    return ParseCache(args.cache_dir, args.cache_size_mb * 1024 ** 2)
@@ -0,0 +1,134 @@
+"""
+Checkpointed matching for the Excel Merge Tool.
+Long runs match the order table in chunks and append the results of each
+chunk to a checkpoint file (<order_file>.merge-checkpoint.pkl by default).
+A run started with --resume reads them back and continues after the last
+saved row, provided the order and payment files are unchanged. The
+checkpoint is removed once the result has been written.
+"""
+
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+from constants import DEFAULT_CHECKPOINT_ROWS
+from utils import OrderMatches, apply_order_matches, column_values, concat_order_matches, report_order_match
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the checkpoint file changes so old checkpoints are ignored
+CHECKPOINT_VERSION = 1
+
+
+def default_checkpoint_file(order_file: str) -> Path:
+    return Path(f"{order_file}.merge-checkpoint.pkl")
+
+
+def _file_signature(file_path: str) -> Tuple[str, int, int]:
+    stat = os.stat(file_path)
+    return str(Path(file_path).resolve()), stat.st_size, stat.st_mtime_ns
+
+
+class Checkpoint:
+    """
+    Progress of matching one order file against one payment file. The file
+    holds a header naming both inputs followed by one pickled OrderMatches
+    per chunk, each written to disk before the next chunk starts, so an
+    interruption loses at most the chunk in progress.
+    """
+
+    def __init__(self, path: Path, order_file: str, payment_file: str, chunk_rows: int = DEFAULT_CHECKPOINT_ROWS,
+                 resume: bool = False):
+        if chunk_rows < 1:
+            raise ValueError("Checkpoint chunks need at least one row")
+        self.path = Path(path)
+        self.chunk_rows = chunk_rows
+        self.resume = resume
+        self.header = {'version': CHECKPOINT_VERSION, 'order_file': _file_signature(order_file),
+                       'payment_file': _file_signature(payment_file)}
+        self.resumed_rows = 0
+
+    def _load(self) -> List[OrderMatches]:
+        """
+        The chunks saved by an earlier run over the same, unchanged files; a
+        chunk cut short by the interruption is dropped
+        """
+        chunks: List[OrderMatches] = []
+        try:
+            with open(self.path, 'rb') as f:
+                if pickle.load(f) != self.header:
+                    logger.warning("Checkpoint %s was made for other or changed input files, starting over", self.path)
+                    return []
+                while True:
+                    chunks.append(pickle.load(f))
+        except FileNotFoundError:
+            logger.info("No checkpoint at %s, starting from the first row", self.path)
+        except EOFError:
+            pass
+        except (OSError, pickle.UnpicklingError, AttributeError, ValueError) as e:
+            logger.warning("Checkpoint %s is damaged after %d chunks (%s), resuming from there", self.path,
+                           len(chunks), e)
+        return chunks
+
+    def _start(self, chunks: List[OrderMatches]) -> None:
+        # Rewritten as a whole so a damaged tail from the interrupted run is not appended to
+        fd, temp_path = tempfile.mkstemp(suffix='.pkl', dir=self.path.parent)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(self.header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            for chunk in chunks:
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+    def fill(self, reconciler: Any, order_df: pd.DataFrame, match_log: Any = None) -> Dict[str, int]:
+        """
+        reconciler.fill(order_df) in chunks of chunk_rows, saving the results
+        of each chunk; when resuming, rows covered by the checkpoint are not
+        matched again (their match log records are written from it).
+        """
+        chunks = self._load() if self.resume else []
+        done = sum(len(chunk.outcomes) for chunk in chunks)
+        if done > len(order_df):
+            logger.warning("Checkpoint %s covers more rows than the order file has, starting over", self.path)
+            chunks, done = [], 0
+        self.resumed_rows = done
+        if done:
+            logger.info("Resuming after row %d of %d from %s", done, len(order_df), self.path)
+            if match_log is not None:
+                self._report(order_df.iloc[:done], concat_order_matches(chunks), match_log)
+        self._start(chunks)
+
+        # Worker processes and payment keys are set up once, not for every chunk
+        with open(self.path, 'ab') as f, reconciler.worker_pool():
+            for start in range(done, len(order_df), self.chunk_rows):
+                matches = reconciler.order_matches(order_df.iloc[start:start + self.chunk_rows], match_log)
+                pickle.dump(matches, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+                chunks.append(matches)
+                logger.info("Checkpoint: %d of %d order rows matched", start + len(matches.outcomes), len(order_df))
+
+        matches = concat_order_matches(chunks)
+        apply_order_matches(order_df, matches)
+        return matches.counts
+
+    @staticmethod
+    def _report(order_df: pd.DataFrame, matches: OrderMatches, match_log: Any) -> None:
+        rows = zip(order_df.index, column_values(order_df, '订单号', default=''), column_values(order_df, '外部订单号'),
+                   column_values(order_df, '订单金额', default=0))
+        for pos, (idx, order_no, external_order_no, amount) in enumerate(rows):
+            report_order_match(match_log, idx, order_no, external_order_no, amount, matches.result(pos))
+
+    def remove(self) -> None:
+        """
+        Delete the checkpoint, once the result it led to has been written
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -1,18 +1,78 @@
-import pandas as pd
-import os
-import re
 from pathlib import Path
 import argparse
-from utils import process_excel_files, read_file_with_appropriate_method, find_file_path, write_result_file
+import sys
+# Only light modules are imported here; pandas and the matching code load once the arguments have been validated
+from backends import add_backend_arguments, apply_backend_args, detect_format, TABLE_FORMATS
+from cache import add_cache_arguments, cache_from_args
+from constants import DEFAULT_CHECKPOINT_ROWS, MATCH_ENGINES, MATCH_OUTCOMES, ORDER_COLUMNS, PAYMENT_CHUNK_ROWS
+from matchlog import add_logging_arguments, configure_logging, match_log_from_args, MATCH_LOG_FORMATS
+from profiling import RunProfiler, profile_stage
 
 
 def main_cli():
+    # 'batch' subcommand: many order files against many payment statements
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        from batch import main_batch
+        main_batch(sys.argv[2:])
+        return
+    # 'serve' subcommand: long-running service with payment indexes kept in memory
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        from service import main_serve
+        main_serve(sys.argv[2:])
+        return
+    # 'history' subcommand: persistent SQLite payment history
+    if len(sys.argv) > 1 and sys.argv[1] == 'history':
+        from history import main_history
+        main_history(sys.argv[2:])
+        return
+    # 'watch' subcommand: reconcile order files as they land in a directory
+    if len(sys.argv) > 1 and sys.argv[1] == 'watch':
+        from watch import main_watch
+        main_watch(sys.argv[2:])
+        return
+    
     parser = argparse.ArgumentParser(description='Merge two Excel files based on specific matching logic.')
     parser.add_argument('order_file', type=str, help='Path to the first Excel file (order data)')
     parser.add_argument('payment_file', type=str, help='Path to the second Excel file (payment/refund data)')
-    parser.add_argument('-o', '--output', type=str, default=None, help='Output filename (default: modify original file)')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Output filename; .parquet, .arrow and .sqlite write a columnar table (default: modify original file)')
+    parser.add_argument('--delta', type=str, default=None, metavar='FILE',
+                        help='Also write just the rows whose 支付手续费 changed to FILE (.csv, .xlsx, .parquet, .arrow or .sqlite)')
+    parser.add_argument('--engine', choices=MATCH_ENGINES, default='row',
+                        help="Matching engine: 'row' processes orders one by one, 'vectorized' matches all orders in bulk (default: row)")
+    parser.add_argument('--chunksize', type=int, default=PAYMENT_CHUNK_ROWS,
+                        help=f'Rows of the payment CSV read at a time by the row engine (default: {PAYMENT_CHUNK_ROWS})')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes matching row ranges of the order file with the row engine; 0 uses every CPU core (default: 1)')
+    add_cache_arguments(parser)
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only match order rows that are new or changed since the last run, and only index appended payment rows')
+    parser.add_argument('--state-file', type=str, default=None,
+                        help='State file for --incremental (default: <order_file>.merge-state.pkl)')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='Match in chunks and save progress after each one, so an interrupted run can be resumed')
+    parser.add_argument('--checkpoint-rows', type=int, default=None,
+                        help=f'Order rows matched between checkpoints (default: {DEFAULT_CHECKPOINT_ROWS})')
+    parser.add_argument('--checkpoint-file', type=str, default=None,
+                        help='Checkpoint file (default: <order_file>.merge-checkpoint.pkl)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted --checkpoint run after the last saved row (implies --checkpoint)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream an .xlsx order file row by row instead of loading it whole (for very large workbooks)')
+    parser.add_argument('--sheets', nargs='*', default=None, metavar='SHEET',
+                        help='Reconcile every sheet of the order workbook, or only the named ones, in one run (default: first sheet only)')
+    parser.add_argument('--update-cells', action='store_true',
+                        help='Only rewrite changed 支付手续费 cells of an .xlsx order file, keeping formatting and other sheets')
+    parser.add_argument('--profile', type=str, default=None, metavar='REPORT.json',
+                        help='Write wall time, CPU time, peak memory, row counts and match methods per stage to a JSON report')
+    parser.add_argument('--cprofile', type=str, default=None, metavar='FILE.prof',
+                        help='With --profile, also dump cProfile statistics of the matching stage to this file')
+    add_logging_arguments(parser)
+    add_backend_arguments(parser)
     
     args = parser.parse_args()
+    configure_logging(args.verbose, args.quiet)
+    apply_backend_args(args)
     
     # Check if files exist
     if not Path(args.order_file).exists():
@@ -23,26 +83,170 @@ def main_cli():
         print(f"Error: File '{args.payment_file}' does not exist.")
         return
     
+    if args.stream and Path(args.order_file).suffix.lower() != '.xlsx':
+        print("Error: --stream only supports .xlsx order files.")
+        return
+    
+    if args.update_cells and Path(args.order_file).suffix.lower() != '.xlsx':
+        print("Error: --update-cells only supports .xlsx order files.")
+        return
+    
+    if args.stream:
+        # The streaming path matches row by row in this process and rewrites the whole workbook
+        incompatible = [flag for flag, used in (('--engine vectorized', args.engine != 'row'),
+                                                ('--workers', args.workers != 1),
+                                                ('--incremental', args.incremental),
+                                                ('--update-cells', args.update_cells),
+                                                ('--delta', bool(args.delta))) if used]
+        if incompatible:
+            print(f"Error: --stream cannot be combined with {', '.join(incompatible)}.")
+            return
+    
+    if args.incremental:
+        # The incremental path keeps its own row-engine payment index in the state file
+        incompatible = [flag for flag, used in (('--engine vectorized', args.engine != 'row'),
+                                                ('--workers', args.workers != 1),
+                                                ('--cache', args.cache)) if used]
+        if incompatible:
+            print(f"Error: --incremental cannot be combined with {', '.join(incompatible)}.")
+            return
+    
+    if (args.checkpoint or args.resume) and (args.stream or args.incremental or args.sheets is not None):
+        print("Error: --checkpoint and --resume cannot be combined with --stream, --incremental or --sheets.")
+        return
+    
+    # Both would be written as the same file (or the same SQLite 'orders' table), the delta replacing the result
+    if args.delta and Path(args.delta).resolve() == Path(args.output or args.order_file).resolve():
+        print("Error: --delta must name a different file than the output.")
+        return
+    
+    if args.checkpoint_rows is not None and not (args.checkpoint or args.resume):
+        print("Error: --checkpoint-rows requires --checkpoint or --resume.")
+        return
+    
+    if args.checkpoint_rows is not None and args.checkpoint_rows < 1:
+        print("Error: --checkpoint-rows must be at least 1.")
+        return
+    
+    if args.sheets is not None:
+        if args.stream or args.incremental or args.delta:
+            print("Error: --sheets cannot be combined with --stream, --incremental or --delta.")
+            return
+        if detect_format(args.order_file) == 'csv':
+            print("Error: --sheets needs an order workbook, not a CSV file.")
+            return
+        if args.output and (Path(args.output).suffix.lower() == '.csv' or Path(args.output).suffix.lower() in TABLE_FORMATS):
+            print("Error: with --sheets the output file must be a workbook (.xlsx).")
+            return
+    
+    if args.cprofile and not args.profile:
+        print("Error: --cprofile requires --profile.")
+        return
+    
+    if args.match_log and Path(args.match_log).suffix.lower() not in MATCH_LOG_FORMATS:
+        print("Error: --match-log must be a .csv or .jsonl file.")
+        return
+    
+    from reconciler import Reconciler
+    from utils import (process_excel_files, process_order_sheets, write_result_file, write_result_sheets,
+                       stream_order_workbook, update_fee_column_in_place, update_fee_columns_in_place, FeeChanges)
+    
     print(f"Processing files:")
     print(f"  Order file: {args.order_file}")
     print(f"  Payment/Refund file: {args.payment_file}")
     
+    profiler = RunProfiler('match', args.cprofile) if args.profile else None
+    
+    match_log = match_log_from_args(args)
+    changes = FeeChanges() if args.delta else None
     try:
-        result_df = process_excel_files(args.order_file, args.payment_file, verbose=True)
-        
-        # If output is specified, save to that file; otherwise modify the original order file
-        if args.output:
-            output_path = Path(args.output)
-            write_result_file(result_df, output_path)
-            print(f"Result saved to: {args.output}")
+        cache = cache_from_args(args)
+        checkpoint = None
+        if args.checkpoint or args.resume:
+            from checkpoint import Checkpoint, default_checkpoint_file
+            checkpoint = Checkpoint(args.checkpoint_file or default_checkpoint_file(args.order_file), args.order_file,
+                                    args.payment_file, args.checkpoint_rows or DEFAULT_CHECKPOINT_ROWS, args.resume)
+        if args.stream:
+            output_path = Path(args.output) if args.output else Path(args.order_file)
+            with profile_stage(profiler, 'read_payments') as stage:
+                reconciler = Reconciler(args.payment_file, chunksize=args.chunksize, cache=cache)
+                stage['rows'] = reconciler.payment_rows
+            # Streaming reads, matches and writes the order workbook in one pass
+            with profile_stage(profiler, 'match') as stage:
+                counts = stream_order_workbook(args.order_file, reconciler.index, output_path, match_log)
+                stage.update(rows=sum(counts[outcome] for outcome in MATCH_OUTCOMES), counts=counts)
+            print(f"Matched: {counts['matched']}, zero amount: {counts['zero']}, "
+                  f"unmatched: {counts['unmatched']}, skipped: {counts['skipped']}")
+            print(f"Result saved to: {output_path}")
+        elif args.sheets is not None:
+            sheets = process_order_sheets(args.order_file, args.payment_file, args.sheets or None, engine=args.engine,
+                                          chunksize=args.chunksize, workers=args.workers, cache=cache,
+                                          profiler=profiler, match_log=match_log,
+                                          order_columns=ORDER_COLUMNS if args.update_cells else None)
+            output_path = Path(args.output) if args.output else Path(args.order_file)
+            # Every sheet goes back in a single workbook save
+            with profile_stage(profiler, 'write') as stage:
+                stage['rows'] = sum(len(sheet) for sheet in sheets.values())
+                if args.update_cells:
+                    changed = update_fee_columns_in_place(sheets, Path(args.order_file), output_path)
+                    print(f"Updated {changed} 支付手续费 cells in {len(sheets)} sheets of: {output_path}")
+                else:
+                    write_result_sheets(sheets, output_path)
+                    print(f"Result saved to: {output_path} ({len(sheets)} sheets)")
         else:
-            # Modify the original order file
-            original_file_path = Path(args.order_file)
-            write_result_file(result_df, original_file_path)
-            print(f"Original file updated: {args.order_file}")
+            if args.incremental:
+                from incremental import reconcile_incremental
+                with profile_stage(profiler, 'match') as stage:
+                    result_df, summary = reconcile_incremental(args.order_file, args.payment_file, args.state_file,
+                                                               args.chunksize, match_log, changes)
+                    stage.update(rows=summary['rows'], summary=summary)
+                print(f"Incremental run: {summary['rematched']} of {summary['rows']} order rows matched, "
+                      f"{summary['payment_rows_added']} payment rows indexed"
+                      + (" (payment index rebuilt)" if summary['payment_rebuilt'] else ""))
+            else:
+                result_df = process_excel_files(args.order_file, args.payment_file, engine=args.engine,
+                                                chunksize=args.chunksize, workers=args.workers, cache=cache,
+                                                profiler=profiler, match_log=match_log,
+                                                # --update-cells writes into the workbook itself, so only matching columns are read
+                                                order_columns=ORDER_COLUMNS if args.update_cells else None,
+                                                changes=changes, checkpoint=checkpoint)
+            
+            # If output is specified, save to that file; otherwise modify the original order file
+            with profile_stage(profiler, 'write') as stage:
+                stage['rows'] = len(result_df)
+                if args.update_cells:
+                    output_path = Path(args.output) if args.output else Path(args.order_file)
+                    changed = update_fee_column_in_place(result_df, Path(args.order_file), output_path)
+                    print(f"Updated {changed} 支付手续费 cells in: {output_path}")
+                elif args.output:
+                    output_path = Path(args.output)
+                    write_result_file(result_df, output_path)
+                    print(f"Result saved to: {args.output}")
+                else:
+                    # Modify the original order file
+                    original_file_path = Path(args.order_file)
+                    write_result_file(result_df, original_file_path)
+                    print(f"Original file updated: {args.order_file}")
+                if changes is not None:
+                    write_result_file(changes.frame(result_df), Path(args.delta))
+                    print(f"Changed rows written to: {args.delta} ({len(changes.positions)} rows)")
+            if checkpoint is not None:
+                # Only once the result is safely written is the progress no longer needed
+                checkpoint.remove()
+                if checkpoint.resumed_rows:
+                    print(f"Resumed after {checkpoint.resumed_rows} order rows from the checkpoint")
+        
+        if profiler is not None:
+            profiler.write_report(Path(args.profile), command=sys.argv[1:], order_file=args.order_file,
+                                  payment_file=args.payment_file, engine=args.engine, workers=args.workers)
+            print(f"Profile report written to: {args.profile}")
     
     except Exception as e:
         print(f"Error processing files: {e}")
+    finally:
+        if match_log is not None:
+            match_log.close()
+            print(f"Match log written to: {args.match_log} ({match_log.records} orders)")
 
 
 if __name__ == "__main__":
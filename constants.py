@@ -0,0 +1,17 @@
+"""
+Column names and defaults shared across the Excel Merge Tool.
+This module imports nothing heavy, so command-line parsing and validation
+can use it without loading pandas; utils re-exports the ones it uses.
+"""
+
+# Order and payment columns used for matching, and the fee column for each business type
+ORDER_COLUMNS = ['订单号', '外部订单号', '订单金额', '支付手续费']
+PAYMENT_COLUMNS = ['商户订单号', '商品名称', '业务类型', '支出金额（-元）', '收入金额（+元）']
+FEE_COLUMNS = {'收费': '支出金额（-元）', '退费': '收入金额（+元）'}
+PAYMENT_CHUNK_ROWS = 100_000
+# Order rows matched between two saves of a --checkpoint run
+DEFAULT_CHECKPOINT_ROWS = 100_000
+
+MATCH_OUTCOMES = ('matched', 'zero', 'unmatched', 'skipped')
+MATCH_METHODS = ('exact', 'p_number', 'hyphen')
+MATCH_ENGINES = ('row', 'vectorized')
@@ -1,8 +1,4 @@
-import pandas as pd
-import os
-import re
-from pathlib import Path
-from utils import process_excel_files, read_file_with_appropriate_method, find_file_path, write_result_file
+from matchlog import configure_logging
 
 
 def main():
@@ -13,6 +9,9 @@ def main():
     order_input = input("Enter the path/name of the first Excel file (order data): ").strip()
     payment_input = input("Enter the path/name of the second Excel file (payment/refund data): ").strip()
     
+    # pandas is loaded after the prompts, so they appear immediately
+    from utils import process_excel_files, find_file_path, write_result_file
+    
     # Try to find the files in common locations
     order_file_path = find_file_path(order_input)
     payment_file_path = find_file_path(payment_input)
@@ -30,8 +29,9 @@ def main():
     print(f"  Order file: {order_file_path}")
     print(f"  Payment/Refund file: {payment_file_path}")
     
+    configure_logging()
     try:
-        result_df = process_excel_files(str(order_file_path), str(payment_file_path), verbose=True)
+        result_df = process_excel_files(str(order_file_path), str(payment_file_path))
         
         # Modify the original order file instead of creating a new one
         write_result_file(result_df, order_file_path)
@@ -0,0 +1,171 @@
+"""
+Synthetic order/payment data for scale testing the Excel Merge Tool.
+Produces an order export and a matching Alipay-style payment statement of a
+configurable size, mixing every case the matcher handles: exact 订单号
+prefix matches, P-number and hyphen fallbacks, refunds, zero amounts and
+orders with no payment at all. The statement is written as GBK CSV with '#'
+comment header lines, like a real Alipay export.
+"""
+
+import argparse
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Scratch directory kept out of the repository's tracked sample data
+DEFAULT_OUTPUT_DIR = 'bench_data'
+
+
+# Share of orders per matching case
+DEFAULT_MIX = {'exact': 0.55, 'p_number': 0.15, 'hyphen': 0.10, 'zero': 0.05, 'unmatched': 0.15}
+MATCHED_KINDS = ('exact', 'p_number', 'hyphen')
+ALIPAY_COLUMNS = ['账务流水号', '业务流水号', '商户订单号', '商品名称', '发生时间', '对方账号', '收入金额（+元）',
+                  '支出金额（-元）', '账户余额（元）', '交易渠道', '业务类型', '签约产品', '费率', '代发上传文件名',
+                  '代发付款类型', '备注']
+ALIPAY_HEADER_LINES = [
+    '#支付宝账务明细查询',
+    '#账号：[20880000000000000156]',
+    '#起始日期：[2025年07月01日 00:00:00]   终止日期：[2025年08月01日 00:00:00]',
+    '#---------------------------------------------------------账务明细列表---------------------------------------------------------',
+]
+FEE_RATE = 0.006
+EXCEL_MAX_ROWS = 1048575
+
+
+def _digits(values: np.ndarray, width: int) -> np.ndarray:
+    return pd.Series(values).astype(str).str.zfill(width).to_numpy(dtype=object)
+
+
+def generate_pair(n_orders: int, seed: int = 0, mix: Optional[Dict[str, float]] = None, refund_ratio: float = 0.2,
+                  noise_ratio: float = 0.1) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, int]]:
+    """
+    Build an order DataFrame with n_orders rows and the payment statement it
+    reconciles against. Matched orders get one fee row each; noise_ratio adds
+    unrelated statement rows. Returns (orders, payments, orders per case).
+    """
+    mix = mix or DEFAULT_MIX
+    rng = np.random.default_rng(seed)
+    kinds = rng.choice(list(mix), size=n_orders, p=np.array(list(mix.values())) / sum(mix.values()))
+    sequence = np.arange(n_orders)
+
+    # 24-character order numbers; only the first 20 take part in matching
+    order_nos = '4025' + _digits(sequence, 16) + _digits(rng.integers(0, 10000, n_orders), 4)
+    external = 'P25' + _digits(sequence, 14)
+    external[kinds == 'hyphen'] = 'XS' + _digits(sequence[kinds == 'hyphen'], 12)
+    external[kinds == 'unmatched'] = 'P99' + _digits(sequence[kinds == 'unmatched'], 14)
+
+    amounts = np.round(rng.uniform(10, 5000, n_orders), 2)
+    is_refund = rng.random(n_orders) < refund_ratio
+    amounts[is_refund] *= -1
+    amounts[kinds == 'zero'] = 0.0
+
+    orders = pd.DataFrame({
+        '订单号': order_nos,
+        '外部订单号': external,
+        '订单金额': amounts,
+        '门店': rng.choice(['上海店', '北京店', '广州店', '成都店'], n_orders),
+        '下单时间': pd.Timestamp('2025-07-01') + pd.to_timedelta(rng.integers(0, 31 * 86400, n_orders), unit='s'),
+        '支付手续费': np.nan,
+    })
+
+    # One fee row per matched order; P-number and hyphen cases use unrelated 商户订单号
+    matched = np.isin(kinds, MATCHED_KINDS)
+    merchant_nos = '2025' + _digits(sequence[matched], 16)
+    exact = kinds[matched] == 'exact'
+    prefixes = np.array([order_no[:20] for order_no in order_nos[matched][exact]], dtype=object)
+    merchant_nos[exact] = prefixes + _digits(rng.integers(0, 10000, len(prefixes)), 4)
+    product_names = '吉祥旅游支付订单-' + external[matched] + '\t'
+    hyphen = kinds[matched] == 'hyphen'
+    product_names[hyphen] = '门店订单-' + external[matched][hyphen]
+
+    fees = np.round(np.abs(amounts[matched]) * FEE_RATE, 2)
+    refunds = amounts[matched] < 0
+    payments = pd.DataFrame({
+        '商户订单号': merchant_nos,
+        '商品名称': product_names,
+        '业务类型': np.where(refunds, '退费', '收费'),
+        '收入金额（+元）': np.where(refunds, fees, 0.0),
+        '支出金额（-元）': np.where(refunds, 0.0, -fees),
+    })
+
+    n_noise = int(n_orders * noise_ratio)
+    noise = pd.DataFrame({
+        '商户订单号': '2026' + _digits(np.arange(n_noise), 16),
+        '商品名称': '吉祥旅游支付订单-P26' + _digits(np.arange(n_noise), 14) + '\t',
+        '业务类型': rng.choice(['在线支付', '提现', '转账'], n_noise),
+        '收入金额（+元）': np.round(rng.uniform(10, 5000, n_noise), 2),
+        '支出金额（-元）': 0.0,
+    })
+    payments = pd.concat([payments, noise], ignore_index=True)
+    payments = payments.iloc[rng.permutation(len(payments))].reset_index(drop=True)
+
+    n = len(payments)
+    payments['账务流水号'] = '1470' + _digits(np.arange(n), 15) + '\t'
+    payments['业务流水号'] = '2025' + _digits(rng.integers(0, 10 ** 15, n), 24) + '\t'
+    payments['发生时间'] = (pd.Timestamp('2025-07-01') + pd.to_timedelta(np.sort(rng.integers(0, 31 * 86400, n)), unit='s')
+                        ).strftime('%Y-%m-%d %H:%M:%S')
+    payments['对方账号'] = '**庆(189****88)\t'
+    payments['账户余额（元）'] = np.round(rng.uniform(1e5, 5e6, n), 2)
+    payments['交易渠道'] = '支付宝'
+    for column in ('签约产品', '费率', '代发上传文件名', '代发付款类型', '备注'):
+        payments[column] = ''
+    payments = payments[ALIPAY_COLUMNS]
+
+    counts = {kind: int((kinds == kind).sum()) for kind in mix}
+    counts['refund'] = int((is_refund & (kinds != 'zero')).sum())
+    return orders, payments, counts
+
+
+def write_alipay_csv(payments: pd.DataFrame, file_path: Path) -> None:
+    """
+    Write a payment statement the way Alipay exports it: GBK, '#' comment lines, then the table
+    """
+    with open(file_path, 'w', encoding='gbk', newline='') as f:
+        f.write('\n'.join(ALIPAY_HEADER_LINES) + '\n')
+        payments.to_csv(f, index=False, float_format='%.2f')
+
+
+def write_orders(orders: pd.DataFrame, file_path: Path) -> None:
+    if file_path.suffix.lower() == '.xlsx':
+        if len(orders) > EXCEL_MAX_ROWS:
+            raise ValueError(f"{len(orders)} orders do not fit in one worksheet; use a .csv order file")
+        orders.to_excel(file_path, index=False)
+    else:
+        orders.to_csv(file_path, index=False, encoding='utf-8-sig')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Generate synthetic order/payment files for scale testing.')
+    parser.add_argument('--rows', type=int, default=10000, help='Number of order rows, e.g. 1000 to 5000000 (default: 10000)')
+    parser.add_argument('--output-dir', type=str, default=DEFAULT_OUTPUT_DIR,
+                        help=f'Where to write the files (default: {DEFAULT_OUTPUT_DIR}, which git ignores)')
+    parser.add_argument('--order-format', choices=['csv', 'xlsx'], default='csv', help='Order file format (default: csv)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--refund-ratio', type=float, default=0.2, help='Share of orders that are refunds (default: 0.2)')
+    parser.add_argument('--noise-ratio', type=float, default=0.1,
+                        help='Unrelated statement rows per order (default: 0.1)')
+    for kind, share in DEFAULT_MIX.items():
+        parser.add_argument(f"--{kind.replace('_', '-')}", type=float, default=share,
+                            help=f'Relative share of {kind} orders (default: {share})')
+    args = parser.parse_args()
+
+    mix = {kind: getattr(args, kind) for kind in DEFAULT_MIX}
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    order_file = output_dir / f"order_synthetic_{args.rows}.{args.order_format}"
+    payment_file = output_dir / f"payment_synthetic_{args.rows}.csv"
+
+    orders, payments, counts = generate_pair(args.rows, args.seed, mix, args.refund_ratio, args.noise_ratio)
+    write_orders(orders, order_file)
+    write_alipay_csv(payments, payment_file)
+
+    print(f"Order file:   {order_file} ({len(orders)} rows)")
+    print(f"Payment file: {payment_file} ({len(payments)} rows)")
+    print("Orders per case: " + ", ".join(f"{kind} {count}" for kind, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
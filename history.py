@@ -0,0 +1,295 @@
+"""
+Persistent payment history for the Excel Merge Tool.
+Payment statements are ingested once into a local SQLite database, keyed
+like PaymentIndex (20-character prefix of '商户订单号', P-number and the text
+after the last '-' in '商品名称', each with '业务类型'), and de-duplicated on
+'账务流水号'. Orders are then matched with indexed queries, so a year of
+statements can be searched while memory stays flat.
+"""
+
+import argparse
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+# pandas and the matching code load on first use, so 'cli.py history --help' stays fast
+from constants import FEE_COLUMNS, PAYMENT_CHUNK_ROWS, PAYMENT_COLUMNS
+from matchlog import add_logging_arguments, configure_logging, match_log_from_args, MATCH_LOG_FORMATS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_DB = 'payment_history.sqlite'
+SERIAL_COLUMN = '账务流水号'
+HISTORY_SCHEMA_VERSION = 2
+HASH_BLOCK_BYTES = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    ingested_at REAL NOT NULL,
+    rows INTEGER NOT NULL,
+    added INTEGER NOT NULL
+);
+-- seq is the ingestion order; seq - 1 is the payment row position and the earliest row wins.
+-- fee has no declared type so text amounts stay text; usable marks 收费/退费 rows with a fee
+-- (NaN is stored as NULL, so usable is what tells a NaN fee from a missing one).
+-- prefix is NULL for a blank 商户订单号; such rows can still match by P-number or hyphen suffix
+CREATE TABLE IF NOT EXISTS payments (
+    seq INTEGER PRIMARY KEY,
+    serial TEXT UNIQUE,
+    statement_id INTEGER NOT NULL REFERENCES statements(id),
+    prefix TEXT,
+    business_type TEXT,
+    p_number TEXT,
+    hyphen_suffix TEXT,
+    usable INTEGER NOT NULL,
+    fee
+);
+CREATE INDEX IF NOT EXISTS payments_by_prefix ON payments(prefix, business_type, usable, seq);
+CREATE INDEX IF NOT EXISTS payments_by_p_number ON payments(p_number, business_type, seq)
+    WHERE usable = 1 AND p_number IS NOT NULL;
+CREATE INDEX IF NOT EXISTS payments_by_hyphen_suffix ON payments(hyphen_suffix, business_type, seq)
+    WHERE usable = 1 AND hyphen_suffix IS NOT NULL;
+"""
+
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sql_value(value: Any) -> Any:
+    """
+    numpy scalars as built-in types; NaN becomes NULL as SQLite has no NaN
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _serial(value: Any) -> Optional[str]:
+    import pandas as pd
+    # Alipay pads identifiers with a tab; a blank serial cannot be de-duplicated on
+    if value is None or pd.isna(value):
+        return None
+    return str(value).strip() or None
+
+
+class PaymentHistory:
+    """
+    A SQLite store of ingested payment rows that answers lookup() like a
+    PaymentIndex, so match_order() and Reconciler work on it unchanged.
+    fees only holds the fee of the row the last lookup() returned.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(str(self.db_path))
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == 1:
+            raise ValueError(f"{self.db_path} was written by a version that dropped payment rows with a blank "
+                             f"商户订单号; delete it and ingest the statements again")
+        if version not in (0, HISTORY_SCHEMA_VERSION):
+            raise ValueError(f"{self.db_path} has payment history version {version}, "
+                             f"expected {HISTORY_SCHEMA_VERSION}")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f'PRAGMA user_version={HISTORY_SCHEMA_VERSION}')
+        self.fees: Dict[int, Any] = {}
+
+    @property
+    def row_count(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM payments').fetchone()[0]
+
+    def ingest(self, payment_file: str, chunksize: int = PAYMENT_CHUNK_ROWS) -> Dict[str, Any]:
+        """
+        Add a statement's rows, skipping rows whose 账务流水号 is already
+        stored. A file whose content was ingested before is skipped whole.
+        Returns the statement's row count and how many rows were added.
+        """
+        from utils import iter_payment_chunks
+        content_hash = _file_hash(payment_file)
+        known = self.connection.execute('SELECT rows FROM statements WHERE content_hash = ?', (content_hash,)).fetchone()
+        if known is not None:
+            return {'file': payment_file, 'rows': known[0], 'added': 0, 'skipped': True}
+
+        rows = added = 0
+        with self.connection:
+            statement_id = self.connection.execute(
+                'INSERT INTO statements (path, content_hash, ingested_at, rows, added) VALUES (?, ?, ?, 0, 0)',
+                (str(Path(payment_file).resolve()), content_hash, time.time())).lastrowid
+            for chunk in iter_payment_chunks(payment_file, chunksize, PAYMENT_COLUMNS + [SERIAL_COLUMN]):
+                before = self.connection.total_changes
+                self.connection.executemany(
+                    'INSERT INTO payments (serial, statement_id, prefix, business_type, p_number, '
+                    'hyphen_suffix, usable, fee) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(serial) DO NOTHING',
+                    self._payment_rows(chunk, statement_id))
+                added += self.connection.total_changes - before
+                rows += len(chunk)
+            self.connection.execute('UPDATE statements SET rows = ?, added = ? WHERE id = ?', (rows, added, statement_id))
+        return {'file': payment_file, 'rows': rows, 'added': added, 'skipped': False}
+
+    @staticmethod
+    def _payment_rows(chunk: 'pd.DataFrame', statement_id: int) -> Iterator[Tuple[Any, ...]]:
+        import pandas as pd
+        from utils import column_values, extract_p_number, hyphen_suffix, require_payment_column
+        # Same keys and fee rule as PaymentIndex.add
+        require_payment_column(chunk)
+        prefixes = chunk['商户订单号'].astype(str).str[:20]
+        business_types = column_values(chunk, '业务类型', default='')
+        product_names = column_values(chunk, '商品名称')
+        serials = column_values(chunk, SERIAL_COLUMN)
+        fee_values = {business_type: column_values(chunk, column) for business_type, column in FEE_COLUMNS.items()}
+        for offset, (prefix, business_type, product_name) in enumerate(zip(prefixes, business_types, product_names)):
+            # A blank 商户订单号 stays NaN on pandas 3, a key no order number equals in PaymentIndex either
+            prefix = None if pd.isna(prefix) else prefix
+            fee = fee_values[business_type][offset] if business_type in FEE_COLUMNS else None
+            if fee is None:
+                yield _serial(serials[offset]), statement_id, prefix, _sql_value(business_type), None, None, 0, None
+            else:
+                yield (_serial(serials[offset]), statement_id, prefix, business_type, extract_p_number(product_name),
+                       hyphen_suffix(product_name), 1, _sql_value(fee))
+
+    def _first(self, sql: str, parameters: Tuple[Any, ...]) -> Optional[Tuple[int, Any]]:
+        row = self.connection.execute(sql, parameters).fetchone()
+        if row is None:
+            return None
+        # Positions count from 0 like PaymentIndex's; usable rows stored with a NULL fee had a NaN fee
+        return row[0] - 1, float('nan') if row[1] is None else row[1]
+
+    def lookup(self, order_no: str, external_order_no: Any, business_type: str) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Same contract as PaymentIndex.lookup: exact prefix match first, then
+        the earliest P-number or hyphen-suffix match on '外部订单号'
+        """
+        import pandas as pd
+        from utils import extract_p_number
+        self.fees.clear()
+        exact = self._first('SELECT seq, fee FROM payments WHERE prefix = ? AND business_type = ? AND usable = 1 '
+                            'ORDER BY seq LIMIT 1', (order_no, business_type))
+        if exact is not None:
+            self.fees[exact[0]] = exact[1]
+            return 'exact', exact[0]
+        if self.connection.execute('SELECT 1 FROM payments WHERE prefix = ? LIMIT 1', (order_no,)).fetchone():
+            return None, None
+
+        candidates = []
+        external_p = extract_p_number(external_order_no)
+        if external_p is not None:
+            found = self._first('SELECT seq, fee FROM payments WHERE p_number = ? AND business_type = ? AND usable = 1 '
+                                'ORDER BY seq LIMIT 1', (external_p, business_type))
+            if found is not None:
+                candidates.append((found, 'p_number'))
+        if pd.notna(external_order_no):
+            found = self._first('SELECT seq, fee FROM payments WHERE hyphen_suffix = ? AND business_type = ? '
+                                'AND usable = 1 ORDER BY seq LIMIT 1', (str(external_order_no), business_type))
+            if found is not None:
+                candidates.append((found, 'hyphen'))
+        if not candidates:
+            return None, None
+        (pos, fee), method = min(candidates, key=lambda candidate: candidate[0][0])
+        self.fees[pos] = fee
+        return method, pos
+
+    def statements(self) -> List[Dict[str, Any]]:
+        cursor = self.connection.execute('SELECT path, ingested_at, rows, added FROM statements ORDER BY id')
+        return [{'path': path, 'ingested_at': ingested_at, 'rows': rows, 'added': added}
+                for path, ingested_at, rows, added in cursor]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'PaymentHistory':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def main_history(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='cli.py history',
+                                     description='Keep a persistent, de-duplicated payment history and match orders against it.')
+    parser.add_argument('--db', type=str, default=os.environ.get('EXCEL_MERGE_HISTORY_DB', DEFAULT_HISTORY_DB),
+                        help=f'History database (default: $EXCEL_MERGE_HISTORY_DB or {DEFAULT_HISTORY_DB})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help='Add payment statements to the history')
+    ingest.add_argument('payment_files', nargs='+', help='Payment/refund files, ingested in the order given')
+    ingest.add_argument('--chunksize', type=int, default=PAYMENT_CHUNK_ROWS,
+                        help=f'Rows of each payment CSV read at a time (default: {PAYMENT_CHUNK_ROWS})')
+    match = commands.add_parser('match', help='Fill 支付手续费 of an order file from the history')
+    match.add_argument('order_file', type=str, help='Path to the order file')
+    match.add_argument('-o', '--output', type=str, default=None, help='Output filename (default: modify original file)')
+    commands.add_parser('stats', help='List the ingested statements')
+    for command in (ingest, match):
+        add_logging_arguments(command, match_log=command is match)
+
+    args = parser.parse_args(argv)
+    configure_logging(getattr(args, 'verbose', 0), getattr(args, 'quiet', False))
+
+    if args.command == 'match':
+        if not Path(args.order_file).exists():
+            print(f"Error: File '{args.order_file}' does not exist.")
+            return
+        if args.match_log and Path(args.match_log).suffix.lower() not in MATCH_LOG_FORMATS:
+            print("Error: --match-log must be a .csv or .jsonl file.")
+            return
+        if not Path(args.db).exists():
+            print(f"Error: History '{args.db}' does not exist; run 'cli.py history ingest' first.")
+            return
+
+    with PaymentHistory(Path(args.db)) as history:
+        if args.command == 'ingest':
+            for payment_file in args.payment_files:
+                try:
+                    result = history.ingest(payment_file, args.chunksize)
+                except Exception as e:
+                    print(f"Error ingesting {payment_file}: {type(e).__name__}: {e}")
+                    continue
+                if result['skipped']:
+                    print(f"Already ingested: {payment_file}")
+                else:
+                    print(f"Ingested {payment_file}: {result['added']} of {result['rows']} rows added")
+            print(f"History {args.db}: {history.row_count} payment rows")
+        elif args.command == 'stats':
+            for statement in history.statements():
+                print(f"{statement['path']}: {statement['added']} of {statement['rows']} rows, ingested "
+                      f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(statement['ingested_at']))}")
+            print(f"History {args.db}: {history.row_count} payment rows")
+        else:
+            from reconciler import Reconciler
+            from utils import log_match_counts, read_file_with_appropriate_method, write_result_file
+            match_log = match_log_from_args(args)
+            try:
+                order_df = read_file_with_appropriate_method(args.order_file)
+                counts = Reconciler.from_index(history).fill(order_df, match_log)
+                log_match_counts("History matching", counts)
+                output_path = Path(args.output) if args.output else Path(args.order_file)
+                write_result_file(order_df, output_path)
+                print(f"Result saved to: {output_path}")
+            except Exception as e:
+                print(f"Error processing files: {e}")
+            finally:
+                if match_log is not None:
+                    match_log.close()
+                    print(f"Match log written to: {args.match_log} ({match_log.records} orders)")
+
+
+if __name__ == '__main__':
+    main_history()
@@ -0,0 +1,203 @@
+"""
+Incremental reconciliation for the Excel Merge Tool.
+A small state file remembers a fingerprint and the match result of every
+order row, plus the payment index and how much of the payment file it
+covers. Later runs only match order rows that are new or changed and only
+index payment rows appended since the last run.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from backends import detect_format
+from utils import (PaymentIndex, OrderMatch, match_order, report_order_match, assign_fees, column_values,
+                   load_payment_index, read_file_with_appropriate_method, run_concurrently, sniff_csv,
+                   CSV_KEY_COLUMNS, PAYMENT_COLUMNS, PAYMENT_CHUNK_ROWS)
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the state file changes so old state is ignored
+STATE_VERSION = 1
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def default_state_file(order_file: str) -> Path:
+    return Path(f"{order_file}.merge-state.pkl")
+
+
+def load_state(state_file: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        logger.warning("Ignoring unreadable state file %s (%s)", state_file, e)
+        return None
+    return state if state.get('version') == STATE_VERSION else None
+
+
+def save_state(state_file: Path, state: Dict[str, Any]) -> None:
+    state_file = Path(state_file)
+    fd, temp_path = tempfile.mkstemp(suffix='.pkl', dir=state_file.parent)
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, state_file)
+
+
+def fingerprint_orders(order_df: pd.DataFrame) -> np.ndarray:
+    """
+    One 64-bit hash per order row over '订单号', '外部订单号' and '订单金额'
+    """
+    key_columns = pd.DataFrame({
+        '订单号': column_values(order_df, '订单号', default=''),
+        '外部订单号': column_values(order_df, '外部订单号'),
+        '订单金额': column_values(order_df, '订单金额', default=0),
+    }).astype(str)
+    return pd.util.hash_pandas_object(key_columns, index=False).to_numpy()
+
+
+def _hash_prefix(file_path: str, length: int) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(HASH_BLOCK_BYTES, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def _payment_file_state(payment_file: str, payment_index: PaymentIndex, dialect: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    size = os.path.getsize(payment_file)
+    return {'file': str(Path(payment_file).resolve()), 'size': size, 'prefix_hash': _hash_prefix(payment_file, size),
+            'dialect': dialect, 'index': payment_index}
+
+
+def _can_append(payment_file: str, previous: Optional[Dict[str, Any]]) -> bool:
+    """
+    True when payment_file is the previously indexed CSV with rows appended
+    """
+    if previous is None or previous['dialect'] is None:
+        return False
+    if previous['file'] != str(Path(payment_file).resolve()):
+        return False
+    size = os.path.getsize(payment_file)
+    if size < previous['size']:
+        return False
+    # Appended rows can only be parsed on their own if the indexed part ended on a line break
+    with open(payment_file, 'rb') as f:
+        f.seek(previous['size'] - 1)
+        if f.read(1) != b'\n':
+            return False
+    return _hash_prefix(payment_file, previous['size']) == previous['prefix_hash']
+
+
+def refresh_payment_index(payment_file: str, previous: Optional[Dict[str, Any]],
+                          chunksize: int = PAYMENT_CHUNK_ROWS) -> Tuple[Dict[str, Any], int, bool]:
+    """
+    Bring the saved payment index up to date with payment_file.
+    Returns (payment state, rows added, whether the index was rebuilt).
+    """
+    if _can_append(payment_file, previous):
+        payment_index = previous['index']
+        dialect = previous['dialect']
+        rows_before = payment_index.row_count
+        if os.path.getsize(payment_file) > previous['size']:
+            with open(payment_file, 'rb') as f:
+                f.seek(previous['size'])
+                reader = pd.read_csv(f, header=None, names=dialect['header'], encoding=dialect['encoding'],
+                                     sep=dialect['sep'], usecols=lambda column: column in PAYMENT_COLUMNS,
+                                     dtype={column: str for column in CSV_KEY_COLUMNS}, chunksize=chunksize)
+                with reader:
+                    for chunk in reader:
+                        payment_index.add(chunk)
+        rows_added = payment_index.row_count - rows_before
+        logger.info("Indexed %d payment rows appended to %s", rows_added, payment_file)
+        return _payment_file_state(payment_file, payment_index, dialect), rows_added, False
+
+    payment_index = load_payment_index(payment_file, chunksize)
+    dialect = sniff_csv(payment_file) if detect_format(payment_file) == 'csv' else None
+    return _payment_file_state(payment_file, payment_index, dialect), payment_index.row_count, True
+
+
+def _needs_rematch(previous: OrderMatch, payment_rows_added: int) -> bool:
+    # New payment rows come after the indexed ones, so an exact match keeps its row. An unmatched
+    # order may now match, and a fallback match moves to the exact tier if its prefix appears.
+    if not payment_rows_added:
+        return False
+    return previous.outcome == 'unmatched' or previous.method in ('p_number', 'hyphen')
+
+
+def reconcile_incremental(order_file: str, payment_file: str, state_file: Optional[Path] = None,
+                          chunksize: int = PAYMENT_CHUNK_ROWS, match_log: Any = None,
+                          changes: Any = None) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Fill '支付手续费' for order_file, reusing the results stored in state_file
+    for rows whose '订单号', '外部订单号' and '订单金额' are unchanged.
+    Every row, reused or not, goes to match_log if one is given; rows whose
+    fee changed are recorded in changes (a utils.FeeChanges) if one is given.
+    Returns the order DataFrame and a summary of the work done.
+    """
+    state_file = Path(state_file) if state_file else default_state_file(order_file)
+    state = load_state(state_file)
+
+    # The order file is parsed while appended payment rows are indexed
+    order_df, (payment_state, payment_rows_added, rebuilt) = run_concurrently(
+        lambda: read_file_with_appropriate_method(order_file),
+        lambda: refresh_payment_index(payment_file, state['payment'] if state else None, chunksize))
+    payment_index = payment_state['index']
+
+    if changes is not None:
+        changes.before(order_df)
+    if '支付手续费' not in order_df.columns:
+        order_df['支付手续费'] = None
+    fingerprints = fingerprint_orders(order_df)
+
+    # Results from the previous run only hold if the index was extended, not rebuilt
+    previous_fingerprints = state['fingerprints'] if state and not rebuilt else np.array([], dtype=np.uint64)
+    previous_matches: List[OrderMatch] = state['matches'] if state and not rebuilt else []
+    overlap = min(len(previous_fingerprints), len(fingerprints))
+    unchanged = np.zeros(len(fingerprints), dtype=bool)
+    unchanged[:overlap] = previous_fingerprints[:overlap] == fingerprints[:overlap]
+
+    order_nos = column_values(order_df, '订单号', default='')
+    external_order_nos = column_values(order_df, '外部订单号')
+    amounts = column_values(order_df, '订单金额', default=0)
+    matches: List[OrderMatch] = []
+    rematched = 0
+    for pos in range(len(order_df)):
+        if unchanged[pos] and not _needs_rematch(previous_matches[pos], payment_rows_added):
+            matches.append(previous_matches[pos])
+            continue
+        matches.append(match_order(payment_index, order_nos[pos], external_order_nos[pos], amounts[pos]))
+        rematched += 1
+    for pos, (idx, match) in enumerate(zip(order_df.index, matches)):
+        report_order_match(match_log, idx, order_nos[pos], external_order_nos[pos], amounts[pos], match)
+
+    assigned = [pos for pos, match in enumerate(matches) if match.fee_assigned]
+    assign_fees(order_df, assigned, [matches[pos].fee for pos in assigned])
+    if changes is not None:
+        changes.after(order_df)
+
+    save_state(state_file, {'version': STATE_VERSION, 'payment': payment_state,
+                            'fingerprints': fingerprints, 'matches': matches})
+    summary = {
+        'rows': len(order_df),
+        'rematched': rematched,
+        'reused': len(order_df) - rematched,
+        'payment_rows_added': payment_rows_added,
+        'payment_rebuilt': int(rebuilt),
+    }
+    return order_df, summary
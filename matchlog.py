@@ -0,0 +1,112 @@
+"""
+Structured match log and logging setup for the Excel Merge Tool.
+MatchLog writes one record per order (outcome, match method, payment row and
+fee) to a CSV or JSON lines file. Records are buffered and written in blocks,
+so an audit trail of a large run costs far less than printing it.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import math
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+
+MATCH_LOG_FIELDS = ('order_row', 'order_no', 'external_order_no', 'order_amount', 'outcome', 'method',
+                    'payment_row', 'fee')
+MATCH_LOG_FORMATS = ('.csv', '.jsonl')
+DEFAULT_BUFFER_ROWS = 10000
+
+
+def _plain(value: Any) -> Any:
+    """
+    Convert numpy/pandas scalars to built-in types and NaN to None
+    """
+    if value is None:
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class MatchLog:
+    """
+    Buffered writer of per-order match records; the format follows the file
+    suffix (.csv or .jsonl). Use as a context manager or call close().
+    """
+
+    def __init__(self, path: Path, buffer_rows: int = DEFAULT_BUFFER_ROWS):
+        self.path = Path(path)
+        self.format = self.path.suffix.lower()
+        if self.format not in MATCH_LOG_FORMATS:
+            raise ValueError(f"Match log must be a .csv or .jsonl file, got '{self.path.name}'")
+        self.buffer_rows = buffer_rows
+        self.buffer: List[Tuple[Any, ...]] = []
+        self.records = 0
+        # utf-8-sig so Excel shows the Chinese order data correctly, as for CSV results
+        self.file = open(self.path, 'w', encoding='utf-8-sig' if self.format == '.csv' else 'utf-8', newline='')
+        self.writer = csv.writer(self.file) if self.format == '.csv' else None
+        if self.writer is not None:
+            self.writer.writerow(MATCH_LOG_FIELDS)
+
+    def record(self, order_row: Any, order_no: Any, external_order_no: Any, order_amount: Any, outcome: str,
+               method: Optional[str] = None, payment_row: Optional[int] = None, fee: Any = None) -> None:
+        self.buffer.append((order_row, order_no, external_order_no, order_amount, outcome, method, payment_row, fee))
+        if len(self.buffer) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        rows = [tuple(_plain(value) for value in record) for record in self.buffer]
+        if self.writer is not None:
+            self.writer.writerows(rows)
+        else:
+            self.file.write(''.join(json.dumps(dict(zip(MATCH_LOG_FIELDS, row)), ensure_ascii=False) + '\n'
+                                    for row in rows))
+        self.records += len(rows)
+        self.buffer.clear()
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+    def __enter__(self) -> 'MatchLog':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def add_logging_arguments(parser: argparse.ArgumentParser, match_log: bool = True) -> None:
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='Log more detail; -v adds one line per order (default: a summary per stage)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only log warnings and errors')
+    if match_log:
+        parser.add_argument('--match-log', type=str, default=None, metavar='FILE',
+                            help='Write one record per order (outcome, method, payment row, fee) to a .csv or .jsonl file')
+
+
+def configure_logging(verbose: int = 0, quiet: bool = False) -> None:
+    """
+    WARNING with quiet, INFO by default, DEBUG (per-order detail) with verbose
+    """
+    if quiet:
+        level = logging.WARNING
+    elif verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(level=level, format='%(message)s')
+
+
+def match_log_from_args(args: argparse.Namespace) -> Optional[MatchLog]:
+    if not args.match_log:
+        return None
+    return MatchLog(Path(args.match_log))
@@ -0,0 +1,115 @@
+"""
+Multi-core reconciliation for the Excel Merge Tool.
+Splits work across worker processes: row-range shards of one order table, or
+one order file per worker in batch runs. Each worker receives the payment
+index once when it starts, and results are collected in input order so a
+parallel run is identical to a serial one.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils import (PaymentIndex, OrderMatch, OrderMatches, match_order, count_match, new_match_counts,
+                   report_order_match, collect_order_matches, column_values)
+
+
+# Set in each worker process by _init_worker
+_worker_index: Optional[PaymentIndex] = None
+
+
+def resolve_workers(workers: int) -> int:
+    """
+    Number of worker processes to use; 0 or less means one per CPU core
+    """
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _init_worker(payment_index: PaymentIndex) -> None:
+    global _worker_index
+    _worker_index = payment_index
+
+
+def _match_shard(rows: List[Tuple[Any, Any, Any]]) -> Tuple[List[OrderMatch], Dict[str, int]]:
+    """
+    Match a contiguous range of orders; returns every OrderMatch and the
+    per-outcome and per-method counts
+    """
+    results = []
+    counts = new_match_counts()
+    for original_order_no, external_order_no, order_amount_raw in rows:
+        result = match_order(_worker_index, original_order_no, external_order_no, order_amount_raw)
+        count_match(counts, result)
+        results.append(result)
+    return results, counts
+
+
+def worker_pool(payment_index: PaymentIndex, workers: int) -> ProcessPoolExecutor:
+    """
+    Worker processes that each hold payment_index, for reuse across several
+    parallel_order_matches calls (e.g. the chunks of a checkpointed run)
+    """
+    return ProcessPoolExecutor(max_workers=resolve_workers(workers), initializer=_init_worker,
+                               initargs=(payment_index,))
+
+
+def parallel_order_matches(order_df: pd.DataFrame, payment_index: PaymentIndex, workers: int,
+                           match_log: Any = None, executor: Optional[ProcessPoolExecutor] = None) -> OrderMatches:
+    """
+    Parallel equivalent of utils.index_order_matches: the order table is cut
+    into one row range per worker and the shards are matched concurrently.
+    Per-order results are sent back and logged by this process. Given an
+    executor from worker_pool(), its processes are used instead of starting
+    new ones.
+    """
+    workers = resolve_workers(workers)
+
+    # Only the three columns matching reads are sent to the workers
+    rows = list(zip(column_values(order_df, '订单号', default=''),
+                    column_values(order_df, '外部订单号'),
+                    column_values(order_df, '订单金额', default=0)))
+    bounds = np.linspace(0, len(rows), workers + 1, dtype=int)
+    shards = [rows[start:end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+    results = []
+    counts = new_match_counts()
+    if executor is None:
+        with worker_pool(payment_index, workers) as executor:
+            shard_outputs = list(executor.map(_match_shard, shards))
+    else:
+        shard_outputs = list(executor.map(_match_shard, shards))
+    for shard_results, shard_counts in shard_outputs:
+        results.extend(shard_results)
+        for key, count in shard_counts.items():
+            counts[key] += count
+
+    for idx, row, result in zip(order_df.index, rows, results):
+        report_order_match(match_log, idx, *row, result)
+    return collect_order_matches(results, counts)
+
+
+def _reconcile_in_worker(order_file: Path, output_dir: Optional[Path]) -> Dict[str, Any]:
+    from batch import reconcile_file
+    try:
+        result = reconcile_file(order_file, _worker_index, output_dir)
+        result.update(file=str(order_file), status='ok')
+    except Exception as e:
+        result = {'file': str(order_file), 'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+    return result
+
+
+def reconcile_files_parallel(order_files: List[Path], payment_index: PaymentIndex, output_dir: Optional[Path],
+                             workers: int) -> List[Dict[str, Any]]:
+    """
+    Reconcile order files concurrently, one file per worker at a time.
+    Results come back in the order of order_files.
+    """
+    workers = min(resolve_workers(workers), max(len(order_files), 1))
+    with worker_pool(payment_index, workers) as executor:
+        return list(executor.map(_reconcile_in_worker, order_files, [output_dir] * len(order_files)))
@@ -0,0 +1,125 @@
+"""
+Run profiling for the Excel Merge Tool.
+RunProfiler records wall time, CPU time, peak memory and row counts for each
+stage of a run (reading, matching, writing) and writes them as a JSON
+report. One stage can additionally be run under cProfile and its statistics
+dumped for pstats or snakeviz.
+"""
+
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, ContextManager, Dict, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb(who: str = 'self') -> Optional[float]:
+    """
+    Peak resident set size in MB of this process ('self') or of its finished
+    worker processes ('children'), or None where the platform has no getrusage
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # Linux reports kilobytes, macOS bytes
+    return round(usage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024), 1)
+
+
+def cpu_seconds() -> float:
+    """
+    User + system CPU time of this process and its finished worker processes
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class RunProfiler:
+    """
+    Collects per-stage measurements for one run. Stages are recorded in the
+    order they finish; callers add 'rows' and any other facts to the dict
+    yielded by stage(). Stages that overlap in time, such as the order and
+    payment reads running on two threads, are marked 'concurrent': their
+    wall times overlap, and their cpu_seconds is the CPU time of the thread
+    that ran the stage rather than of the whole process, so it is not
+    counted twice.
+    """
+
+    def __init__(self, cprofile_stage: Optional[str] = None, cprofile_file: Optional[Path] = None):
+        self.cprofile_stage = cprofile_stage
+        self.cprofile_file = Path(cprofile_file) if cprofile_file else None
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.started = time.perf_counter()
+        self.cpu_started = cpu_seconds()
+        self.lock = threading.Lock()
+        # Records of the stages currently running
+        self.running: Dict[int, Dict[str, Any]] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        record: Dict[str, Any] = {}
+        with self.lock:
+            if self.running:
+                record['concurrent'] = True
+                for other in self.running.values():
+                    other['concurrent'] = True
+            self.running[id(record)] = record
+        profile = cProfile.Profile() if self.cprofile_file and name == self.cprofile_stage else None
+        wall_start, cpu_start, thread_cpu_start = time.perf_counter(), cpu_seconds(), time.thread_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(str(self.cprofile_file))
+                record['cprofile_file'] = str(self.cprofile_file)
+            wall = time.perf_counter() - wall_start
+            with self.lock:
+                del self.running[id(record)]
+            record['wall_seconds'] = round(wall, 4)
+            if record.get('concurrent'):
+                record['cpu_seconds'] = round(time.thread_time() - thread_cpu_start, 4)
+            else:
+                record['cpu_seconds'] = round(cpu_seconds() - cpu_start, 4)
+            # getrusage only offers a high-water mark, so this is the peak up to the end of the stage
+            record['peak_rss_mb'] = peak_rss_mb()
+            if record.get('rows') and wall > 0:
+                record['rows_per_second'] = round(record['rows'] / wall)
+            self.stages[name] = record
+
+    def report(self, **details: Any) -> Dict[str, Any]:
+        return {
+            **details,
+            'stages': self.stages,
+            'total': {
+                'wall_seconds': round(time.perf_counter() - self.started, 4),
+                'cpu_seconds': round(cpu_seconds() - self.cpu_started, 4),
+                'peak_rss_mb': peak_rss_mb(),
+                'workers_peak_rss_mb': peak_rss_mb('children'),
+            },
+        }
+
+    def write_report(self, report_file: Path, **details: Any) -> Dict[str, Any]:
+        report = self.report(**details)
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+
+def profile_stage(profiler: Optional[RunProfiler], name: str) -> ContextManager[Dict[str, Any]]:
+    """
+    profiler.stage(name), or a no-op context yielding a throwaway dict when not profiling
+    """
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name)
@@ -0,0 +1,226 @@
+"""
+Reconciler API for the Excel Merge Tool.
+A Reconciler is built once from one or more payment statements, given as
+file paths, DataFrames or prebuilt PaymentIndex objects, and then matches
+any number of order tables or order rows in memory without file round
+trips. cli.py, utils.process_excel_files and the service are built on it.
+
+    reconciler = Reconciler(['payment_07.csv', payment_df])
+    result = reconciler.match(order_df)         # order_df is not modified
+    result.fees, result.matches, result.counts
+    reconciler.fill(order_df)                   # writes '支付手续费' in place
+    reconciler.fill_sheets({'门店A': sheet_a, '门店B': sheet_b})
+    reconciler.match_rows([{'订单号': ..., '外部订单号': ..., '订单金额': ...}])
+"""
+
+from collections.abc import Mapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+import pandas as pd
+
+from utils import (PaymentIndex, PaymentKeys, OrderMatch, OrderMatches, apply_order_matches, column_values,
+                   index_order_matches, load_payment_index, match_order, payment_match_keys, read_payment_frame,
+                   report_order_match, vectorized_order_matches, MATCH_ENGINES, PAYMENT_CHUNK_ROWS)
+
+
+PaymentSource = Union[str, Path, pd.DataFrame, PaymentIndex]
+# Fields of an order row, in the order a tuple row gives them, and the value used where a table lacks one
+ROW_FIELDS = ('订单号', '外部订单号', '订单金额')
+ROW_DEFAULTS = ('', None, 0)
+
+
+class MatchResult(NamedTuple):
+    """
+    Outcome of Reconciler.match(): matches is aligned with the order table's
+    index and has the columns '支付手续费' (the value it is set to, None
+    where it is left unchanged), 'outcome', 'method' and 'payment_row'
+    """
+    matches: pd.DataFrame
+    counts: Dict[str, int]
+
+    @property
+    def fees(self) -> pd.Series:
+        return self.matches['支付手续费']
+
+    @property
+    def assigned(self) -> pd.Series:
+        return self.matches['outcome'].isin(('zero', 'matched'))
+
+
+class Reconciler:
+    """
+    Payment statements compiled once for matching. Earlier statements win
+    when several contain a match. The 'row' engine keeps a PaymentIndex
+    (self.index), the 'vectorized' engine the projected payment table
+    (self.payment_frame), whose matching keys are derived on first use and
+    kept; both give the same results. Inside worker_pool(), the row engine's
+    worker processes are started once and reused by every match.
+    """
+
+    def __init__(self, payments: Union[PaymentSource, Sequence[PaymentSource]], engine: str = 'row',
+                 chunksize: int = PAYMENT_CHUNK_ROWS, cache: Any = None, workers: int = 1):
+        if engine not in MATCH_ENGINES:
+            raise ValueError(f"Unknown matching engine '{engine}', expected one of {MATCH_ENGINES}")
+        if isinstance(payments, (str, Path, pd.DataFrame, PaymentIndex)):
+            payments = [payments]
+        self.engine = engine
+        self.workers = workers
+        self.index: Optional[PaymentIndex] = None
+        self.payment_frame: Optional[pd.DataFrame] = None
+        self.payment_keys: Optional[PaymentKeys] = None
+        self.executor: Any = None
+        if engine == 'row':
+            self.index = self._build_index(payments, chunksize, cache)
+            self.payment_rows = self.index.row_count
+        else:
+            self.payment_frame = self._build_frame(payments, cache)
+            self.payment_rows = len(self.payment_frame)
+
+    @classmethod
+    def from_index(cls, payment_index: Any, workers: int = 1) -> 'Reconciler':
+        """
+        A row-engine Reconciler around an existing index, without copying it.
+        Anything with PaymentIndex's lookup(), fees and row_count will do,
+        e.g. a history.PaymentHistory (which must be used with workers=1).
+        """
+        reconciler = cls.__new__(cls)
+        reconciler.engine = 'row'
+        reconciler.workers = workers
+        reconciler.index = payment_index
+        reconciler.payment_frame = None
+        reconciler.payment_keys = None
+        reconciler.executor = None
+        reconciler.payment_rows = payment_index.row_count
+        return reconciler
+
+    @staticmethod
+    def _build_index(payments: Sequence[PaymentSource], chunksize: int, cache: Any) -> PaymentIndex:
+        indexes = []
+        for payment in payments:
+            if isinstance(payment, PaymentIndex):
+                indexes.append(payment)
+            elif isinstance(payment, pd.DataFrame):
+                indexes.append(PaymentIndex(payment))
+            elif cache is not None:
+                from cache import cached_payment_index
+                indexes.append(cached_payment_index(str(payment), cache, chunksize))
+            else:
+                indexes.append(load_payment_index(str(payment), chunksize))
+        if len(indexes) == 1:
+            return indexes[0]
+        payment_index = PaymentIndex()
+        for statement_index in indexes:
+            payment_index.merge(statement_index)
+        return payment_index
+
+    @staticmethod
+    def _build_frame(payments: Sequence[PaymentSource], cache: Any) -> pd.DataFrame:
+        frames = []
+        for payment in payments:
+            if isinstance(payment, PaymentIndex):
+                raise ValueError("The vectorized engine needs payment tables or files, not a PaymentIndex")
+            if isinstance(payment, pd.DataFrame):
+                frames.append(payment)
+            elif cache is not None:
+                from cache import cached_payment_frame
+                frames.append(cached_payment_frame(str(payment), cache))
+            else:
+                frames.append(read_payment_frame(str(payment)))
+        # A single table is used as it is; several are stacked so row positions continue across statements
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def _payment_keys(self) -> PaymentKeys:
+        if self.payment_keys is None:
+            self.payment_keys = payment_match_keys(self.payment_frame)
+        return self.payment_keys
+
+    @contextmanager
+    def worker_pool(self) -> Iterator[None]:
+        """
+        Keep the worker processes of the row engine running for every match
+        inside the block, e.g. the chunks of a checkpointed run, instead of
+        starting them for each call. A no-op with one worker or the
+        vectorized engine.
+        """
+        if self.engine != 'row' or self.workers == 1 or self.executor is not None:
+            yield
+            return
+        from parallel import worker_pool
+        with worker_pool(self.index, self.workers) as executor:
+            self.executor = executor
+            try:
+                yield
+            finally:
+                self.executor = None
+
+    def order_matches(self, order_df: pd.DataFrame, match_log: Any = None) -> OrderMatches:
+        """
+        Per-order results as arrays in row order; order_df is only read
+        """
+        if self.engine == 'vectorized':
+            return vectorized_order_matches(order_df, self.payment_frame, match_log, self._payment_keys())
+        if self.workers != 1:
+            from parallel import parallel_order_matches
+            return parallel_order_matches(order_df, self.index, self.workers, match_log, self.executor)
+        return index_order_matches(order_df, self.index, match_log)
+
+    def match(self, order_df: pd.DataFrame, match_log: Any = None) -> MatchResult:
+        """
+        Fee and match metadata for every row of order_df, which is not
+        modified or copied
+        """
+        matches = self.order_matches(order_df, match_log)
+        frame = pd.DataFrame({'支付手续费': matches.fees, 'outcome': matches.outcomes, 'method': matches.methods,
+                              'payment_row': matches.payment_rows}, index=order_df.index)
+        return MatchResult(frame, matches.counts)
+
+    def fill(self, order_df: pd.DataFrame, match_log: Any = None) -> Dict[str, int]:
+        """
+        Set '支付手续费' of order_df in place, as process_excel_files does,
+        and return the number of orders per match outcome and method
+        """
+        matches = self.order_matches(order_df, match_log)
+        apply_order_matches(order_df, matches)
+        return matches.counts
+
+    def fill_sheets(self, sheets: Dict[str, pd.DataFrame], match_log: Any = None) -> Dict[str, Dict[str, int]]:
+        """
+        fill() for several order tables, e.g. the sheets of a workbook, given
+        as name -> DataFrame. Their rows are matched together in one pass,
+        which the workers share out regardless of sheet sizes; match log rows
+        are labelled '<name>:<row>'. Returns the counts per table.
+        """
+        combined = pd.concat([pd.DataFrame({field: column_values(order_df, field, default)
+                                            for field, default in zip(ROW_FIELDS, ROW_DEFAULTS)},
+                                           index=[f"{name}:{idx}" for idx in order_df.index], columns=list(ROW_FIELDS))
+                              for name, order_df in sheets.items()]) if sheets else pd.DataFrame(columns=list(ROW_FIELDS))
+        matches = self.order_matches(combined, match_log)
+        counts = {}
+        start = 0
+        for name, order_df in sheets.items():
+            sheet_matches = matches.rows(start, start + len(order_df))
+            apply_order_matches(order_df, sheet_matches)
+            counts[name] = sheet_matches.counts
+            start += len(order_df)
+        return counts
+
+    def match_rows(self, rows: Iterable[Any], match_log: Any = None) -> List[OrderMatch]:
+        """
+        Match order rows given as mappings (or pandas Series, such as rows
+        from df.iterrows()) with '订单号', '外部订单号' and '订单金额', or as
+        (订单号, 外部订单号, 订单金额) tuples; returns one OrderMatch per row
+        """
+        rows = [tuple(row.get(field) for field in ROW_FIELDS) if isinstance(row, (Mapping, pd.Series)) else tuple(row)
+                for row in rows]
+        if self.engine == 'vectorized':
+            matches = vectorized_order_matches(pd.DataFrame(rows, columns=list(ROW_FIELDS)), self.payment_frame,
+                                               match_log, self._payment_keys())
+            return [matches.result(pos) for pos in range(len(rows))]
+        results = []
+        for pos, (original_order_no, external_order_no, order_amount_raw) in enumerate(rows):
+            result = match_order(self.index, original_order_no, external_order_no, order_amount_raw)
+            report_order_match(match_log, pos, original_order_no, external_order_no, order_amount_raw, result)
+            results.append(result)
+        return results
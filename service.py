@@ -0,0 +1,431 @@
+"""
+Reconciliation service for the Excel Merge Tool.
+A long-running process that keeps indexed payment statements in memory and
+answers fee lookups over a local HTTP port or Unix socket, so repeated
+reconciliations skip interpreter startup and statement parsing. Indexes are
+reloaded when their file changes and evicted least recently used first once
+their estimated size exceeds the memory limit.
+
+Endpoints (JSON in and out):
+    GET  /status     loaded indexes, their size, hits and misses
+    POST /match      {"payments": [...], "rows": [{"订单号": ..., "外部订单号": ..., "订单金额": ...}]}
+    POST /reconcile  {"payments": [...], "order_file": ..., "output": optional file name to write the result to}
+
+POST bodies must be sent as application/json, which browsers cannot do
+cross-site without a preflight the service never grants. Results are only
+written inside the --output-dir given at start-up, and with --token every
+POST must carry "Authorization: Bearer <token>".
+"""
+
+import argparse
+import hmac
+import json
+import logging
+import math
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+# pandas and the matching code load once the service starts, so 'cli.py serve --help' stays fast
+from backends import add_backend_arguments, apply_backend_args
+from cache import add_cache_arguments, cache_from_args, cached_payment_index
+from constants import PAYMENT_CHUNK_ROWS
+from matchlog import add_logging_arguments, configure_logging
+
+if TYPE_CHECKING:
+    from reconciler import Reconciler
+    from utils import PaymentIndex
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_POOL_BYTES = 1024 ** 3
+# Largest request body accepted, so a stray client cannot exhaust memory
+MAX_REQUEST_BYTES = 64 * 1024 ** 2
+# Environment variable --token defaults to, so the token need not appear in the process list
+TOKEN_ENV = 'EXCEL_MERGE_SERVICE_TOKEN'
+
+
+def estimate_index_bytes(payment_index: 'PaymentIndex') -> int:
+    """
+    Approximate memory held by a PaymentIndex: its containers, keys and fees
+    (business type strings are shared and not counted per key)
+    """
+    total = sys.getsizeof(payment_index.prefixes) + sum(sys.getsizeof(prefix) for prefix in payment_index.prefixes)
+    for table in (payment_index.exact, payment_index.by_p_number, payment_index.by_hyphen_suffix):
+        total += sys.getsizeof(table) + sum(sys.getsizeof(key) + sys.getsizeof(key[0]) + sys.getsizeof(pos)
+                                            for key, pos in table.items())
+    total += sys.getsizeof(payment_index.fees) + sum(sys.getsizeof(fee) for fee in payment_index.fees.values())
+    return total
+
+
+def _file_signature(file_path: str) -> Tuple[int, int]:
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class PaymentIndexPool:
+    """
+    Payment indexes kept warm between requests, keyed by the ordered list of
+    statement paths. An entry is rebuilt when any of its files changed, and
+    least recently used entries are dropped while the pool is over max_bytes;
+    the entry just used is always kept.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_POOL_BYTES, chunksize: int = PAYMENT_CHUNK_ROWS, cache: Any = None):
+        self.max_bytes = max_bytes
+        self.chunksize = chunksize
+        self.cache = cache
+        self.entries: 'OrderedDict[Tuple[str, ...], Dict[str, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # key -> [lock held while its index is built, requests using that lock]; dropped by the last one
+        self.building: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def _build(self, payment_files: Tuple[str, ...]) -> 'PaymentIndex':
+        from utils import PaymentIndex, load_payment_index
+        payment_index = PaymentIndex()
+        for payment_file in payment_files:
+            if self.cache is not None:
+                payment_index.merge(cached_payment_index(payment_file, self.cache, self.chunksize))
+            else:
+                payment_index.merge(load_payment_index(payment_file, self.chunksize))
+        return payment_index
+
+    def get(self, payment_files: Iterable[str]) -> 'PaymentIndex':
+        """
+        The index over payment_files in the given order, built on first use
+        """
+        key = tuple(str(Path(payment_file).resolve()) for payment_file in payment_files)
+        signatures = [_file_signature(payment_file) for payment_file in key]
+        with self.lock:
+            building = self.building.setdefault(key, [threading.Lock(), 0])
+            building[1] += 1
+        try:
+            # Builds run outside the pool lock so lookups on warm indexes are never held up,
+            # while the per-key lock keeps two requests from building the same index
+            with building[0]:
+                return self._get_locked(key, signatures)
+        finally:
+            with self.lock:
+                building[1] -= 1
+                if not building[1]:
+                    del self.building[key]
+
+    def _get_locked(self, key: Tuple[str, ...], signatures: List[Tuple[int, int]]) -> 'PaymentIndex':
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['signatures'] == signatures:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry['index']
+            self.misses += 1
+
+        started = time.perf_counter()
+        payment_index = self._build(key)
+        entry = {
+            'index': payment_index,
+            'signatures': signatures,
+            'bytes': estimate_index_bytes(payment_index),
+            'loaded_at': time.time(),
+        }
+        logger.info("Indexed %s: %d rows, ~%.1f MB in %.2fs", ', '.join(key), payment_index.row_count,
+                    entry['bytes'] / 1024 ** 2, time.perf_counter() - started)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self._evict()
+        return payment_index
+
+    def _evict(self) -> None:
+        total = sum(entry['bytes'] for entry in self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            total -= entry['bytes']
+            logger.info("Evicting payment index for %s", ', '.join(key))
+        if total > self.max_bytes:
+            logger.warning("Payment index of ~%.1f MB exceeds the pool limit of %.1f MB",
+                           total / 1024 ** 2, self.max_bytes / 1024 ** 2)
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'max_bytes': self.max_bytes,
+                'bytes': sum(entry['bytes'] for entry in self.entries.values()),
+                'indexes': [{'payments': list(key), 'rows': entry['index'].row_count, 'bytes': entry['bytes'],
+                             'loaded_at': entry['loaded_at']}
+                            for key, entry in self.entries.items()],
+            }
+
+
+def _json_value(value: Any) -> Any:
+    """
+    numpy/pandas scalars as built-in types and NaN as null
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def match_rows(reconciler: 'Reconciler', rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Match order rows given as {'订单号', '外部订单号', '订单金额'} objects.
+    'fees' holds the value '支付手续费' would be set to, or null where it would be left unchanged.
+    """
+    from utils import count_match, new_match_counts
+    counts = new_match_counts()
+    fees, results = [], []
+    for result in reconciler.match_rows(rows):
+        count_match(counts, result)
+        fees.append(_json_value(result.fee) if result.fee_assigned else None)
+        results.append({'outcome': result.outcome, 'method': result.method, 'payment_row': result.payment_row})
+    return {'fees': fees, 'results': results, 'counts': counts}
+
+
+def reconcile_order_file(reconciler: 'Reconciler', order_file: str, output: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    Fill '支付手续费' for an order file, through the same path as
+    utils.process_excel_files, and write the result if output is given
+    """
+    from utils import log_match_counts, read_file_with_appropriate_method, write_result_file
+    order_df = read_file_with_appropriate_method(order_file)
+    counts = reconciler.fill(order_df)
+    log_match_counts(f"Matching {order_file}", counts)
+    if output is not None:
+        write_result_file(order_df, output)
+    return {'fees': [_json_value(fee) for fee in order_df['支付手续费']], 'counts': counts,
+            'output': str(output) if output is not None else None}
+
+
+class RequestError(Exception):
+    """
+    A request the service rejects, with the HTTP status to answer with
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _payment_files(body: Dict[str, Any]) -> List[str]:
+    payments = body.get('payments')
+    if isinstance(payments, str):
+        payments = [payments]
+    if not payments or not all(isinstance(payment_file, str) for payment_file in payments):
+        raise RequestError(400, "'payments' must be a payment file path or a list of them")
+    for payment_file in payments:
+        if not Path(payment_file).is_file():
+            raise RequestError(404, f"Payment file '{payment_file}' does not exist")
+    return payments
+
+
+def resolve_output(output: Any, output_dir: Optional[Path]) -> Optional[Path]:
+    """
+    The path a /reconcile result is written to: output taken relative to
+    output_dir, which it must not leave. Without an output_dir the service
+    writes nothing.
+    """
+    if output is None:
+        return None
+    if output_dir is None:
+        raise RequestError(403, "Writing results is disabled; start the service with --output-dir to allow 'output'")
+    if not isinstance(output, str) or not output:
+        raise RequestError(400, "'output' must be a file name inside the output directory")
+    output_path = (output_dir / output).resolve()
+    if output_dir not in output_path.parents:
+        raise RequestError(403, f"'{output}' is outside the output directory")
+    return output_path
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    server_version = 'ExcelMergeService/1.0'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Unix socket peers have no address, so the default log line cannot be used
+        logger.debug("%s %s", self.command, format % args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _check_token(self) -> None:
+        token = self.server.token
+        if token is None:
+            return
+        supplied = self.headers.get('Authorization') or ''
+        if not hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {token}".encode('utf-8')):
+            raise RequestError(401, "Missing or wrong service token")
+
+    def _read_json(self) -> Dict[str, Any]:
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            raise RequestError(415, "Request body must be sent as application/json")
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            raise RequestError(413, f"Request body larger than {MAX_REQUEST_BYTES} bytes")
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            raise RequestError(400, f"Invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise RequestError(400, "Request body must be a JSON object")
+        return body
+
+    def do_GET(self) -> None:
+        if self.path.rstrip('/') == '/status':
+            self._send_json(200, self.server.pool.status())
+        else:
+            self._send_json(404, {'error': f"Unknown endpoint '{self.path}'"})
+
+    def do_POST(self) -> None:
+        from reconciler import Reconciler
+        started = time.perf_counter()
+        try:
+            endpoint = self.path.rstrip('/')
+            if endpoint not in ('/match', '/reconcile'):
+                raise RequestError(404, f"Unknown endpoint '{self.path}'")
+            self._check_token()
+            body = self._read_json()
+            payment_files = _payment_files(body)
+            if endpoint == '/match':
+                rows = body.get('rows')
+                if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                    raise RequestError(400, "'rows' must be a list of order objects")
+                response = match_rows(Reconciler.from_index(self.server.pool.get(payment_files)), rows)
+            else:
+                order_file = body.get('order_file')
+                if not isinstance(order_file, str) or not Path(order_file).is_file():
+                    raise RequestError(404, f"Order file '{order_file}' does not exist")
+                output = resolve_output(body.get('output'), self.server.output_dir)
+                response = reconcile_order_file(Reconciler.from_index(self.server.pool.get(payment_files)), order_file,
+                                                output)
+        except RequestError as e:
+            self._send_json(e.status, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.exception("Request to %s failed", self.path)
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        response['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self._send_json(200, response)
+
+
+class ReconciliationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], pool: PaymentIndexPool, output_dir: Optional[Path] = None,
+                 token: Optional[str] = None):
+        super().__init__(address, ServiceHandler)
+        self.pool = pool
+        self.output_dir = output_dir
+        self.token = token
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class UnixReconciliationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, socket_path: str, pool: PaymentIndexPool, output_dir: Optional[Path] = None,
+                     token: Optional[str] = None):
+            super().__init__(socket_path, ServiceHandler)
+            self.pool = pool
+            self.output_dir = output_dir
+            self.token = token
+
+        def get_request(self) -> Tuple[Any, Any]:
+            # BaseHTTPRequestHandler expects a (host, port) style client address
+            request, _ = super().get_request()
+            return request, ('unix', 0)
+
+
+def create_server(pool: PaymentIndexPool, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                  socket_path: Optional[str] = None, output_dir: Optional[Path] = None,
+                  token: Optional[str] = None) -> socketserver.BaseServer:
+    """
+    An HTTP server on host:port, or on a Unix socket if socket_path is given.
+    /reconcile results may only be written inside output_dir (resolved here);
+    with a token, every POST must present it.
+    """
+    if output_dir is not None:
+        output_dir = Path(output_dir).resolve()
+    if socket_path is None:
+        return ReconciliationServer((host, port), pool, output_dir, token)
+    if not hasattr(socket, 'AF_UNIX'):
+        raise ValueError("Unix sockets are not available on this platform; use --port instead")
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    return UnixReconciliationServer(socket_path, pool, output_dir, token)
+
+
+def main_serve(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='cli.py serve',
+                                     description='Keep payment indexes in memory and answer fee lookups over HTTP.')
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help=f'Address to listen on (default: {DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--socket', type=str, default=None, help='Listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--max-memory-mb', type=int, default=DEFAULT_POOL_BYTES // 1024 ** 2,
+                        help=f'Estimated memory for payment indexes before least recently used ones are evicted '
+                             f'(default: {DEFAULT_POOL_BYTES // 1024 ** 2})')
+    parser.add_argument('--preload', nargs='+', default=[], metavar='PAYMENT_FILE',
+                        help='Payment files to index at startup, as one statement set')
+    parser.add_argument('--chunksize', type=int, default=PAYMENT_CHUNK_ROWS,
+                        help=f'Rows of each payment CSV read at a time (default: {PAYMENT_CHUNK_ROWS})')
+    parser.add_argument('--output-dir', type=str, default=None,
+                        help="Directory /reconcile may write results to; 'output' is a file name inside it "
+                             "(default: results are never written)")
+    parser.add_argument('--token', type=str, default=os.environ.get(TOKEN_ENV),
+                        help=f'Shared token every POST must send as "Authorization: Bearer <token>" '
+                             f'(default: ${TOKEN_ENV}, or none)')
+    add_cache_arguments(parser)
+    add_logging_arguments(parser, match_log=False)
+    add_backend_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+    apply_backend_args(args)
+
+    pool = PaymentIndexPool(args.max_memory_mb * 1024 ** 2, args.chunksize, cache_from_args(args))
+    if args.preload:
+        missing = [payment_file for payment_file in args.preload if not Path(payment_file).is_file()]
+        if missing:
+            print(f"Error: File '{missing[0]}' does not exist.")
+            return
+        pool.get(args.preload)
+
+    try:
+        server = create_server(pool, args.host, args.port, args.socket,
+                               Path(args.output_dir) if args.output_dir else None, args.token)
+    except (OSError, ValueError) as e:
+        print(f"Error: Cannot start the service: {e}")
+        return
+    print(f"Serving on {args.socket or f'http://{args.host}:{args.port}'} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main_serve()
@@ -0,0 +1,62 @@
+"""
+Shared fixtures: a small payment statement and order table that exercise
+every match rule (exact prefix, P-number, hyphen suffix, zero amount,
+refunds, short order numbers and unmatched orders).
+"""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+PAYMENT_ROWS = [
+    # 商户订单号, 商品名称, 业务类型, 支出金额（-元）, 收入金额（+元）
+    ('A0000000000000000001x', '商品-P100', '收费', 1.5, None),
+    ('A0000000000000000001y', '商品', '收费', 9.9, None),
+    ('B0000000000000000002', '套餐 P200', '收费', 2.0, None),
+    ('C0000000000000000003', '退款-P300', '退费', None, 0.7),
+    ('D0000000000000000004', '门店-HX42', '收费', 0.3, None),
+    ('E0000000000000000005', '转账', '其他', 8.8, None),
+    ('F0000000000000000006', '重复 P200', '收费', 4.4, None),
+]
+ORDER_ROWS = [
+    # 订单号, 外部订单号, 订单金额
+    ('A00000000000000000011234', 'X', 100),   # exact, first of two payment rows
+    ('Z00000000000000000099999', 'P200', 50),  # P-number, earlier of two rows
+    ('Y00000000000000000088888', 'HX42', 20),  # hyphen suffix
+    ('C0000000000000000003', 'R', -10),        # refund, exact
+    ('W00000000000000000077777', 'P999', 5),   # unmatched
+    ('V00000000000000000066666', 'X', 0),      # zero amount
+    ('SHORT', 'P100', 30),                     # skipped, fewer than 20 characters
+    ('E0000000000000000005', 'X', 10),         # prefix known, but no 收费 row: unmatched
+]
+
+
+@pytest.fixture
+def payment_df() -> pd.DataFrame:
+    return pd.DataFrame(PAYMENT_ROWS, columns=['商户订单号', '商品名称', '业务类型', '支出金额（-元）', '收入金额（+元）'])
+
+
+@pytest.fixture
+def order_df() -> pd.DataFrame:
+    df = pd.DataFrame(ORDER_ROWS, columns=['订单号', '外部订单号', '订单金额'])
+    df['支付手续费'] = None
+    return df
+
+
+@pytest.fixture
+def payment_csv(tmp_path: Path, payment_df: pd.DataFrame) -> Path:
+    path = tmp_path / 'payment.csv'
+    payment_df.to_csv(path, index=False, encoding='utf-8-sig')
+    return path
+
+
+@pytest.fixture
+def order_csv(tmp_path: Path, order_df: pd.DataFrame) -> Path:
+    path = tmp_path / 'order.csv'
+    order_df.to_csv(path, index=False, encoding='utf-8-sig')
+    return path
@@ -0,0 +1,50 @@
+import openpyxl
+import pytest
+
+import utils
+from utils import PaymentIndex, atomic_output, stream_order_workbook
+
+
+def test_atomic_output_replaces_on_success(tmp_path):
+    target = tmp_path / 'result.csv'
+    target.write_text('old')
+    with atomic_output(target) as temp_path:
+        assert temp_path != target and temp_path.parent == target.parent
+        temp_path.write_text('new')
+    assert target.read_text() == 'new'
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_atomic_output_keeps_file_on_failure(tmp_path):
+    target = tmp_path / 'result.csv'
+    target.write_text('old')
+    with pytest.raises(RuntimeError):
+        with atomic_output(target) as temp_path:
+            temp_path.write_text('half written')
+            raise RuntimeError('write failed')
+    assert target.read_text() == 'old'
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_stream_in_place_closes_source_before_replacing(tmp_path, monkeypatch, order_df, payment_df):
+    order_file = tmp_path / 'order.xlsx'
+    order_df.to_excel(order_file, index=False)
+
+    opened = []
+    load_workbook = openpyxl.load_workbook
+
+    def tracking_load_workbook(*args, **kwargs):
+        opened.append(load_workbook(*args, **kwargs))
+        return opened[-1]
+
+    replace = utils.os.replace
+
+    def checked_replace(source, destination):
+        # Windows refuses to replace a file that is still open
+        assert all(workbook._archive.fp is None for workbook in opened)
+        replace(source, destination)
+
+    monkeypatch.setattr(openpyxl, 'load_workbook', tracking_load_workbook)
+    monkeypatch.setattr(utils.os, 'replace', checked_replace)
+    counts = stream_order_workbook(str(order_file), PaymentIndex(payment_df), order_file)
+    assert opened and counts['matched'] == 4
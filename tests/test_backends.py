@@ -0,0 +1,52 @@
+import pytest
+
+import backends
+from backends import detect_format, read_spreadsheet
+
+
+@pytest.fixture
+def order_xlsx(tmp_path, order_df):
+    path = tmp_path / 'order.xlsx'
+    order_df.to_excel(path, index=False, engine='openpyxl')
+    return path
+
+
+@pytest.fixture(autouse=True)
+def no_forced_backend(monkeypatch):
+    monkeypatch.delenv(backends.READER_ENV, raising=False)
+
+
+def test_format_comes_from_the_leading_bytes(tmp_path, order_xlsx, order_csv):
+    assert detect_format(str(order_xlsx)) == 'xlsx'
+    assert detect_format(str(order_csv)) == 'csv'
+    # Names are not trusted: a legacy workbook saved as .xlsx and a CSV export saved as .xls
+    legacy = tmp_path / 'legacy.xlsx'
+    legacy.write_bytes(backends.OLE2_MAGIC + b'\x00' * 504)
+    assert detect_format(str(legacy)) == 'xls'
+    renamed = tmp_path / 'export.xls'
+    renamed.write_bytes(order_csv.read_bytes())
+    assert detect_format(str(renamed)) == 'csv'
+    # A corrupt zip is not a workbook
+    broken = tmp_path / 'broken.xlsx'
+    broken.write_bytes(backends.ZIP_MAGIC + b'garbage')
+    assert detect_format(str(broken)) == 'csv'
+
+
+def test_missing_backends_are_named(monkeypatch, order_xlsx):
+    monkeypatch.setattr(backends, 'is_available', lambda engine: False)
+    with pytest.raises(ValueError, match='install one of python_calamine, openpyxl'):
+        read_spreadsheet(str(order_xlsx), 'xlsx')
+
+
+def test_uninstalled_backend_is_skipped(monkeypatch, order_xlsx, order_df):
+    monkeypatch.setitem(backends.READERS, 'xlsx', ['not_installed', 'openpyxl'])
+    monkeypatch.setitem(backends.BACKEND_MODULES, 'not_installed', 'excel_merge_missing_module')
+    assert read_spreadsheet(str(order_xlsx), 'xlsx')['订单号'].tolist() == order_df['订单号'].tolist()
+
+
+def test_failing_backend_falls_back_to_the_next(monkeypatch, order_xlsx, order_df, caplog):
+    # An engine pandas does not know fails on read, as a backend choking on a file would
+    monkeypatch.setitem(backends.READERS, 'xlsx', ['broken', 'openpyxl'])
+    monkeypatch.setitem(backends.BACKEND_MODULES, 'broken', 'json')
+    assert read_spreadsheet(str(order_xlsx), 'xlsx')['订单号'].tolist() == order_df['订单号'].tolist()
+    assert 'trying openpyxl' in caplog.text
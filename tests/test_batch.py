@@ -0,0 +1,32 @@
+import pandas as pd
+
+from batch import collect_files, run_batch
+
+
+def test_collect_files_expands_directories_and_globs(tmp_path):
+    for name in ('a.csv', 'b.XLSX', 'c.xls', 'notes.txt'):
+        (tmp_path / name).touch()
+    (tmp_path / 'nested').mkdir()
+    found = collect_files([str(tmp_path), str(tmp_path / '*.csv')])
+    assert [path.name for path in found] == ['a.csv', 'b.XLSX', 'c.xls']
+
+
+def test_each_order_file_is_written_under_its_name(tmp_path, order_df, payment_csv):
+    orders = []
+    for name in ('store_a.csv', 'store_b.csv'):
+        orders.append(tmp_path / name)
+        order_df.to_csv(orders[-1], index=False, encoding='utf-8-sig')
+    output_dir = tmp_path / 'results'
+    results = run_batch(orders, [payment_csv], output_dir)
+    assert [result['output'] for result in results] == [str(output_dir / 'store_a.csv'), str(output_dir / 'store_b.csv')]
+    for result in results:
+        assert result['status'] == 'ok' and result['counts']['matched'] == 4
+        assert pd.read_csv(result['output'], encoding='utf-8-sig')['支付手续费'].notna().sum() == 5
+
+
+def test_a_failing_file_does_not_stop_the_others(tmp_path, order_csv, payment_csv):
+    missing = tmp_path / 'removed_meanwhile.csv'
+    results = run_batch([missing, order_csv], [payment_csv], tmp_path / 'results')
+    assert [result['status'] for result in results] == ['error', 'ok']
+    assert results[1]['counts']['matched'] == 4
+    assert not (tmp_path / 'results' / missing.name).exists()
@@ -0,0 +1,49 @@
+import os
+
+from cache import ParseCache, cached_read
+
+
+def test_unchanged_file_is_served_from_the_cache(tmp_path, payment_csv):
+    cache = ParseCache(tmp_path / 'cache')
+    first = cached_read(str(payment_csv), cache)
+    assert cache.load(str(payment_csv), 'frame').equals(first)
+    # A new instance reads the manifest back
+    assert ParseCache(tmp_path / 'cache').load(str(payment_csv), 'frame').equals(first)
+
+
+def test_changed_size_or_mtime_invalidates_the_entry(tmp_path, payment_csv):
+    cache = ParseCache(tmp_path / 'cache')
+    cached_read(str(payment_csv), cache)
+    with open(payment_csv, 'a', encoding='utf-8') as f:
+        f.write('G0000000000000000007,商品,收费,0.1,\n')
+    assert cache.load(str(payment_csv), 'frame') is None
+    assert len(cached_read(str(payment_csv), cache)) == 8
+
+    # Same size, different bytes and mtime
+    content = payment_csv.read_bytes().replace(b'0.1', b'0.2')
+    payment_csv.write_bytes(content)
+    stat = payment_csv.stat()
+    os.utime(payment_csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.load(str(payment_csv), 'frame') is None
+
+
+def test_least_recently_used_entries_are_evicted_with_their_files(tmp_path):
+    files = []
+    for n in range(3):
+        files.append(tmp_path / f'statement_{n}.csv')
+        files[-1].write_text(f'value\n{n}\n')
+    cache = ParseCache(tmp_path / 'cache')
+    cache.store(str(files[0]), 'frame', b'x' * 1000)
+    cache.store(str(files[1]), 'frame', b'x' * 1000)
+    entry_bytes = max(entry['bytes'] for entry in cache.manifest['entries'].values())
+    cache.max_bytes = 2 * entry_bytes
+    # Using the first entry makes the second one the least recently used
+    assert cache.load(str(files[0]), 'frame') is not None
+    cache.store(str(files[2]), 'frame', b'x' * 1000)
+
+    kept = {str(path.resolve()) for path in (files[0], files[2])}
+    assert {entry['file'] for entry in cache.manifest['entries'].values()} == kept
+    assert set(cache.manifest['files']) == kept
+    assert len(list((tmp_path / 'cache').glob('*.pkl'))) == 2
+    assert cache.load(str(files[1]), 'frame') is None
+    assert cache.load(str(files[0]), 'frame') is not None
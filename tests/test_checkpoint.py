@@ -0,0 +1,69 @@
+import pickle
+
+import pytest
+
+import parallel
+import utils
+from checkpoint import Checkpoint
+from reconciler import Reconciler
+
+
+def fees(order_df):
+    return [None if utils.pd.isna(fee) else fee for fee in order_df['支付手续费']]
+
+
+@pytest.mark.parametrize('engine, workers', [('row', 1), ('row', 2), ('vectorized', 1)])
+def test_checkpointed_fill_matches_plain_fill(tmp_path, order_csv, payment_csv, order_df, engine, workers):
+    expected = order_df.copy()
+    counts = Reconciler(str(payment_csv), engine).fill(expected)
+
+    checkpoint = Checkpoint(tmp_path / 'run.pkl', str(order_csv), str(payment_csv), chunk_rows=3)
+    assert checkpoint.fill(Reconciler(str(payment_csv), engine, workers=workers), order_df) == counts
+    assert fees(order_df) == fees(expected)
+
+
+def test_resume_skips_saved_chunks(tmp_path, order_csv, payment_csv, order_df):
+    expected = order_df.copy()
+    Reconciler(str(payment_csv)).fill(expected)
+    path = tmp_path / 'run.pkl'
+    Checkpoint(path, str(order_csv), str(payment_csv), chunk_rows=3).fill(Reconciler(str(payment_csv)), order_df.copy())
+    # Keep the header and the first two chunks, as if the run stopped there
+    with open(path, 'rb') as f:
+        saved = [pickle.load(f) for _ in range(3)]
+    with open(path, 'wb') as f:
+        for item in saved:
+            pickle.dump(item, f)
+        f.write(b'\x80truncated')
+
+    class CountingReconciler(Reconciler):
+        matched_rows = 0
+
+        def order_matches(self, chunk, match_log=None):
+            CountingReconciler.matched_rows += len(chunk)
+            return super().order_matches(chunk, match_log)
+
+    checkpoint = Checkpoint(path, str(order_csv), str(payment_csv), chunk_rows=3, resume=True)
+    checkpoint.fill(CountingReconciler(str(payment_csv)), order_df)
+    assert checkpoint.resumed_rows == 6
+    assert CountingReconciler.matched_rows == len(order_df) - 6
+    assert fees(order_df) == fees(expected)
+
+
+def test_checkpoint_sets_up_workers_and_keys_once(tmp_path, monkeypatch, order_csv, payment_csv, order_df):
+    calls = {'pool': 0, 'keys': 0}
+    worker_pool, payment_match_keys = parallel.worker_pool, utils.payment_match_keys
+
+    def counting_pool(*args):
+        calls['pool'] += 1
+        return worker_pool(*args)
+
+    def counting_keys(*args):
+        calls['keys'] += 1
+        return payment_match_keys(*args)
+
+    monkeypatch.setattr(parallel, 'worker_pool', counting_pool)
+    monkeypatch.setattr('reconciler.payment_match_keys', counting_keys)
+    for engine, workers in (('row', 2), ('vectorized', 1)):
+        checkpoint = Checkpoint(tmp_path / f'{engine}.pkl', str(order_csv), str(payment_csv), chunk_rows=2)
+        checkpoint.fill(Reconciler(str(payment_csv), engine, workers=workers), order_df.copy())
+    assert calls == {'pool': 1, 'keys': 1}
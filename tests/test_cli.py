@@ -0,0 +1,38 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+CLI = str(Path(__file__).resolve().parent.parent / 'cli.py')
+
+
+def run_cli(*args: str) -> str:
+    return subprocess.run([sys.executable, CLI, *args], capture_output=True, text=True).stdout
+
+
+@pytest.mark.parametrize('flags', [['--engine', 'vectorized'], ['--workers', '2'], ['--incremental'],
+                                   ['--update-cells'], ['--checkpoint-rows', '10']])
+def test_stream_rejects_flags_it_would_ignore(tmp_path, order_df, payment_csv, flags):
+    order_file = tmp_path / 'order.xlsx'
+    order_df.to_excel(order_file, index=False)
+    output = run_cli(str(order_file), str(payment_csv), '--stream', *flags)
+    assert output.startswith('Error:')
+    assert flags[0] in output
+
+
+@pytest.mark.parametrize('flags', [['--engine', 'vectorized'], ['--workers', '2'], ['--cache']])
+def test_incremental_rejects_flags_it_would_ignore(tmp_path, order_csv, payment_csv, flags):
+    output = run_cli(str(order_csv), str(payment_csv), '--incremental', '--state-file', str(tmp_path / 'state.pkl'),
+                     *flags)
+    assert output.startswith('Error: --incremental')
+    assert flags[0] in output
+
+
+@pytest.mark.parametrize('same_as_output', [True, False])
+def test_delta_must_differ_from_output(tmp_path, order_csv, payment_csv, same_as_output):
+    output = tmp_path / 'result.sqlite'
+    delta = output if same_as_output else tmp_path / 'delta.sqlite'
+    text = run_cli(str(order_csv), str(payment_csv), '-o', str(output), '--delta', str(delta))
+    assert text.startswith('Error: --delta') == same_as_output
+    assert output.exists() != same_as_output
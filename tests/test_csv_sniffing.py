@@ -0,0 +1,29 @@
+from utils import read_file_with_appropriate_method, sniff_csv
+
+
+def test_sniffs_alipay_statement(tmp_path):
+    path = tmp_path / 'payment.csv'
+    lines = ['#支付宝账务明细查询', '#账号：[2088]', '商户订单号;商品名称;业务类型;支出金额（-元）',
+             '012345678901234567890;套餐-P1;收费;1.50']
+    path.write_bytes(('\n'.join(lines) + '\n').encode('gbk'))
+    dialect = sniff_csv(str(path))
+    assert (dialect['encoding'], dialect['skip_rows'], dialect['sep']) == ('gbk', 2, ';')
+    df = read_file_with_appropriate_method(str(path))
+    # Identifiers keep their leading zero, amounts are numbers
+    assert df['商户订单号'].tolist() == ['012345678901234567890']
+    assert df['支出金额（-元）'].tolist() == [1.5]
+
+
+def test_byte_order_mark_wins(tmp_path):
+    path = tmp_path / 'order.csv'
+    path.write_bytes('订单号\t金额\n1\t2\n'.encode('utf-8-sig'))
+    assert sniff_csv(str(path))['encoding'] == 'utf-8-sig'
+    assert sniff_csv(str(path))['sep'] == '\t'
+
+
+def test_sample_boundary_inside_a_character(tmp_path):
+    path = tmp_path / 'order.csv'
+    row = '订单号,商品名称\n' + '1,支付宝支付宝\n' * 50
+    path.write_bytes(row.encode('utf-8'))
+    # 101 bytes ends in the middle of a three-byte character
+    assert sniff_csv(str(path), sample_size=101)['encoding'] == 'utf-8'
@@ -0,0 +1,28 @@
+import sqlite3
+
+import pandas as pd
+
+from backends import SQLITE_RESULT_TABLE
+from reconciler import Reconciler
+from utils import FeeChanges, write_result_file
+
+
+def test_delta_holds_only_changed_rows(tmp_path, order_df, payment_df):
+    # Row 0 already has the fee it will get, row 1 a stale one; NaN and None count as equal
+    order_df['支付手续费'] = [1.5, 9.0, None, None, float('nan'), None, None, None]
+    changes = FeeChanges()
+    changes.before(order_df)
+    Reconciler(payment_df).fill(order_df)
+    changes.after(order_df)
+
+    assert changes.positions.tolist() == [1, 2, 3, 5]
+    delta = changes.frame(order_df)
+    assert delta['order_row'].tolist() == [1, 2, 3, 5]
+    assert delta['previous_fee'].tolist()[0] == 9.0
+    assert delta['支付手续费'].tolist() == [2.0, 0.3, 0.7, 0.0]
+
+    path = tmp_path / 'delta.sqlite'
+    write_result_file(delta, path)
+    with sqlite3.connect(path) as connection:
+        stored = pd.read_sql(f'SELECT * FROM {SQLITE_RESULT_TABLE}', connection)
+    assert stored['order_row'].tolist() == [1, 2, 3, 5]
@@ -0,0 +1,30 @@
+import pandas as pd
+
+import utils
+from utils import compact_dtypes
+
+
+def test_string_dtype_falls_back_on_old_pandas(monkeypatch):
+    # pandas 2.0: no na_value argument and no 'pyarrow_numpy' storage
+    def old_string_dtype(storage=None, **kwargs):
+        if kwargs:
+            raise TypeError("unexpected keyword argument 'na_value'")
+        raise ValueError(f"Storage must be 'python' or 'pyarrow'. Got {storage} instead.")
+
+    monkeypatch.setattr(utils.importlib.util, 'find_spec', lambda name: object())
+    monkeypatch.setattr(utils.pd, 'StringDtype', old_string_dtype)
+    assert utils._arrow_string_dtype() is None
+
+
+def test_compact_dtypes_keeps_values(payment_df):
+    expected = payment_df.copy()
+    compact_dtypes(payment_df)
+    assert isinstance(payment_df['业务类型'].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_numeric_dtype(payment_df['支出金额（-元）'])
+    assert payment_df['商户订单号'].tolist() == expected['商户订单号'].tolist()
+    assert payment_df['业务类型'].astype(str).tolist() == expected['业务类型'].tolist()
+
+
+def test_string_dtype_needs_pyarrow(monkeypatch):
+    monkeypatch.setattr(utils.importlib.util, 'find_spec', lambda name: None)
+    assert utils._arrow_string_dtype() is None
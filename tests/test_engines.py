@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+from generate_large_data import generate_pair
+from reconciler import Reconciler
+from utils import compact_dtypes, index_order_matches, vectorized_order_matches, PaymentIndex
+
+
+def assert_same_matches(order_df, payment_df):
+    row = index_order_matches(order_df, PaymentIndex(payment_df))
+    vectorized = vectorized_order_matches(order_df, payment_df)
+    assert vectorized.counts == row.counts
+    assert vectorized.outcomes.tolist() == row.outcomes.tolist()
+    assert vectorized.methods.tolist() == row.methods.tolist()
+    assert [None if pos is None else int(pos) for pos in vectorized.payment_rows] == row.payment_rows.tolist()
+    assert pd.Series(vectorized.fees).equals(pd.Series(row.fees))
+
+
+def test_vectorized_matches_row_engine(order_df, payment_df):
+    assert_same_matches(order_df, payment_df)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_vectorized_matches_row_engine_on_synthetic_data(seed):
+    orders, payments, _ = generate_pair(2000, seed=seed)
+    assert_same_matches(orders, compact_dtypes(payments))
+
+
+def test_reconciler_engines_fill_the_same_fees(order_df, payment_df):
+    row_df, vectorized_df = order_df.copy(), order_df.copy()
+    assert Reconciler(payment_df).fill(row_df) == Reconciler(payment_df, 'vectorized').fill(vectorized_df)
+    assert row_df['支付手续费'].equals(vectorized_df['支付手续费'])
+
+
+@pytest.mark.parametrize('engine', ['row', 'vectorized'])
+def test_missing_payment_order_column_is_named(tmp_path, order_csv, payment_df, engine):
+    from utils import process_excel_files
+    payment_csv = tmp_path / 'payment.csv'
+    payment_df.rename(columns={'商户订单号': '商务订单号'}).to_csv(payment_csv, index=False, encoding='utf-8-sig')
+    with pytest.raises(ValueError, match='商户订单号'):
+        process_excel_files(str(order_csv), str(payment_csv), engine=engine)
@@ -0,0 +1,50 @@
+import pytest
+
+from history import PaymentHistory
+from reconciler import Reconciler
+
+
+@pytest.fixture
+def statements(tmp_path, payment_df):
+    payment_df['账务流水号'] = [f'\t2025{n:04d}' for n in range(len(payment_df))]
+    first, second = tmp_path / 'july.csv', tmp_path / 'august.csv'
+    payment_df.iloc[:5].to_csv(first, index=False, encoding='utf-8-sig')
+    # August's export repeats the last two July rows
+    payment_df.iloc[3:].to_csv(second, index=False, encoding='utf-8-sig')
+    return first, second
+
+
+def test_ingest_deduplicates_rows_and_files(tmp_path, statements, payment_df):
+    with PaymentHistory(tmp_path / 'history.sqlite') as history:
+        assert history.ingest(str(statements[0]))['added'] == 5
+        result = history.ingest(str(statements[1]))
+        assert (result['rows'], result['added']) == (4, 2)
+        assert history.ingest(str(statements[0]))['skipped']
+        assert history.row_count == len(payment_df)
+
+
+def test_history_matches_like_an_in_memory_index(tmp_path, statements, payment_df, order_df):
+    expected = order_df.copy()
+    expected_counts = Reconciler(payment_df).fill(expected)
+    with PaymentHistory(tmp_path / 'history.sqlite') as history:
+        for statement in statements:
+            history.ingest(str(statement))
+        assert Reconciler.from_index(history).fill(order_df) == expected_counts
+    assert order_df['支付手续费'].equals(expected['支付手续费'])
+
+
+def test_blank_order_number_still_matches_by_p_number(tmp_path):
+    import pandas as pd
+    from utils import PaymentIndex
+    statement = tmp_path / 'blank.csv'
+    pd.DataFrame({'账务流水号': ['1', '2'], '商户订单号': ['A0000000000000000001', None],
+                  '商品名称': ['商品', '商品-P500'], '业务类型': ['收费', '收费'],
+                  '支出金额（-元）': [0.5, 1.25], '收入金额（+元）': [None, None]}).to_csv(statement, index=False)
+    orders = pd.DataFrame({'订单号': ['Q00000000000000000012345'], '外部订单号': ['P500'], '订单金额': [10],
+                           '支付手续费': [None]})
+    index = PaymentIndex(pd.read_csv(statement))
+    assert Reconciler.from_index(index).fill(orders.copy())['matched'] == 1
+    with PaymentHistory(tmp_path / 'history.sqlite') as history:
+        assert history.ingest(str(statement))['added'] == 2
+        Reconciler.from_index(history).fill(orders)
+    assert orders['支付手续费'].tolist() == [1.25]
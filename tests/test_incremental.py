@@ -0,0 +1,45 @@
+import pandas as pd
+
+from incremental import reconcile_incremental
+from reconciler import Reconciler
+from utils import read_file_with_appropriate_method
+
+
+def full_run(order_csv, payment_csv):
+    order_df = read_file_with_appropriate_method(str(order_csv))
+    Reconciler(str(payment_csv)).fill(order_df)
+    return order_df
+
+
+def test_second_run_only_matches_new_rows(tmp_path, order_csv, payment_csv, order_df):
+    state_file = tmp_path / 'state.pkl'
+    first, summary = reconcile_incremental(str(order_csv), str(payment_csv), state_file)
+    assert summary['rematched'] == len(order_df)
+    assert first['支付手续费'].equals(full_run(order_csv, payment_csv)['支付手续费'])
+
+    # A new order, and a payment row appended that matches a previously unmatched order
+    order_df.loc[len(order_df)] = ['H00000000000000000012345', 'HX42', 3, None]
+    order_df.to_csv(order_csv, index=False, encoding='utf-8-sig')
+    payments = pd.read_csv(payment_csv, encoding='utf-8-sig', dtype={'商户订单号': str})
+    payments.loc[len(payments)] = ['W0000000000000000007', '-', '收费', 0.05, None]
+    payments.to_csv(payment_csv, index=False, encoding='utf-8-sig')
+
+    second, summary = reconcile_incremental(str(order_csv), str(payment_csv), state_file)
+    assert summary['payment_rows_added'] == 1 and not summary['payment_rebuilt']
+    assert summary['rematched'] < len(order_df)
+    assert second['支付手续费'].equals(full_run(order_csv, payment_csv)['支付手续费'])
+    # Unchanged but unmatched orders are retried against the appended rows
+    assert second.loc[4, '支付手续费'] == 0.05
+
+
+def test_appended_rows_use_a_quoted_header(tmp_path, order_csv, payment_df):
+    payment_csv = tmp_path / 'quoted.csv'
+    payment_df.to_csv(payment_csv, index=False, encoding='utf-8-sig', quoting=1)
+    state_file = tmp_path / 'state.pkl'
+    reconcile_incremental(str(order_csv), str(payment_csv), state_file)
+
+    with open(payment_csv, 'a', encoding='utf-8') as f:
+        f.write('"W0000000000000000007","-","收费","0.05",""\n')
+    second, summary = reconcile_incremental(str(order_csv), str(payment_csv), state_file)
+    assert summary['payment_rows_added'] == 1 and not summary['payment_rebuilt']
+    assert second.loc[4, '支付手续费'] == 0.05
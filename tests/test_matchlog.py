@@ -0,0 +1,41 @@
+import csv
+import json
+
+import pytest
+
+from matchlog import MatchLog
+from reconciler import Reconciler
+
+# outcome, method and payment row of each ORDER_ROWS order
+EXPECTED = [
+    ('matched', 'exact', 0),
+    ('matched', 'p_number', 2),
+    ('matched', 'hyphen', 4),
+    ('matched', 'exact', 3),
+    ('unmatched', None, None),
+    ('zero', None, None),
+    ('skipped', None, None),
+    ('unmatched', None, None),
+]
+
+
+@pytest.mark.parametrize('engine', ['row', 'vectorized'])
+def test_log_records_every_order(tmp_path, order_df, payment_df, engine):
+    path = tmp_path / 'matches.jsonl'
+    with MatchLog(path, buffer_rows=3) as match_log:
+        Reconciler(payment_df, engine=engine).fill(order_df, match_log)
+    records = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [record['order_row'] for record in records] == list(range(len(order_df)))
+    assert [(record['outcome'], record['method'], record['payment_row']) for record in records] == EXPECTED
+    assert records[0]['fee'] == 1.5 and records[0]['order_no'] == 'A00000000000000000011234'
+
+
+def test_sheet_rows_are_labelled(tmp_path, order_df, payment_df):
+    path = tmp_path / 'matches.csv'
+    sheets = {'门店A': order_df.iloc[:3].copy(), '门店B': order_df.iloc[3:].reset_index(drop=True)}
+    with MatchLog(path) as match_log:
+        Reconciler(payment_df).fill_sheets(sheets, match_log)
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['order_row'] for row in rows] == ['门店A:0', '门店A:1', '门店A:2'] + [f'门店B:{n}' for n in range(5)]
+    assert [row['outcome'] for row in rows] == [outcome for outcome, _, _ in EXPECTED]
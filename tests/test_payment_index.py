@@ -0,0 +1,46 @@
+from utils import PaymentIndex, match_order
+
+
+def test_first_usable_row_wins(payment_df):
+    payment_index = PaymentIndex(payment_df)
+    # Two 收费 rows share the prefix; the earlier one supplies the fee
+    assert payment_index.lookup('A0000000000000000001', None, '收费') == ('exact', 0)
+    assert payment_index.fees[0] == 1.5
+    # 'P200' appears in rows 2 and 6
+    assert payment_index.lookup('Z0000000000000000009', 'P200', '收费') == ('p_number', 2)
+
+
+def test_known_prefix_never_falls_back(payment_df):
+    payment_index = PaymentIndex(payment_df)
+    # The prefix exists, but only as a '其他' row, so P-number/hyphen matching is not tried
+    assert payment_index.lookup('E0000000000000000005', 'P200', '收费') == (None, None)
+
+
+def test_earliest_of_p_number_and_hyphen_wins(payment_df):
+    payment_df.loc[len(payment_df)] = ['G0000000000000000007', 'x-P100', '收费', 7.0, None]
+    payment_index = PaymentIndex(payment_df)
+    # 'P100' is the P-number of row 0 and the hyphen suffix of the last row
+    assert payment_index.lookup('Z0000000000000000009', 'P100', '收费') == ('p_number', 0)
+    assert payment_index.lookup('Z0000000000000000009', 'HX42', '收费') == ('hyphen', 4)
+    assert payment_index.lookup('Z0000000000000000009', 'HX42', '退费') == (None, None)
+
+
+def test_chunks_and_merges_match_a_single_index(payment_df):
+    whole = PaymentIndex(payment_df)
+    chunked = PaymentIndex()
+    for start in range(0, len(payment_df), 2):
+        chunked.add(payment_df.iloc[start:start + 2])
+    merged = PaymentIndex(payment_df.iloc[:3])
+    merged.merge(PaymentIndex(payment_df.iloc[3:].reset_index(drop=True)))
+    for other in (chunked, merged):
+        assert (other.exact, other.by_p_number, other.by_hyphen_suffix, other.fees, other.prefixes) == \
+            (whole.exact, whole.by_p_number, whole.by_hyphen_suffix, whole.fees, whole.prefixes)
+
+
+def test_match_order_outcomes(payment_df):
+    payment_index = PaymentIndex(payment_df)
+    assert match_order(payment_index, 'SHORT', 'P100', 30).outcome == 'skipped'
+    assert match_order(payment_index, 'V00000000000000000066666', 'X', 0).fee == 0.0
+    refund = match_order(payment_index, 'C0000000000000000003', 'R', -10)
+    assert (refund.outcome, refund.method, refund.fee, refund.is_regular_order) == ('matched', 'exact', 0.7, False)
+    assert match_order(payment_index, 'W00000000000000000077777', 'P999', 5).outcome == 'unmatched'
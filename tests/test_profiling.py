@@ -0,0 +1,33 @@
+import threading
+import time
+
+from profiling import RunProfiler
+from utils import run_concurrently
+
+
+def busy(seconds: float) -> None:
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+def test_overlapping_stages_are_marked_and_not_double_counted():
+    profiler = RunProfiler()
+    barrier = threading.Barrier(2)
+
+    def stage(name):
+        def run():
+            with profiler.stage(name):
+                barrier.wait()
+                busy(0.2)
+        return run
+
+    run_concurrently(stage('read_orders'), stage('read_payments'))
+    with profiler.stage('match'):
+        busy(0.05)
+
+    orders, payments, match = (profiler.stages[name] for name in ('read_orders', 'read_payments', 'match'))
+    assert orders['concurrent'] and payments['concurrent']
+    assert 'concurrent' not in match
+    # Each concurrent stage reports its own thread's CPU time, not the whole process's
+    assert orders['cpu_seconds'] < 0.35 and payments['cpu_seconds'] < 0.35
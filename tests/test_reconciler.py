@@ -0,0 +1,16 @@
+from types import MappingProxyType
+
+import pytest
+
+from reconciler import Reconciler
+
+
+@pytest.mark.parametrize('engine', ['row', 'vectorized'])
+def test_match_rows_reads_named_fields_of_any_mapping(order_df, payment_df, engine):
+    reconciler = Reconciler(payment_df, engine=engine)
+    expected = reconciler.match_rows(order_df[['订单号', '外部订单号', '订单金额']].itertuples(index=False))
+    # The fee column comes first, so positional reads would take the wrong values
+    reordered = order_df[['支付手续费', '订单金额', '外部订单号', '订单号']]
+    assert reconciler.match_rows(row for _, row in reordered.iterrows()) == expected
+    assert reconciler.match_rows(MappingProxyType(row.to_dict()) for _, row in reordered.iterrows()) == expected
+    assert [match.outcome for match in expected].count('matched') == 4
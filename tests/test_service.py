@@ -0,0 +1,93 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from service import PaymentIndexPool, create_server
+
+
+@pytest.fixture
+def service(tmp_path: Path):
+    output_dir = tmp_path / 'results'
+    output_dir.mkdir()
+    server = create_server(PaymentIndexPool(), port=0, output_dir=output_dir, token='secret')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", output_dir
+    server.shutdown()
+    server.server_close()
+
+
+def post(url: str, body: dict, content_type: str = 'application/json', token: str = 'secret'):
+    request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), method='POST',
+                                     headers={'Content-Type': content_type, 'Authorization': f'Bearer {token}'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_reconcile_writes_inside_output_dir(service, payment_csv, order_csv):
+    url, output_dir = service
+    status, body = post(f"{url}/reconcile", {'payments': str(payment_csv), 'order_file': str(order_csv),
+                                            'output': 'result.csv'})
+    assert status == 200
+    assert body['counts']['matched'] == 4
+    assert (output_dir / 'result.csv').is_file()
+
+
+def test_plain_text_post_is_rejected(service, payment_csv, order_csv, tmp_path):
+    url, _ = service
+    victim = tmp_path / 'victim.txt'
+    victim.write_text('keep me')
+    status, _ = post(f"{url}/reconcile", {'payments': str(payment_csv), 'order_file': str(order_csv),
+                                         'output': str(victim)}, content_type='text/plain')
+    assert status == 415
+    assert victim.read_text() == 'keep me'
+
+
+def test_wrong_token_is_rejected(service, payment_csv):
+    url, _ = service
+    status, _ = post(f"{url}/match", {'payments': str(payment_csv), 'rows': []}, token='guess')
+    assert status == 401
+
+
+@pytest.mark.parametrize('output', ['../victim.txt', '/tmp/victim.txt', 'sub/../../victim.txt'])
+def test_output_outside_output_dir_is_refused(service, payment_csv, order_csv, output):
+    url, output_dir = service
+    status, _ = post(f"{url}/reconcile", {'payments': str(payment_csv), 'order_file': str(order_csv),
+                                         'output': output})
+    assert status == 403
+    assert not (output_dir.parent / 'victim.txt').exists()
+
+
+def test_output_needs_an_output_dir(payment_csv, order_csv):
+    server = create_server(PaymentIndexPool(), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        status, _ = post(f"http://127.0.0.1:{server.server_address[1]}/reconcile",
+                         {'payments': str(payment_csv), 'order_file': str(order_csv), 'output': 'result.csv'})
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert status == 403
+
+
+def test_pool_forgets_build_locks(tmp_path, payment_csv):
+    pool = PaymentIndexPool()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        indexes = list(executor.map(lambda _: pool.get([str(payment_csv)]), range(8)))
+    assert all(index is indexes[0] for index in indexes)
+    assert pool.misses == 1 and pool.building == {}
+
+    # A failed build releases its lock too
+    unusable = tmp_path / 'unusable.csv'
+    unusable.write_text('商务订单号,业务类型\n1,收费\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        pool.get([str(unusable)])
+    assert pool.building == {}
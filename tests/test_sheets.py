@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from reconciler import Reconciler
+from utils import process_order_sheets, write_result_sheets
+
+
+@pytest.fixture
+def order_workbook(tmp_path, order_df):
+    path = tmp_path / 'orders.xlsx'
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        order_df.iloc[:4].to_excel(writer, sheet_name='门店A', index=False)
+        pd.DataFrame(columns=order_df.columns).to_excel(writer, sheet_name='空表', index=False)
+        order_df.iloc[4:].to_excel(writer, sheet_name='门店B', index=False)
+    return path
+
+
+def fees(sheet):
+    return [None if pd.isna(fee) else fee for fee in sheet['支付手续费']]
+
+
+@pytest.mark.parametrize('engine', ['row', 'vectorized'])
+def test_every_sheet_is_matched_and_written_back(tmp_path, order_workbook, payment_csv, order_df, engine):
+    expected = order_df.copy()
+    Reconciler(str(payment_csv)).fill(expected)
+    sheets = process_order_sheets(str(order_workbook), str(payment_csv), engine=engine)
+    assert list(sheets) == ['门店A', '空表', '门店B']
+    assert fees(sheets['门店A']) == fees(expected)[:4]
+    assert fees(sheets['门店B']) == fees(expected)[4:]
+    assert sheets['空表'].empty
+
+    output = tmp_path / 'result.xlsx'
+    write_result_sheets(sheets, output)
+    written = pd.read_excel(output, sheet_name=None, dtype={'订单号': str})
+    assert list(written) == ['门店A', '空表', '门店B']
+    assert fees(written['门店A']) == fees(expected)[:4]
+    assert written['空表'].empty and list(written['空表'].columns) == list(order_df.columns)
+
+
+def test_selected_sheets_are_matched_and_the_rest_kept(order_workbook, payment_csv, order_df):
+    sheets = process_order_sheets(str(order_workbook), str(payment_csv), ['门店B'])
+    assert list(sheets) == ['门店A', '空表', '门店B']
+    assert sheets['门店A']['支付手续费'].isna().all()
+    assert sheets['门店B']['支付手续费'].notna().any()
+
+
+def test_fill_sheets_counts_per_sheet(order_df, payment_df):
+    sheets = {'门店A': order_df.iloc[:4].copy(), '空表': order_df.iloc[:0].copy(), '门店B': order_df.iloc[4:].copy()}
+    counts = Reconciler(payment_df).fill_sheets(sheets)
+    assert [counts[name]['matched'] for name in sheets] == [4, 0, 0]
+    assert counts['门店B']['zero'] == 1 and counts['空表']['unmatched'] == 0
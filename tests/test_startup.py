@@ -0,0 +1,15 @@
+import pytest
+
+from benchmark import HEAVY_MODULES, STARTUP_CASES, measure_startup
+
+
+def test_subcommands_are_guarded():
+    for subcommand in ('batch', 'serve', 'history', 'watch'):
+        assert [subcommand, '--help'] in STARTUP_CASES.values()
+
+
+@pytest.mark.parametrize('name', sorted(STARTUP_CASES))
+def test_startup_cases_do_not_load_heavy_modules(name, monkeypatch):
+    monkeypatch.setattr('benchmark.STARTUP_CASES', {name: STARTUP_CASES[name]})
+    case = measure_startup(repeats=1)['cases'][name]
+    assert not set(case['heavy_imports']) & HEAVY_MODULES
@@ -0,0 +1,32 @@
+from openpyxl import Workbook, load_workbook
+
+from utils import PaymentIndex, stream_order_workbook
+
+
+def write_order_workbook(path, order_df, blank_tail_row=None):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(list(order_df.columns))
+    for row in order_df.itertuples(index=False):
+        sheet.append(list(row))
+    sheet.append([None] * len(order_df.columns))
+    sheet.append(['Q0000000000000000000000', 'X', 0, None])
+    if blank_tail_row is not None:
+        # Formatting far below the data stretches the declared dimension, as in ExcelForHandel/order.xlsx
+        sheet.cell(row=blank_tail_row, column=1).number_format = '0.00'
+    workbook.save(path)
+
+
+def test_stream_drops_trailing_blank_rows(tmp_path, order_df, payment_df):
+    order_file, output_file = tmp_path / 'order.xlsx', tmp_path / 'result.xlsx'
+    write_order_workbook(order_file, order_df, blank_tail_row=5000)
+    counts = stream_order_workbook(str(order_file), PaymentIndex(payment_df), output_file)
+
+    rows = list(load_workbook(output_file, read_only=True).worksheets[0].iter_rows(values_only=True))
+    # Header, the orders, the blank row between data rows, and the last order
+    assert len(rows) == 1 + len(order_df) + 2
+    assert all(value is None for value in rows[-2])
+    assert counts['matched'] == 4
+    # The blank row in between is kept and skipped, like pd.read_excel reads it
+    assert counts['skipped'] == 2
+    assert sum(counts[outcome] for outcome in ('matched', 'zero', 'unmatched', 'skipped')) == len(order_df) + 2
@@ -0,0 +1,29 @@
+import logging
+
+from openpyxl import Workbook, load_workbook
+
+from reconciler import Reconciler
+from utils import update_fee_column_in_place
+
+
+def test_update_cells_keeps_formulas(tmp_path, order_df, payment_df, caplog):
+    order_file = tmp_path / 'order.xlsx'
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(list(order_df.columns))
+    for row in order_df.itertuples(index=False):
+        sheet.append(list(row))
+    sheet['D2'] = '=C2*0.01'
+    sheet['E1'] = 'kept'
+    workbook.save(order_file)
+
+    Reconciler(payment_df).fill(order_df)
+    with caplog.at_level(logging.WARNING, logger='utils'):
+        changed = update_fee_column_in_place(order_df, order_file)
+
+    sheet = load_workbook(order_file).active
+    assert sheet['D2'].value == '=C2*0.01'
+    assert 'D2' in caplog.text
+    # The other matched and zero-amount rows are written
+    assert changed == 4
+    assert sheet['D3'].value == 2.0 and sheet['E1'].value == 'kept'
@@ -0,0 +1,62 @@
+import os
+
+import pandas as pd
+
+import watch
+from watch import FolderWatcher, PollingNotifier, create_notifier, main_watch, run_watch
+
+
+def count_reconciles(monkeypatch):
+    calls = []
+    reconcile_file = watch.reconcile_file
+
+    def counting(path, *args, **kwargs):
+        calls.append(path.name)
+        return reconcile_file(path, *args, **kwargs)
+    monkeypatch.setattr(watch, 'reconcile_file', counting)
+    return calls
+
+
+def test_notifier_falls_back_to_polling(monkeypatch, tmp_path):
+    def no_inotify(directory):
+        raise OSError(38, 'Function not implemented')
+    monkeypatch.setattr(watch, 'InotifyNotifier', no_inotify)
+    assert isinstance(create_notifier(tmp_path), PollingNotifier)
+    assert isinstance(create_notifier(tmp_path, polling=True), PollingNotifier)
+
+
+def test_polling_reconciles_new_and_changed_files_once(monkeypatch, tmp_path, order_df, payment_df):
+    calls = count_reconciles(monkeypatch)
+    inbox, results = tmp_path / 'inbox', tmp_path / 'results'
+    inbox.mkdir()
+    results.mkdir()
+    payment_df.to_csv(inbox / 'payment.csv', index=False, encoding='utf-8-sig')
+    order_file = inbox / 'order.csv'
+    order_df.to_csv(order_file, index=False, encoding='utf-8-sig')
+    watcher = FolderWatcher(inbox, results, settle_seconds=0)
+
+    run_watch(watcher, PollingNotifier(), poll_seconds=0, once=True)
+    assert calls == ['order.csv']
+    assert pd.read_csv(results / 'order.csv', encoding='utf-8-sig')['支付手续费'].notna().sum() == 5
+    # Nothing changed, so another pass reconciles nothing
+    run_watch(watcher, PollingNotifier(), poll_seconds=0, once=True)
+    assert calls == ['order.csv']
+
+    order_df.loc[len(order_df)] = ['B00000000000000000021234', 'X', 10, None]
+    order_df.to_csv(order_file, index=False, encoding='utf-8-sig')
+    stat = order_file.stat()
+    os.utime(order_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    run_watch(watcher, PollingNotifier(), poll_seconds=0, once=True)
+    assert calls == ['order.csv', 'order.csv']
+    assert len(pd.read_csv(results / 'order.csv', encoding='utf-8-sig')) == len(order_df)
+
+
+def test_once_processes_the_directory_and_exits(monkeypatch, tmp_path, order_df, payment_df, capsys):
+    calls = count_reconciles(monkeypatch)
+    payment_df.to_csv(tmp_path / 'payment.csv', index=False, encoding='utf-8-sig')
+    order_df.to_csv(tmp_path / 'order.csv', index=False, encoding='utf-8-sig')
+    (tmp_path / 'notes.txt').write_text('not a spreadsheet')
+    main_watch([str(tmp_path), '--once', '--settle', '0', '--output-dir', str(tmp_path / 'results')])
+    assert calls == ['order.csv']
+    assert (tmp_path / 'results' / 'order.csv').exists()
+    assert 'Watching' not in capsys.readouterr().out
@@ -4,12 +4,38 @@ This module contains common functions shared between the interactive and CLI ver
 """
 
 import pandas as pd
+import numpy as np
+import csv
+import importlib.util
 import os
 import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Any
+from typing import Optional, Any, Callable, Dict, Iterator, List, NamedTuple, Set, Tuple
 import logging
 
+from backends import detect_format, read_spreadsheet, write_spreadsheet, write_table, TABLE_FORMATS
+from constants import PAYMENT_COLUMNS, FEE_COLUMNS, PAYMENT_CHUNK_ROWS, MATCH_OUTCOMES, MATCH_METHODS, MATCH_ENGINES
+
+
+logger = logging.getLogger(__name__)
+
+# Compiled once; P followed by digits, e.g. P2507021103060001
+P_NUMBER_PATTERN = re.compile(r'P\d+')
+
+# Encodings tried in order when a CSV file has no byte order mark
+CSV_ENCODINGS = ['utf-8', 'gbk', 'gb2312', 'latin-1']
+CSV_SEPARATORS = [',', ';', '\t']
+CSV_SNIFF_BYTES = 64 * 1024
+# Identifier columns parsed as text so long numbers keep every digit
+CSV_KEY_COLUMNS = ['订单号', '商户订单号', '商务订单号', '账务流水号']
+# Columns shrunk by compact_dtypes
+TEXT_COLUMNS = ['订单号', '外部订单号', '商户订单号', '商品名称']
+AMOUNT_COLUMNS = ['订单金额', '支出金额（-元）', '收入金额（+元）']
+
 
 def extract_p_number(text: Any) -> Optional[str]:
     """
@@ -19,10 +45,22 @@ def extract_p_number(text: Any) -> Optional[str]:
         return None
     # Convert to string to handle numbers, then search for P pattern
     text_str = str(text)
-    match = re.search(r'P\d+', text_str)
+    match = P_NUMBER_PATTERN.search(text_str)
     return match.group() if match else None
 
 
+def hyphen_suffix(product_name: Any) -> Optional[str]:
+    """
+    The text after the last '-' in a product name, or None if it has no '-'
+    """
+    if pd.isna(product_name):
+        return None
+    product_str = str(product_name)
+    if '-' not in product_str:
+        return None
+    return product_str.split('-')[-1]
+
+
 def match_orders_by_p_number(external_order_no: Any, product_name: Any) -> bool:
     """
     Match external order number with product name based on P-number
@@ -35,85 +73,93 @@ def match_orders_by_p_number(external_order_no: Any, product_name: Any) -> bool:
     return False
 
 
-def read_file_with_appropriate_method(file_path: str) -> pd.DataFrame:
+def sniff_csv(file_path: str, sample_size: int = CSV_SNIFF_BYTES) -> Dict[str, Any]:
     """
-    Read a file using the appropriate pandas method based on its extension
+    Inspect the first few KB of a CSV file and decide how to parse it:
+    encoding (byte order mark first, then CSV_ENCODINGS), number of leading
+    '#' comment lines, delimiter, and the header row that follows the comments
     """
-    path = Path(file_path)
-    ext = path.suffix.lower()
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+        truncated = bool(f.read(1))
     
-    if ext == '.csv':
-        # For CSV files, try different encodings and parameters if default fails
-        encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1']
-        
-        # First, try to read the file content to check for # comment lines
-        for encoding in encodings:
-            try:
-                # Read the file as text to check for comment lines
-                with open(file_path, 'r', encoding=encoding) as f:
-                    lines = f.readlines()
-                
-                # Count how many lines start with # at the beginning
-                skip_rows = 0
-                for i, line in enumerate(lines):
-                    if line.strip().startswith('#'):
-                        skip_rows += 1
-                    else:
-                        break  # Stop at first line that doesn't start with #
-                
-                # If we need to skip rows, and row 4 exists (0-indexed as row 4 = 5th row), use it as header
-                if skip_rows > 0:
-                    df = pd.read_csv(file_path, encoding=encoding, skiprows=skip_rows, header=0)
-                else:
-                    # If no comment rows, use normal parsing
-                    df = pd.read_csv(file_path, encoding=encoding)
-                    if '订单号' in df.columns or '商户订单号' in df.columns:
-                        # If it has expected columns, it's likely parsed correctly
-                        break
-            except (UnicodeDecodeError, pd.errors.ParserError):
-                continue
-        
-        # If the above approach failed, use robust fallback
-        if 'df' not in locals():
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding)
-                    if '订单号' in df.columns or '商户订单号' in df.columns:
-                        break
-                except (UnicodeDecodeError, pd.errors.ParserError):
-                    pass
-                
-                # Try with different separators
-                for sep in [',', ';', '\t']:
-                    try:
-                        df = pd.read_csv(file_path, encoding=encoding, sep=sep)
-                        if '订单号' in df.columns or '商户订单号' in df.columns:
-                            break
-                    except:
-                        continue
-                if 'df' in locals():
-                    break
-                    
-                try:
-                    # Try with python engine which is more forgiving
-                    df = pd.read_csv(file_path, encoding=encoding, engine='python')
-                    if '订单号' in df.columns or '商户订单号' in df.columns:
-                        break
-                except:
-                    continue
-        
-        # If still no success, try with more robust parameters
-        if 'df' not in locals():
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding, engine='python', on_bad_lines='skip')
-                    break
-                except:
-                    continue
-        
-        # If all encodings failed, try with different parameters
-        if 'df' not in locals():
-            df = pd.read_csv(file_path, encoding='utf-8', engine='python', on_bad_lines='skip', sep=None)
+    if sample.startswith(b'\xef\xbb\xbf'):
+        candidates = ['utf-8-sig']
+    elif sample.startswith((b'\xff\xfe', b'\xfe\xff')):
+        candidates = ['utf-16']
+    else:
+        candidates = CSV_ENCODINGS
+    
+    # Don't let a multi-byte character cut at the sample boundary fail decoding
+    if truncated and b'\n' in sample:
+        sample = sample[:sample.rindex(b'\n') + 1]
+    
+    for encoding in candidates:
+        try:
+            text = sample.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        encoding, text = 'latin-1', sample.decode('latin-1')
+    
+    # Count how many lines start with # at the beginning; the next line is the header
+    lines = text.splitlines()
+    skip_rows = 0
+    for line in lines:
+        if line.strip().startswith('#'):
+            skip_rows += 1
+        else:
+            break  # Stop at first line that doesn't start with #
+    header = lines[skip_rows] if skip_rows < len(lines) else ''
+    
+    # The separator that splits the header into the most fields wins, comma on ties
+    sep = max(CSV_SEPARATORS, key=lambda candidate: (header.count(candidate), candidate == ','))
+    
+    # Quoted names are unquoted the way pandas parses the header row
+    return {'encoding': encoding, 'skip_rows': skip_rows, 'sep': sep, 'header': next(csv.reader([header], delimiter=sep), [])}
+
+
+def read_csv_sniffed(file_path: str, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Read a CSV file in a single parse using the settings found by sniff_csv.
+    Other encodings are only tried if the rest of the file fails to decode.
+    With usecols, only those columns (where present) are parsed.
+    """
+    dialect = sniff_csv(file_path)
+    logger.info("Sniffed %s: encoding=%s, comment lines=%d, delimiter=%r, header=%s",
+                file_path, dialect['encoding'], dialect['skip_rows'], dialect['sep'], dialect['header'])
+    
+    encodings = [dialect['encoding']] + [e for e in CSV_ENCODINGS if e != dialect['encoding']]
+    for encoding in encodings:
+        options = dict(encoding=encoding, sep=dialect['sep'], skiprows=dialect['skip_rows'], header=0,
+                       dtype={column: str for column in CSV_KEY_COLUMNS})
+        if usecols is not None:
+            options['usecols'] = lambda column: column in usecols
+        try:
+            return pd.read_csv(file_path, **options)
+        except UnicodeDecodeError:
+            logger.warning("%s is not valid %s beyond the sniffed sample, trying the next encoding", file_path, encoding)
+        except pd.errors.ParserError as e:
+            # Use python engine which is more forgiving, skipping malformed lines
+            logger.warning("Parsing %s failed (%s), retrying with the python engine and skipping bad lines", file_path, e)
+            return pd.read_csv(file_path, engine='python', on_bad_lines='skip', **options)
+    
+    raise ValueError(f"Could not decode CSV file '{file_path}' with any of {encodings}")
+
+
+def read_file_with_appropriate_method(file_path: str, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Read a file using the appropriate pandas method for its content. The
+    format is detected from the file's leading bytes, so an old .xls saved
+    as .xlsx or a workbook named .csv is still read correctly, and
+    spreadsheets are parsed with the fastest installed backend.
+    With usecols, only those columns (where present) are parsed.
+    """
+    file_format = detect_format(file_path)
+    
+    if file_format == 'csv':
+        df = read_csv_sniffed(file_path, usecols)
         
         # Ensure critical columns are treated as strings
         if '订单号' in df.columns:
@@ -124,211 +170,863 @@ def read_file_with_appropriate_method(file_path: str) -> pd.DataFrame:
             df['商务订单号'] = df['商务订单号'].astype(str)
             
         return df
-    elif ext in ['.xlsx', '.xls']:
-        # For Excel files
-        import zipfile
-        
-        # Determine engine based on file type
-        if ext == '.xlsx':
+    
+    select = (lambda column: column in usecols) if usecols is not None else None
+    return read_spreadsheet(file_path, file_format, dtype={column: str for column in CSV_KEY_COLUMNS}, usecols=select)
+
+
+def read_order_sheets(file_path: str, sheet_names: Optional[List[str]] = None,
+                      usecols: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Every sheet of a workbook, or those in sheet_names, keyed by sheet name
+    in workbook order, from a single parse of the file. Sheets are read as
+    read_file_with_appropriate_method reads the first one.
+    """
+    file_format = detect_format(file_path)
+    if file_format == 'csv':
+        raise ValueError(f"{file_path} is not a workbook, it has no sheets to select")
+    select = (lambda column: column in usecols) if usecols is not None else None
+    return read_spreadsheet(file_path, file_format, sheet_name=sheet_names,
+                            dtype={column: str for column in CSV_KEY_COLUMNS}, usecols=select)
+
+
+def column_values(df: pd.DataFrame, column: str, default: Any = None) -> list:
+    """
+    Values of a column as Python objects, or default for every row if it is missing
+    """
+    if column in df.columns:
+        return df[column].tolist()
+    return [default] * len(df)
+
+
+def _arrow_string_dtype() -> Optional[Any]:
+    """
+    Arrow-backed string dtype with NaN for missing values, or None without
+    pyarrow or on a pandas too old to offer one (columns then stay object)
+    """
+    if importlib.util.find_spec('pyarrow') is None:
+        return None
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+    except TypeError:
+        pass
+    try:
+        # pandas 2.1 and 2.2 spell the same dtype 'pyarrow_numpy'
+        return pd.StringDtype('pyarrow_numpy')
+    except (TypeError, ValueError):
+        # Older pandas only has 'pyarrow' storage with pd.NA, which the matching code does not expect
+        return None
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shrink the matching columns of a projected table in place: '业务类型'
+    becomes categorical, amount columns numeric (when every value converts)
+    and identifier columns Arrow-backed strings if pyarrow is installed
+    """
+    if '业务类型' in df.columns:
+        df['业务类型'] = df['业务类型'].astype('category')
+    for column in AMOUNT_COLUMNS:
+        if column in df.columns and not pd.api.types.is_numeric_dtype(df[column]):
             try:
-                with zipfile.ZipFile(path, 'r') as zip_file:
-                    # If it's a valid zip file, use openpyxl
-                    engine = 'openpyxl'
-            except zipfile.BadZipFile:
-                # If it's not a valid zip file, fall back to xlrd (sometimes older xls files have xlsx extension)
-                engine = 'xlrd'
-            except:
-                # For any other error, fall back to openpyxl
-                engine = 'openpyxl'
-        elif ext == '.xls':
-            engine = 'xlrd'
-        else:
-            engine = 'openpyxl'
-        
-        return pd.read_excel(file_path, dtype={'订单号': str, '商户订单号': str, '商务订单号': str}, engine=engine)
-    else:
-        # Default to Excel reading for unknown types (as before)
-        try:
-            return pd.read_excel(file_path, dtype={'订单号': str, '商户订单号': str, '商务订单号': str}, engine='openpyxl')
-        except:
-            # For CSV files with encoding issues, try different encodings
-            encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1']
-            df = None
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding)
-                    if '订单号' in df.columns:
-                        df['订单号'] = df['订单号'].astype(str)
-                    if '商户订单号' in df.columns:
-                        df['商户订单号'] = df['商户订单号'].astype(str)
-                    if '商务订单号' in df.columns:
-                        df['商务订单号'] = df['商务订单号'].astype(str)
-                    return df
-                except UnicodeDecodeError:
-                    continue  # Try next encoding
-            
-            # If all encodings failed, try with utf-8-sig
-            df = pd.read_csv(file_path, encoding='utf-8-sig')
-            if '订单号' in df.columns:
-                df['订单号'] = df['订单号'].astype(str)
-            if '商户订单号' in df.columns:
-                df['商户订单号'] = df['商户订单号'].astype(str)
-            if '商务订单号' in df.columns:
-                df['商务订单号'] = df['商务订单号'].astype(str)
-            return df
+                df[column] = pd.to_numeric(df[column])
+            except (ValueError, TypeError):
+                logger.info("Keeping '%s' as text, not every value is a number", column)
+    string_dtype = _arrow_string_dtype()
+    if string_dtype is not None:
+        for column in TEXT_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].astype(string_dtype)
+    return df
 
 
-def process_excel_files(order_file: str, payment_file: str, verbose: bool = False) -> pd.DataFrame:
+def read_payment_frame(payment_file: str, columns: List[str] = PAYMENT_COLUMNS) -> pd.DataFrame:
     """
-    Process two files (Excel or CSV) according to the specified matching logic.
-    Uses more efficient pandas operations instead of nested loops.
+    The payment statement reduced to columns (PAYMENT_COLUMNS) with compact dtypes
+    """
+    return compact_dtypes(read_file_with_appropriate_method(payment_file, usecols=columns))
+
+
+def require_payment_column(payment_df: pd.DataFrame, column: str = '商户订单号') -> None:
+    """
+    Raise a ValueError naming column if the payment table lacks it, instead of a bare KeyError
     """
-    # Read the files using the appropriate method
-    order_df = read_file_with_appropriate_method(order_file)
-    payment_df = read_file_with_appropriate_method(payment_file)
+    if column not in payment_df.columns:
+        raise ValueError(f"Payment file has no '{column}' column, so its rows cannot be matched")
+
+
+class PaymentIndex:
+    """
+    Hash index over payment/refund records, built once per payment file.
+
+    Rows are keyed by the first 20 characters of '商户订单号' and '业务类型',
+    so an order finds its exact match with a dictionary lookup instead of
+    scanning the whole payment table. Two inverted tables, keyed by the
+    P-number and by the text after the last '-' in '商品名称', serve the
+    fallback match the same way.
+
+    Because the first matching row with a fee always wins, each table only
+    keeps the first usable row per key. Memory therefore grows with the number
+    of distinct keys, and rows can be fed in blocks with add().
+    """
+
+    def __init__(self, payment_df: Optional[pd.DataFrame] = None):
+        self.row_count = 0
+        # Every prefix seen, whatever its business type; an order whose prefix
+        # appears here never falls back to the P-number/hyphen match
+        self.prefixes: Set[str] = set()
+        # (key, business type) -> position of the first row that can supply a fee
+        self.exact: Dict[Tuple[str, Any], int] = {}
+        self.by_p_number: Dict[Tuple[str, Any], int] = {}
+        self.by_hyphen_suffix: Dict[Tuple[str, Any], int] = {}
+        # Fee of every row referenced by the tables above
+        self.fees: Dict[int, Any] = {}
+        if payment_df is not None:
+            self.add(payment_df)
+
+    def add(self, payment_df: pd.DataFrame) -> None:
+        """
+        Index another block of payment rows, continuing the row positions
+        """
+        require_payment_column(payment_df)
+        prefixes = payment_df['商户订单号'].astype(str).str[:20]
+        business_types = column_values(payment_df, '业务类型', default='')
+        product_names = column_values(payment_df, '商品名称')
+        # A missing fee column behaves like Series.get() returning None
+        fee_values = {business_type: column_values(payment_df, column)
+                      for business_type, column in FEE_COLUMNS.items()}
+
+        for offset, (prefix, business_type, product_name) in enumerate(zip(prefixes, business_types, product_names)):
+            pos = self.row_count + offset
+            self.prefixes.add(prefix)
+
+            # Only charge/refund rows with a fee value (NaN counts, None does not) can ever be chosen
+            if business_type not in FEE_COLUMNS:
+                continue
+            fee = fee_values[business_type][offset]
+            if fee is None:
+                continue
+
+            keys = ((self.exact, prefix), (self.by_p_number, extract_p_number(product_name)),
+                    (self.by_hyphen_suffix, hyphen_suffix(product_name)))
+            for table, key in keys:
+                if key is not None and (key, business_type) not in table:
+                    table[(key, business_type)] = pos
+                    self.fees[pos] = fee
+
+        self.row_count += len(payment_df)
+
+    def merge(self, other: 'PaymentIndex') -> None:
+        """
+        Append the rows of another index after this one's, as if its payment
+        file had been added here; rows already indexed keep priority
+        """
+        offset = self.row_count
+        self.prefixes |= other.prefixes
+        tables = ((self.exact, other.exact), (self.by_p_number, other.by_p_number),
+                  (self.by_hyphen_suffix, other.by_hyphen_suffix))
+        for table, other_table in tables:
+            for key, pos in other_table.items():
+                if key not in table:
+                    table[key] = pos + offset
+                    self.fees[pos + offset] = other.fees[pos]
+        self.row_count += other.row_count
+
+    def lookup(self, order_no: str, external_order_no: Any, business_type: str) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Find the payment row for an order: exact prefix match first, then the
+        earliest P-number or hyphen-suffix match on '外部订单号'.
+        Returns (method, row position) with method 'exact', 'p_number' or
+        'hyphen', or (None, None) if no usable row matches.
+        """
+        if order_no in self.prefixes:
+            pos = self.exact.get((order_no, business_type))
+            return ('exact', pos) if pos is not None else (None, None)
+
+        candidates = []
+        external_p = extract_p_number(external_order_no)
+        if external_p is not None and (external_p, business_type) in self.by_p_number:
+            candidates.append((self.by_p_number[(external_p, business_type)], 'p_number'))
+        if pd.notna(external_order_no) and (str(external_order_no), business_type) in self.by_hyphen_suffix:
+            candidates.append((self.by_hyphen_suffix[(str(external_order_no), business_type)], 'hyphen'))
+        if not candidates:
+            return None, None
+        pos, method = min(candidates, key=lambda candidate: candidate[0])
+        return method, pos
+
+
+def iter_payment_chunks(payment_file: str, chunksize: int = PAYMENT_CHUNK_ROWS,
+                        columns: List[str] = PAYMENT_COLUMNS) -> Iterator[pd.DataFrame]:
+    """
+    Yield the payment statement in blocks of at most chunksize rows, keeping
+    only the columns matching needs (or the given columns). CSV files are
+    streamed with the sniffed dialect; Excel files are read in one go,
+    parsing only those columns.
+    """
+    if detect_format(payment_file) != 'csv':
+        yield read_payment_frame(payment_file, columns)
+        return
+
+    dialect = sniff_csv(payment_file)
+    logger.info("Streaming %s in chunks of %d rows: encoding=%s, comment lines=%d, delimiter=%r",
+                payment_file, chunksize, dialect['encoding'], dialect['skip_rows'], dialect['sep'])
+    with pd.read_csv(payment_file, encoding=dialect['encoding'], sep=dialect['sep'], skiprows=dialect['skip_rows'],
+                     header=0, usecols=lambda column: column in columns,
+                     dtype={**{column: str for column in CSV_KEY_COLUMNS}, '业务类型': 'category'},
+                     chunksize=chunksize) as reader:
+        yield from reader
+
+
+def load_payment_index(payment_file: str, chunksize: int = PAYMENT_CHUNK_ROWS) -> PaymentIndex:
+    """
+    Build a PaymentIndex from a payment file without holding the whole
+    statement in memory
+    """
+    payment_index = PaymentIndex()
+    try:
+        for chunk in iter_payment_chunks(payment_file, chunksize):
+            payment_index.add(chunk)
+    except (UnicodeDecodeError, pd.errors.ParserError) as e:
+        logger.warning("Streaming %s failed (%s), falling back to a full read", payment_file, e)
+        payment_index = PaymentIndex(read_file_with_appropriate_method(payment_file))
+    return payment_index
+
+
+def new_match_counts() -> Dict[str, int]:
+    """
+    Zeroed counters for every match outcome and every method a match can be made by
+    """
+    return dict.fromkeys(MATCH_OUTCOMES + MATCH_METHODS, 0)
+
+
+class OrderMatch(NamedTuple):
+    """
+    Outcome of matching one order: 'skipped' (order number shorter than 20
+    characters), 'zero' (zero amount, fee 0.0), 'matched' or 'unmatched'
+    """
+    outcome: str
+    method: Optional[str] = None
+    payment_row: Optional[int] = None
+    fee: Any = None
+    is_regular_order: Optional[bool] = None
+
+    @property
+    def fee_assigned(self) -> bool:
+        return self.outcome in ('zero', 'matched')
+
+
+def match_order(payment_index: PaymentIndex, original_order_no: Any, external_order_no: Any,
+                order_amount_raw: Any) -> OrderMatch:
+    """
+    Apply the matching rules to a single order against a PaymentIndex
+    """
+    # Get order number (first 20 characters); skip if it is shorter
+    if pd.isna(original_order_no) or len(str(original_order_no)) < 20:
+        return OrderMatch('skipped')
+    order_no = str(original_order_no)[:20]
+    
+    # Treat NaN and values that can't be converted to float as 0
+    order_amount = 0
+    if not pd.isna(order_amount_raw):
+        try:
+            order_amount = float(order_amount_raw)
+        except (ValueError, TypeError):
+            pass
+    
+    # Positive amounts = regular order, negative amounts = refund, amount = 0 = set 支付手续费 to 0
+    if order_amount == 0:
+        return OrderMatch('zero', fee=0.0)
+    is_regular_order = order_amount > 0
     
-    # Initialize the '支付手续费' column if it doesn't exist
+    # Exact match by truncated order number first, then P-number and hyphen logic.
+    # Regular orders use '支出金额（-元）' from '收费' rows, refund orders '收入金额（+元）' from '退费' rows
+    required_business_type = '收费' if is_regular_order else '退费'
+    method, p_pos = payment_index.lookup(order_no, external_order_no, required_business_type)
+    if p_pos is None:
+        return OrderMatch('unmatched', is_regular_order=is_regular_order)
+    return OrderMatch('matched', method, p_pos, payment_index.fees[p_pos], is_regular_order)
+
+
+def count_match(counts: Dict[str, int], result: OrderMatch) -> None:
+    counts[result.outcome] += 1
+    if result.method is not None:
+        counts[result.method] += 1
+
+
+def report_order_match(match_log: Any, idx: Any, original_order_no: Any, external_order_no: Any,
+                       order_amount_raw: Any, result: OrderMatch) -> None:
+    """
+    Send one order's result to the match log (a matchlog.MatchLog, if given)
+    and, at DEBUG level, to the logger
+    """
+    if match_log is not None:
+        match_log.record(idx, original_order_no, external_order_no, order_amount_raw, result.outcome,
+                         result.method, result.payment_row, result.fee)
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if result.outcome == 'skipped':
+        logger.debug("Row %s: skipped, order number %r is shorter than 20 characters", idx, original_order_no)
+    elif result.outcome == 'zero':
+        logger.debug("Row %s: order amount is 0, 支付手续费 set to 0", idx)
+    elif result.outcome == 'matched':
+        order_kind = 'regular' if result.is_regular_order else 'refund'
+        logger.debug("Row %s: %s order %s matched via %s at payment row %s, 支付手续费 %s",
+                     idx, order_kind, original_order_no, result.method, result.payment_row, result.fee)
+    else:
+        logger.debug("Row %s: no payment found for order %s (外部订单号 %s, amount %s)",
+                     idx, original_order_no, external_order_no, order_amount_raw)
+
+
+def wants_order_records(match_log: Any) -> bool:
+    """
+    Whether per-order results are consumed: by a match log or by DEBUG logging
+    """
+    return match_log is not None or logger.isEnabledFor(logging.DEBUG)
+
+
+class OrderMatches(NamedTuple):
+    """
+    Results of matching a whole order table, one entry per row in row order
+    (object arrays). fees holds the value '支付手续费' is set to where the
+    outcome is 'zero' or 'matched'; regular is True for regular orders and
+    False for refunds among matched and unmatched rows, None elsewhere.
+    """
+    outcomes: np.ndarray
+    methods: np.ndarray
+    payment_rows: np.ndarray
+    fees: np.ndarray
+    regular: np.ndarray
+    counts: Dict[str, int]
+
+    @property
+    def assigned(self) -> np.ndarray:
+        return (self.outcomes == 'zero') | (self.outcomes == 'matched')
+
+    def result(self, pos: int) -> OrderMatch:
+        return OrderMatch(self.outcomes[pos], self.methods[pos], self.payment_rows[pos], self.fees[pos],
+                          self.regular[pos])
+
+    def rows(self, start: int, stop: int) -> 'OrderMatches':
+        """
+        The results of rows start to stop - 1, with their own counts
+        """
+        counts = new_match_counts()
+        for pos in range(start, stop):
+            count_match(counts, self.result(pos))
+        return OrderMatches(self.outcomes[start:stop], self.methods[start:stop], self.payment_rows[start:stop],
+                            self.fees[start:stop], self.regular[start:stop], counts)
+
+
+def collect_order_matches(results: List[OrderMatch], counts: Dict[str, int]) -> OrderMatches:
+    """
+    OrderMatches from per-order results, as produced by match_order()
+    """
+    columns = list(zip(*results)) if results else [()] * len(OrderMatch._fields)
+    return OrderMatches(*(np.array(column, dtype=object) for column in columns), counts)
+
+
+def concat_order_matches(parts: List[OrderMatches]) -> OrderMatches:
+    """
+    One OrderMatches for consecutive row ranges that were matched separately
+    """
+    counts = new_match_counts()
+    for part in parts:
+        for key, count in part.counts.items():
+            counts[key] += count
+    if not parts:
+        return collect_order_matches([], counts)
+    # Every field but counts is a per-row array
+    return OrderMatches(*(np.concatenate([getattr(part, field) for part in parts])
+                          for field in OrderMatches._fields[:-1]), counts)
+
+
+def log_match_counts(label: str, counts: Dict[str, int]) -> None:
+    logger.info("%s: %d matched (%d exact, %d P-number, %d hyphen), %d zero-amount, %d unmatched, %d skipped",
+                label, counts['matched'], counts['exact'], counts['p_number'], counts['hyphen'], counts['zero'],
+                counts['unmatched'], counts['skipped'])
+
+
+def run_concurrently(first: Callable[[], Any], second: Callable[[], Any]) -> Tuple[Any, Any]:
+    """
+    Run two independent loads at once, second in a helper thread, and return
+    both results. Parsing and decompression release the GIL for much of the
+    work, so this takes about as long as the slower of the two.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        second_result = executor.submit(second)
+        return first(), second_result.result()
+
+
+def assign_fees(order_df: pd.DataFrame, positions: Any, fees: Any) -> None:
+    """
+    Set '支付手续费' for the given row positions in a single column assignment
+    """
+    values = order_df['支付手续费'].to_numpy(dtype=object, copy=True)
+    values[np.asarray(positions, dtype=np.intp)] = np.asarray(fees, dtype=object)
+    order_df['支付手续费'] = pd.Series(values, index=order_df.index).infer_objects()
+
+
+# Joins a matching key and '业务类型' into one lookup key; neither contains it
+KEY_SEPARATOR = '\x1f'
+
+
+def _first_candidates(orders: pd.DataFrame, table: Tuple[pd.Index, np.ndarray], key: str) -> pd.DataFrame:
+    """
+    Look up orders in a first-row table of payment_match_keys on (key,
+    '业务类型') and return the (order position, payment position) pairs found
+    """
+    index, positions = table
+    left = orders[['order_pos', key, 'business_type']].dropna(subset=[key])
+    found = index.get_indexer(left[key].astype(str) + KEY_SEPARATOR + left['business_type'])
+    hit = found >= 0
+    return pd.DataFrame({'order_pos': left['order_pos'].to_numpy()[hit], 'payment_pos': positions[found[hit]]})
+
+
+def apply_order_matches(order_df: pd.DataFrame, matches: OrderMatches) -> None:
+    """
+    Write the fees of matched and zero-amount orders to '支付手续费' in a
+    single column assignment, creating the column if needed
+    """
     if '支付手续费' not in order_df.columns:
         order_df['支付手续费'] = None
+    assigned = matches.assigned
+    assign_fees(order_df, np.flatnonzero(assigned), matches.fees[assigned])
+
+
+class PaymentKeys(NamedTuple):
+    """
+    The payment side of vectorized_order_matches, built once per payment
+    table by payment_match_keys(). tables maps 'prefix', 'p_number' and
+    'hyphen_suffix' to a unique index of (key, '业务类型') lookup keys and
+    the position of the first row with a fee for each; fee_values holds the
+    fee of every row per business type and prefixes every prefix seen.
+    """
+    tables: Dict[str, Tuple[pd.Index, np.ndarray]]
+    fee_values: Dict[str, np.ndarray]
+    prefixes: Set[str]
+
+
+def payment_match_keys(payment_df: pd.DataFrame) -> PaymentKeys:
+    """
+    Prefix, P-number and hyphen-suffix keys of payment_df for vectorized_order_matches
+    """
+    require_payment_column(payment_df)
+    payment_prefix = payment_df['商户订单号'].astype(str).str[:20]
+    if '业务类型' in payment_df.columns:
+        business_types = payment_df['业务类型']
+    else:
+        business_types = pd.Series('', index=payment_df.index)
+    if '商品名称' in payment_df.columns:
+        product = payment_df['商品名称']
+    else:
+        product = pd.Series(None, index=payment_df.index, dtype=object)
+    product_str = product.astype(str).where(product.notna())
+
+    fee_values = {}
+    has_fee = np.zeros(len(payment_df), dtype=bool)
+    for business_type, column in FEE_COLUMNS.items():
+        if column not in payment_df.columns:
+            fee_values[business_type] = np.full(len(payment_df), None, dtype=object)
+            continue
+        fee_values[business_type] = payment_df[column].to_numpy(dtype=object)
+        # Same rule as the row engine: NaN is a usable fee, only None is skipped
+        present = np.fromiter((v is not None for v in fee_values[business_type]), dtype=bool, count=len(payment_df))
+        has_fee |= (business_types == business_type).to_numpy() & present
+
+    payments = pd.DataFrame({
+        'payment_pos': np.arange(len(payment_df)),
+        'prefix': payment_prefix.to_numpy(),
+        'p_number': product_str.str.extract(r'(P\d+)', expand=False).to_numpy(),
+        'hyphen_suffix': product_str.str.rsplit('-', n=1).str[-1].where(product_str.str.contains('-', regex=False, na=False)).to_numpy(),
+        'business_type': business_types.to_numpy(),
+    })[has_fee]
+    # Only the earliest row per key can ever win, so each table keeps just that row, as PaymentIndex does
+    tables = {}
+    for key in ('prefix', 'p_number', 'hyphen_suffix'):
+        first = payments.dropna(subset=[key]).drop_duplicates([key, 'business_type'])
+        tables[key] = (pd.Index(first[key].astype(str) + KEY_SEPARATOR + first['business_type'].astype(str)),
+                       first['payment_pos'].to_numpy())
+    return PaymentKeys(tables, fee_values, set(payment_prefix))
+
+
+def vectorized_order_matches(order_df: pd.DataFrame, payment_df: pd.DataFrame, match_log: Any = None,
+                             keys: Optional[PaymentKeys] = None) -> OrderMatches:
+    """
+    Columnar equivalent of index_order_matches. Orders are classified in
+    bulk, then their (key, '业务类型') strings are looked up with
+    pd.Index.get_indexer in the prefix, P-number and hyphen-suffix tables of
+    payment_match_keys. Each table holds only the earliest payment row with a
+    fee per key, so a hit is the first match, as in PaymentIndex; between a
+    P-number and a hyphen-suffix hit the earlier payment row wins. order_df
+    is only read. keys, if given, are payment_match_keys(payment_df)
+    computed beforehand, so they can be shared by several calls.
+    """
+    # Orders: the 20-char prefix, business type implied by the amount sign, and fallback keys
+    if '订单号' in order_df.columns:
+        order_nos = order_df['订单号']
+    else:
+        order_nos = pd.Series('', index=order_df.index)
+    order_str = order_nos.astype(str)
+    valid = (order_nos.notna() & (order_str.str.len().fillna(0) >= 20)).to_numpy()
+
+    if '订单金额' in order_df.columns:
+        amounts = pd.to_numeric(order_df['订单金额'], errors='coerce').fillna(0).to_numpy()
+    else:
+        amounts = np.zeros(len(order_df))
+    is_zero = valid & (amounts == 0)
+    is_regular = amounts > 0
+    to_match = valid & (amounts != 0)
+
+    if '外部订单号' in order_df.columns:
+        external = order_df['外部订单号']
+    else:
+        external = pd.Series(None, index=order_df.index, dtype=object)
+    external_str = external.astype(str).where(external.notna())
+
+    orders = pd.DataFrame({
+        'order_pos': np.arange(len(order_df)),
+        'prefix': order_str.str[:20].to_numpy(),
+        'p_number': external_str.str.extract(r'(P\d+)', expand=False).to_numpy(),
+        'hyphen_suffix': external_str.to_numpy(),
+        'business_type': np.where(is_regular, '收费', '退费'),
+    })[to_match]
+
+    # Payments: the same keys, restricted to rows that can supply a fee for their type
+    tables, fee_values, payment_prefixes = keys if keys is not None else payment_match_keys(payment_df)
+
+    # Exact prefix matches take priority; only orders whose prefix never appears fall back
+    has_prefix = orders['prefix'].isin(payment_prefixes)
+    candidates = pd.concat([
+        _first_candidates(orders[has_prefix], tables['prefix'], 'prefix').assign(method='exact'),
+        _first_candidates(orders[~has_prefix], tables['p_number'], 'p_number').assign(method='p_number'),
+        _first_candidates(orders[~has_prefix], tables['hyphen_suffix'], 'hyphen_suffix').assign(method='hyphen'),
+    ])
+    # The earliest payment row wins; on a tie the P-number candidate comes first, as in PaymentIndex.lookup
+    first_match = candidates.sort_values('payment_pos', kind='stable').drop_duplicates('order_pos')
+
+    matched_orders = first_match['order_pos'].to_numpy()
+    matched_payments = first_match['payment_pos'].to_numpy()
+    matched_fees = np.where(
+        is_regular[matched_orders],
+        fee_values['收费'][matched_payments],
+        fee_values['退费'][matched_payments],
+    )
+    counts = new_match_counts()
+    counts.update(first_match['method'].value_counts().to_dict())
+    counts.update(matched=len(matched_orders), zero=int(is_zero.sum()),
+                  unmatched=int(to_match.sum()) - len(matched_orders), skipped=int((~valid).sum()))
+
+    outcomes = np.where(valid, 'unmatched', 'skipped').astype(object)
+    outcomes[is_zero] = 'zero'
+    outcomes[matched_orders] = 'matched'
+    methods = np.full(len(order_df), None, dtype=object)
+    methods[matched_orders] = first_match['method'].to_numpy()
+    payment_rows = np.full(len(order_df), None, dtype=object)
+    payment_rows[matched_orders] = matched_payments
+    fees = np.full(len(order_df), None, dtype=object)
+    fees[is_zero] = 0.0
+    fees[matched_orders] = matched_fees
+    regular = np.full(len(order_df), None, dtype=object)
+    regular[to_match] = is_regular[to_match].tolist()
+    matches = OrderMatches(outcomes, methods, payment_rows, fees, regular, counts)
+
+    # Per-order records are only assembled when someone consumes them
+    if wants_order_records(match_log):
+        rows = zip(order_df.index, column_values(order_df, '订单号', default=''), column_values(order_df, '外部订单号'),
+                   column_values(order_df, '订单金额', default=0))
+        for pos, (idx, order_no, external_order_no, amount) in enumerate(rows):
+            report_order_match(match_log, idx, order_no, external_order_no, amount, matches.result(pos))
+    return matches
+
+
+def fill_fees_vectorized(order_df: pd.DataFrame, payment_df: pd.DataFrame, match_log: Any = None) -> Dict[str, int]:
+    """
+    Fill '支付手续费' of order_df in place with vectorized_order_matches and
+    return the number of orders per match outcome and method
+    """
+    matches = vectorized_order_matches(order_df, payment_df, match_log)
+    apply_order_matches(order_df, matches)
+    return matches.counts
+
+
+def match_orders_vectorized(order_df: pd.DataFrame, payment_df: pd.DataFrame, match_log: Any = None) -> pd.DataFrame:
+    """
+    Fill '支付手续费' of order_df in bulk with fill_fees_vectorized and return it
+    """
+    counts = fill_fees_vectorized(order_df, payment_df, match_log)
+    log_match_counts("Vectorized matching", counts)
+    return order_df
+
+
+class FeeChanges:
+    """
+    Records the rows of an order table whose '支付手续费' a run changed,
+    for a delta output holding just those rows (cli.py --delta).
+    Missing values (None, NaN) count as equal to each other.
+    """
+
+    def __init__(self) -> None:
+        self.previous_fees: Optional[pd.Series] = None
+        self.positions = np.array([], dtype=np.intp)
+
+    def before(self, order_df: pd.DataFrame) -> None:
+        if '支付手续费' in order_df.columns:
+            self.previous_fees = order_df['支付手续费'].copy()
+        else:
+            self.previous_fees = pd.Series(None, index=order_df.index, dtype=object)
+
+    def after(self, order_df: pd.DataFrame) -> None:
+        previous = self.previous_fees.to_numpy(dtype=object)
+        current = order_df['支付手续费'].to_numpy(dtype=object)
+        self.positions = np.flatnonzero((previous != current) & ~(pd.isna(previous) & pd.isna(current)))
+
+    def frame(self, order_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        The changed rows with their position in the order table ('order_row')
+        and the fee they had before ('previous_fee')
+        """
+        delta = order_df.iloc[self.positions].copy()
+        delta.insert(0, 'order_row', self.positions)
+        delta['previous_fee'] = self.previous_fees.to_numpy(dtype=object)[self.positions]
+        return delta
+
+
+def process_excel_files(order_file: str, payment_file: str, engine: str = 'row', chunksize: int = PAYMENT_CHUNK_ROWS,
+                        workers: int = 1, cache: Any = None, profiler: Any = None, match_log: Any = None,
+                        order_columns: Optional[List[str]] = None, changes: Optional[FeeChanges] = None,
+                        checkpoint: Any = None) -> pd.DataFrame:
+    """
+    Process two files (Excel or CSV) according to the specified matching logic.
+    Uses more efficient pandas operations instead of nested loops.
+    The 'row' engine streams the payment file into a PaymentIndex chunksize
+    rows at a time and, with workers other than 1, matches row-range shards
+    in separate processes; the 'vectorized' engine resolves all orders at once
+    with vectorized_order_matches. Matching goes through a reconciler.Reconciler
+    built from payment_file. Given a cache.ParseCache, the parsed payment
+    file is reused across runs while its content is unchanged. Given a
+    profiling.RunProfiler, the read and match stages are measured; given a
+    matchlog.MatchLog, one record per order is written to it; given a
+    FeeChanges, the rows whose fee changed are recorded in it; given a
+    checkpoint.Checkpoint, orders are matched in chunks whose results are
+    saved to it as they complete. A summary is logged at INFO level and every
+    order at DEBUG level.
+    The whole order sheet is returned for writing back unless order_columns
+    (e.g. ORDER_COLUMNS) limits it; the payment file is always reduced to
+    PAYMENT_COLUMNS.
+    """
+    from profiling import profile_stage
+    from reconciler import Reconciler
+    if engine not in MATCH_ENGINES:
+        raise ValueError(f"Unknown matching engine '{engine}', expected one of {MATCH_ENGINES}")
+
+    def read_orders() -> pd.DataFrame:
+        with profile_stage(profiler, 'read_orders') as stage:
+            order_df = read_file_with_appropriate_method(order_file, usecols=order_columns)
+            if order_columns is not None:
+                compact_dtypes(order_df)
+            stage['rows'] = len(order_df)
+        return order_df
+
+    def read_payments() -> Any:
+        with profile_stage(profiler, 'read_payments') as stage:
+            reconciler = Reconciler(payment_file, engine, chunksize, cache, workers)
+            stage['rows'] = reconciler.payment_rows
+        return reconciler
+
+    # The two files are independent, so the payment side is loaded while the order file parses
+    order_df, reconciler = run_concurrently(read_orders, read_payments)
+
+    with profile_stage(profiler, 'match') as stage:
+        if changes is not None:
+            changes.before(order_df)
+        if checkpoint is not None:
+            counts = checkpoint.fill(reconciler, order_df, match_log)
+        else:
+            counts = reconciler.fill(order_df, match_log)
+        if changes is not None:
+            changes.after(order_df)
+        stage.update(rows=len(order_df), counts=counts)
+    log_match_counts("Vectorized matching" if engine == 'vectorized' else "Matching", counts)
+    return order_df
+
+
+def process_order_sheets(order_file: str, payment_file: str, sheet_names: Optional[List[str]] = None,
+                         engine: str = 'row', chunksize: int = PAYMENT_CHUNK_ROWS, workers: int = 1, cache: Any = None,
+                         profiler: Any = None, match_log: Any = None,
+                         order_columns: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    process_excel_files for a workbook with several order sheets. The
+    sheets in sheet_names (all by default) are matched against one
+    reconciler.Reconciler with Reconciler.fill_sheets and their '支付手续费'
+    filled in place. Every sheet is returned, in workbook order, so the
+    workbook can be written back whole; with order_columns only the
+    selected sheets are read, and only those columns.
+    """
+    from profiling import profile_stage
+    from reconciler import Reconciler
+    if engine not in MATCH_ENGINES:
+        raise ValueError(f"Unknown matching engine '{engine}', expected one of {MATCH_ENGINES}")
+
+    def read_orders() -> Dict[str, pd.DataFrame]:
+        with profile_stage(profiler, 'read_orders') as stage:
+            # Unselected sheets are only needed to write the whole workbook back
+            sheets = read_order_sheets(order_file, sheet_names if order_columns is not None else None, order_columns)
+            stage['rows'] = sum(len(sheet) for sheet in sheets.values())
+        return sheets
+
+    def read_payments() -> Any:
+        with profile_stage(profiler, 'read_payments') as stage:
+            reconciler = Reconciler(payment_file, engine, chunksize, cache, workers)
+            stage['rows'] = reconciler.payment_rows
+        return reconciler
+
+    sheets, reconciler = run_concurrently(read_orders, read_payments)
+    selected = list(sheets) if sheet_names is None else list(sheet_names)
+    missing = [name for name in selected if name not in sheets]
+    if missing:
+        raise ValueError(f"Worksheet(s) not found in {order_file}: {', '.join(missing)}")
+
+    with profile_stage(profiler, 'match') as stage:
+        sheet_counts = reconciler.fill_sheets({name: sheets[name] for name in selected}, match_log)
+        stage.update(rows=sum(len(sheets[name]) for name in selected), counts=sheet_counts)
+    for name, counts in sheet_counts.items():
+        log_match_counts(f"Sheet {name}", counts)
+    return sheets
+
+
+def index_order_matches(order_df: pd.DataFrame, payment_index: PaymentIndex, match_log: Any = None) -> OrderMatches:
+    """
+    Match every row of order_df against a prebuilt PaymentIndex, one
+    match_order() call per row. order_df is only read.
+    """
+    counts = new_match_counts()
+    results = []
+    # Process each row in the order dataframe
+    columns = zip(order_df.index,
+                  column_values(order_df, '订单号', default=''),
+                  column_values(order_df, '外部订单号'),
+                  column_values(order_df, '订单金额', default=0))
+    for idx, original_order_no, external_order_no, order_amount_raw in columns:
+        result = match_order(payment_index, original_order_no, external_order_no, order_amount_raw)
+        count_match(counts, result)
+        report_order_match(match_log, idx, original_order_no, external_order_no, order_amount_raw, result)
+        results.append(result)
+    return collect_order_matches(results, counts)
+
+
+def fill_fees_from_index(order_df: pd.DataFrame, payment_index: PaymentIndex, match_log: Any = None) -> Dict[str, int]:
+    """
+    Fill the '支付手续费' column of order_df in place from a prebuilt
+    PaymentIndex. Returns the number of orders per match outcome and method.
+    """
+    matches = index_order_matches(order_df, payment_index, match_log)
+    apply_order_matches(order_df, matches)
+    return matches.counts
+
+
+def _cell_text(value: Any) -> Optional[str]:
+    """
+    Convert an identifier cell read by openpyxl the way read_excel(dtype=str) does
+    """
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+@contextmanager
+def atomic_output(file_path: Path) -> Iterator[Path]:
+    """
+    A temporary path next to file_path, with the same extension, that is
+    renamed over file_path once the block completes. If writing fails, the
+    temporary file is removed and file_path is left as it was.
+    """
+    file_path = Path(file_path)
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{file_path.stem}.', suffix=file_path.suffix, dir=file_path.parent)
+    os.close(fd)
+    try:
+        yield Path(temp_path)
+        # mkstemp makes the file private; keep the permissions the output had, or would have had
+        if file_path.exists():
+            shutil.copymode(file_path, temp_path)
+        else:
+            os.chmod(temp_path, 0o666 & ~_umask())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def stream_order_workbook(order_file: str, payment_index: PaymentIndex, output_file: Path,
+                          match_log: Any = None) -> Dict[str, int]:
+    """
+    Fill '支付手续费' in an .xlsx order workbook without loading it into a
+    DataFrame. The first sheet is read row by row in openpyxl's read-only mode
+    and the result is written in write-only mode, so memory stays roughly
+    constant however many rows the order file has. Returns the number of
+    orders per match outcome and method.
+    """
+    from openpyxl import Workbook, load_workbook
     
-    if verbose:
-        print("Starting matching process...")
+    counts = new_match_counts()
     
-    # Process each row in the order dataframe
-    for idx, order_row in order_df.iterrows():
-        if verbose:
-            print(f"\n--- Processing Order Row {idx} ---")
-            print(f"  Full Order Number: {order_row.get('订单号', 'N/A')}")
-            print(f"  External Order Number: {order_row.get('外部订单号', 'N/A')}")
-
-        # Get order number (first 20 characters)
-        original_order_no = order_row.get('订单号', '')
-        if pd.isna(original_order_no) or len(str(original_order_no)) < 20:
-            if verbose:
-                print(f"Row {idx}: Skipped - Order number less than 20 characters: {original_order_no}")
-            continue  # Skip if order number is less than 20 characters
+    # Saved next to the destination and swapped in afterwards, so the order file itself can be the output
+    with atomic_output(output_file) as temp_path:
+        source = load_workbook(order_file, read_only=True)
+        try:
+            sheet = source.worksheets[0]
+            rows = sheet.iter_rows(values_only=True)
+            header = list(next(rows, ()))
+            if '支付手续费' not in header:
+                header.append('支付手续费')
+            columns = {name: header.index(name) for name in ('订单号', '外部订单号', '订单金额') if name in header}
+            fee_column = header.index('支付手续费')
             
-        order_no = str(original_order_no)[:20] 
-        external_order_no = order_row.get('外部订单号', None)
-        
-        if verbose:
-            print(f"  Truncated Order Number (first 20 chars): {order_no}")
+            target = Workbook(write_only=True)
+            target_sheet = target.create_sheet(sheet.title)
+            target_sheet.append(header)
             
-        # Determine if it's a regular order, refund order, or skip
-        order_amount_raw = order_row.get('订单金额', 0)
-        if verbose:
-            print(f"  Raw Order Amount: {order_amount_raw}")
-        
-        if pd.isna(order_amount_raw):
-            order_amount = 0  # Treat NaN as 0
-            if verbose:
-                print("  Order amount is NaN, setting to 0")
-        else:
-            # Ensure it's a numeric value to avoid issues with string values
-            try:
-                order_amount = float(order_amount_raw)
-                if verbose:
-                    print(f"  Converted Order Amount: {order_amount}")
-            except (ValueError, TypeError):
-                order_amount = 0  # Default to 0 if conversion fails
-                if verbose:
-                    print(f"  Failed to convert amount '{order_amount_raw}' to float, setting to 0")
-        
-        # Updated logic: positive amounts > 0 = regular order, negative amounts < 0 = refund, amount = 0 = set 支付手续费 to 0
-        if order_amount > 0:
-            is_regular_order = True
-            order_type = "正单(Regular)"
-        elif order_amount < 0:
-            is_regular_order = False
-            order_type = "退单(Refund)"
-        else:  # order_amount == 0
-            if verbose:
-                print(f"Row {idx}: Order amount is 0, setting 支付手续费 to 0")
-            order_df.at[idx, '支付手续费'] = 0.0
-            continue  # Skip further processing for this row but set the fee to 0
-        
-        if verbose:
-            print(f"Row {idx}: Processing - Order No: {order_no}, External Order: {external_order_no}, Amount: {order_amount} ({order_type})")
-        
-        # Find matching records in payment dataframe using vectorized operations where possible
-        matching_payments = []
-        
-        # First, try to find exact matches by truncated order number
-        business_order_numbers = payment_df['商户订单号'].astype(str)
-        exact_matches = business_order_numbers.str[:20] == order_no
-        exact_match_rows = payment_df[exact_matches]
-        
-        # For non-exact matches, check P-number and hyphen logic
-        if len(exact_match_rows) == 0:
-            for p_idx, payment_row in payment_df.iterrows():
-                # Try P-number match
-                product_name = payment_row.get('商品名称', None)
-                p_number_match = match_orders_by_p_number(external_order_no, product_name)
+            def write_row(idx: int, row: Tuple[Any, ...]) -> None:
+                values = list(row) + [None] * (len(header) - len(row))
                 
-                # Try hyphen match
-                hyphen_match = False
-                if pd.notna(product_name) and pd.notna(external_order_no):
-                    product_str = str(product_name)
-                    if '-' in product_str:
-                        product_after_hyphen = product_str.split('-')[-1]
-                        hyphen_match = str(external_order_no) == product_after_hyphen
+                def cell(name: str, default: Any) -> Any:
+                    return values[columns[name]] if name in columns else default
                 
-                # Check business type
-                business_type = payment_row.get('业务类型', '')
-                business_type_correct = (
-                    (is_regular_order and business_type == '收费') or 
-                    (not is_regular_order and business_type == '退费')
-                )
-                
-                if verbose and (p_number_match or hyphen_match):
-                    print(f"      Match found via P-number or hyphen: P={p_number_match}, Hyphen={hyphen_match}")
-                
-                if ((p_number_match or hyphen_match) and business_type_correct):
-                    matching_payments.append(payment_row)
-                    if verbose:
-                        print(f"    - Match confirmed at payment row {p_idx}")
-        else:
-            # Handle exact matches
-            for p_idx, payment_row in exact_match_rows.iterrows():
-                # Check business type
-                business_type = payment_row.get('业务类型', '')
-                business_type_correct = (
-                    (is_regular_order and business_type == '收费') or 
-                    (not is_regular_order and business_type == '退费')
-                )
-                
-                if business_type_correct:
-                    matching_payments.append(payment_row)
-                    if verbose:
-                        print(f"    - Exact match confirmed at payment row {p_idx} with correct business type")
-        
-        # If matches found, get the appropriate amount and update '支付手续费'
-        if matching_payments:
-            if is_regular_order:
-                # For regular order, use '支出金额（-元）'
-                for payment in matching_payments:
-                    expenditure = payment.get('支出金额（-元）', None)
-                    if expenditure is not None:
-                        order_df.at[idx, '支付手续费'] = expenditure
-                        if verbose:
-                            print(f"  - Updated 支付手续费 for regular order: {expenditure}")
-                        break  # Use first match
-            else:
-                # For refund order, use '收入金额（+元）'
-                for payment in matching_payments:
-                    income = payment.get('收入金额（+元）', None)
-                    if income is not None:
-                        order_df.at[idx, '支付手续费'] = income
-                        if verbose:
-                            print(f"  - Updated 支付手续费 for refund order: {income}")
-                        break  # Use first match
-        else:
-            if verbose:
-                print(f"  - No matches found for this order")
-    
-    if verbose:
-        print("Matching process completed.")
-    return order_df
+                order_no = _cell_text(cell('订单号', ''))
+                result = match_order(payment_index, order_no, cell('外部订单号', None), cell('订单金额', 0))
+                count_match(counts, result)
+                report_order_match(match_log, idx, order_no, cell('外部订单号', None), cell('订单金额', 0), result)
+                if result.fee_assigned:
+                    # NaN fees are written as empty cells, like to_excel does
+                    values[fee_column] = None if pd.isna(result.fee) else result.fee
+                target_sheet.append(values)
+            
+            # Read-only sheets run to their declared dimension, which can reach row 1048576. Like
+            # pd.read_excel, blank rows are kept between data rows but dropped after the last one.
+            idx = blank_rows = 0
+            for row in rows:
+                if all(value is None for value in row):
+                    blank_rows += 1
+                    continue
+                for _ in range(blank_rows):
+                    write_row(idx, ())
+                    idx += 1
+                blank_rows = 0
+                write_row(idx, row)
+                idx += 1
+            target.save(temp_path)
+        finally:
+            # Closed before atomic_output swaps the result in: Windows cannot replace a file that is still open
+            source.close()
+    return counts
 
 
 def find_file_path(filename: str) -> Path:
@@ -350,34 +1048,97 @@ def find_file_path(filename: str) -> Path:
     return Path(filename)
 
 
+def update_fee_column_in_place(df: pd.DataFrame, order_file: Path, output_file: Optional[Path] = None) -> int:
+    """
+    Write the '支付手续费' column of df back into the original .xlsx order
+    workbook, touching only the cells whose value changed. Formatting, other
+    sheets, formulas and column widths are left as they are; 支付手续费
+    cells holding a formula are not overwritten (they are logged instead). The workbook is
+    saved to output_file, or over order_file if none is given.
+    Returns the number of cells written.
+    """
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(order_file)
+    changed = _write_fee_cells(workbook.worksheets[0], df)
+    with atomic_output(output_file if output_file is not None else order_file) as temp_path:
+        workbook.save(temp_path)
+    return changed
+
+
+def update_fee_columns_in_place(sheets: Dict[str, pd.DataFrame], order_file: Path,
+                                output_file: Optional[Path] = None) -> int:
+    """
+    update_fee_column_in_place for several sheets of one workbook, given as
+    sheet name -> DataFrame; the workbook is loaded and saved once
+    """
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(order_file)
+    changed = sum(_write_fee_cells(workbook[name], df) for name, df in sheets.items())
+    with atomic_output(output_file if output_file is not None else order_file) as temp_path:
+        workbook.save(temp_path)
+    return changed
+
+
+def _write_fee_cells(sheet: Any, df: pd.DataFrame) -> int:
+    header = [cell.value for cell in sheet[1]]
+    if '支付手续费' in header:
+        fee_column = header.index('支付手续费') + 1
+    else:
+        fee_column = len(header) + 1
+        sheet.cell(row=1, column=fee_column, value='支付手续费')
+    
+    changed = 0
+    formulas = []
+    # DataFrame row i was read from worksheet row i + 2 (row 1 is the header)
+    for row_number, fee in enumerate(df['支付手续费'].tolist(), start=2):
+        new_value = None if pd.isna(fee) else fee
+        cell = sheet.cell(row=row_number, column=fee_column)
+        if cell.data_type == 'f':
+            # A formula is the workbook's own logic; it is never replaced by a constant
+            formulas.append(cell.coordinate)
+            continue
+        if cell.value == new_value:
+            continue
+        cell.value = new_value
+        changed += 1
+    if formulas:
+        logger.warning("Left %d 支付手续费 formula cells in sheet %s unchanged: %s%s", len(formulas), sheet.title,
+                       ', '.join(formulas[:10]), ' ...' if len(formulas) > 10 else '')
+    return changed
+
+
 def write_result_file(df: pd.DataFrame, file_path: Path) -> None:
     """
     Write the result DataFrame to the specified file path, preserving the original file format.
+    Spreadsheets are written with the fastest installed backend for the extension;
+    .parquet, .arrow and .sqlite paths get a columnar table (backends.write_table).
+    Files are replaced atomically, so a failed write leaves the previous file intact.
     """
-    import zipfile
-    from pathlib import Path
+    original_file_extension = file_path.suffix.lower()
     
-    original_file_extension = file_path.suffix
+    # A SQLite table is replaced in one transaction, keeping the database's other tables
+    if TABLE_FORMATS.get(original_file_extension) == 'sqlite':
+        write_table(df, file_path)
+        return
     
     # Determine the appropriate engine or format based on the original file extension
-    if original_file_extension.lower() == '.csv':
-        df.to_csv(file_path, index=False, encoding='utf-8-sig')
-    else:
-        # For Excel files, determine the appropriate engine
-        path = Path(file_path)
-        ext = path.suffix.lower()
-        
-        if ext == '.xlsx':
-            try:
-                with zipfile.ZipFile(path, 'r') as zip_file:
-                    engine = 'openpyxl'
-            except zipfile.BadZipFile:
-                engine = 'xlrd'
-            except Exception:
-                engine = 'openpyxl'
-        elif ext == '.xls':
-            engine = 'xlrd'
+    with atomic_output(file_path) as temp_path:
+        if original_file_extension == '.csv':
+            df.to_csv(temp_path, index=False, encoding='utf-8-sig')
+        elif original_file_extension in TABLE_FORMATS:
+            write_table(df, temp_path)
         else:
-            engine = 'openpyxl'
-        
-        df.to_excel(file_path, index=False, engine=engine)
\ No newline at end of file
+            write_spreadsheet(df, temp_path)
+
+
+def write_result_sheets(sheets: Dict[str, pd.DataFrame], file_path: Path) -> None:
+    """
+    Write several sheets to one workbook in a single save
+    """
+    extension = file_path.suffix.lower()
+    if extension == '.csv' or extension in TABLE_FORMATS:
+        raise ValueError(f"Several sheets cannot be written to a {extension} file; choose an .xlsx output file")
+    with atomic_output(file_path) as temp_path:
+        write_spreadsheet(sheets, temp_path)
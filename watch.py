@@ -0,0 +1,332 @@
+"""
+Watch-folder mode for the Excel Merge Tool.
+Monitors a drop directory (ExcelForHandel by default) and reconciles order
+exports as they land against every payment statement in it. Changes are
+picked up through inotify on Linux and by polling elsewhere; a file is only
+read once its size and modification time have settled, so partially written
+files are left alone. Only statements that changed are re-indexed.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+# pandas and the matching code load once the watcher starts, so 'cli.py watch --help' stays fast
+from backends import add_backend_arguments, apply_backend_args, detect_format, read_spreadsheet
+from batch import print_result, reconcile_file, SUPPORTED_EXTENSIONS
+from cache import add_cache_arguments, cache_from_args, cached_payment_index
+from constants import PAYMENT_CHUNK_ROWS
+from matchlog import add_logging_arguments, configure_logging
+
+if TYPE_CHECKING:
+    from utils import PaymentIndex
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WATCH_DIR = 'ExcelForHandel'
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_SECONDS = 1.0
+# Editor lock files and partial downloads
+IGNORED_PREFIXES = ('~$', '.')
+IGNORED_SUFFIXES = ('.tmp', '.part', '.crdownload')
+
+# inotify(7): IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_CLOSE_WRITE
+INOTIFY_MASK = 0x2 | 0x40 | 0x80 | 0x100 | 0x200 | 0x8
+
+
+def _file_signature(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def classify_file(path: Path) -> Optional[str]:
+    """
+    'payment' for a statement (has '商户订单号'), 'order' for an order export
+    (has '订单号'), judged from the header only; None for anything else
+    """
+    from utils import sniff_csv
+    file_format = detect_format(str(path))
+    if file_format == 'csv':
+        columns = [column.strip() for column in sniff_csv(str(path))['header']]
+    else:
+        columns = [str(column).strip() for column in read_spreadsheet(str(path), file_format, nrows=0).columns]
+    if '商户订单号' in columns:
+        return 'payment'
+    if '订单号' in columns:
+        return 'order'
+    return None
+
+
+class PollingNotifier:
+    """
+    Wakes the watcher at a fixed interval
+    """
+
+    def wait(self, timeout: float) -> bool:
+        time.sleep(timeout)
+        return False
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyNotifier:
+    """
+    Wakes the watcher as soon as anything changes in the directory (Linux).
+    Events are only used as a hint to rescan, so they are drained, not parsed.
+    """
+
+    def __init__(self, directory: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def create_notifier(directory: Path, polling: bool = False) -> Any:
+    """
+    An inotify notifier where the platform offers one, otherwise polling
+    """
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyNotifier(directory)
+        except (OSError, AttributeError) as e:
+            logger.warning("inotify is not available (%s), polling instead", e)
+    return PollingNotifier()
+
+
+class FolderWatcher:
+    """
+    State of one watched directory: the statements indexed so far, the order
+    files reconciled so far, and files waiting for their writes to settle.
+    A file is only looked at again when its size or mtime changes.
+    """
+
+    def __init__(self, directory: Path, output_dir: Optional[Path] = None,
+                 settle_seconds: float = DEFAULT_SETTLE_SECONDS, chunksize: int = PAYMENT_CHUNK_ROWS, cache: Any = None):
+        from utils import PaymentIndex
+        self.directory = directory
+        self.output_dir = output_dir
+        self.settle_seconds = settle_seconds
+        self.chunksize = chunksize
+        self.cache = cache
+        # path -> (signature, time the signature was first seen)
+        self.pending: Dict[Path, Tuple[Tuple[int, int], float]] = {}
+        # path -> signature of files already handled (indexed, reconciled, ignored or failed)
+        self.handled: Dict[Path, Tuple[int, int]] = {}
+        self.statements: Dict[Path, 'PaymentIndex'] = {}
+        # Order files with unmatched rows or waiting for a first statement, retried when the statements change
+        self.rematch_orders: Set[Path] = set()
+        self.payment_index = PaymentIndex()
+
+    def _candidates(self) -> List[Path]:
+        return sorted(path for path in self.directory.iterdir()
+                      if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS
+                      and not path.name.startswith(IGNORED_PREFIXES) and not path.name.lower().endswith(IGNORED_SUFFIXES))
+
+    def scan(self, now: Optional[float] = None) -> List[Path]:
+        """
+        Files whose size and mtime have not changed for settle_seconds since
+        they were last handled; removed statements are dropped from the index
+        """
+        now = time.monotonic() if now is None else now
+        present = set()
+        ready = []
+        for path in self._candidates():
+            try:
+                signature = _file_signature(path)
+            except OSError:
+                continue
+            present.add(path)
+            if self.handled.get(path) == signature:
+                continue
+            pending = self.pending.get(path)
+            if pending is None or pending[0] != signature:
+                self.pending[path] = (signature, now)
+            elif now - pending[1] >= self.settle_seconds:
+                ready.append(path)
+
+        removed = [path for path in self.statements if path not in present]
+        for path in removed:
+            logger.info("Payment statement removed: %s", path)
+            del self.statements[path]
+        for path in set(self.pending) - present:
+            del self.pending[path]
+        for path in set(self.handled) - present:
+            del self.handled[path]
+        if removed:
+            self._rebuild_index()
+        return ready
+
+    def _rebuild_index(self) -> None:
+        from utils import PaymentIndex
+        # Statements are merged in name order, so an earlier statement wins as in batch mode
+        payment_index = PaymentIndex()
+        for path in sorted(self.statements):
+            payment_index.merge(self.statements[path])
+        self.payment_index = payment_index
+        # New statements may match rows that found nothing before
+        for path in self.rematch_orders:
+            signature = self.handled.pop(path, None)
+            if signature is not None:
+                self.pending[path] = (signature, float('-inf'))
+        self.rematch_orders.clear()
+
+    def _index_statement(self, path: Path) -> 'PaymentIndex':
+        if self.cache is not None:
+            return cached_payment_index(str(path), self.cache, self.chunksize)
+        from utils import load_payment_index
+        return load_payment_index(str(path), self.chunksize)
+
+    def process(self, ready: List[Path]) -> List[Dict[str, Any]]:
+        """
+        Index the ready statements, then reconcile the ready order files.
+        Returns one result per order file, as batch.run_batch does.
+        """
+        kinds = {}
+        for path in ready:
+            signature = self.pending.pop(path)[0]
+            try:
+                kinds[path] = classify_file(path)
+            except Exception as e:
+                logger.warning("Cannot read %s yet (%s: %s), waiting for it to change", path, type(e).__name__, e)
+                self.handled[path] = signature
+                continue
+            if kinds[path] is None:
+                logger.info("Ignoring %s: neither an order export nor a payment statement", path)
+                self.handled[path] = signature
+
+        statements_changed = False
+        for path in (path for path in ready if kinds.get(path) == 'payment'):
+            signature = _file_signature(path)
+            try:
+                self.statements[path] = self._index_statement(path)
+            except Exception as e:
+                print(f"Error loading payment file {path}: {type(e).__name__}: {e}")
+            else:
+                print(f"Indexed payment file: {path} ({self.statements[path].row_count} rows)")
+                statements_changed = True
+            self.handled[path] = signature
+        if statements_changed:
+            self._rebuild_index()
+
+        results = []
+        for path in (path for path in ready if kinds.get(path) == 'order'):
+            if not self.statements:
+                logger.info("No payment statement indexed yet, %s waits for one", path)
+                self.rematch_orders.add(path)
+                self.handled[path] = _file_signature(path)
+                continue
+            try:
+                result = reconcile_file(path, self.payment_index, self.output_dir)
+                result.update(file=str(path), status='ok')
+            except Exception as e:
+                result = {'file': str(path), 'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+            else:
+                if result['counts']['unmatched']:
+                    self.rematch_orders.add(path)
+            # Written in place, the file's new signature marks it as handled so the write is not picked up again
+            self.handled[path] = _file_signature(path)
+            results.append(result)
+            print_result(result)
+        return results
+
+    def waiting_for(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Seconds until the next pending file may have settled, or None
+        """
+        if not self.pending:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(min(since + self.settle_seconds - now for _, since in self.pending.values()), 0.0)
+
+
+def run_watch(watcher: FolderWatcher, notifier: Any, poll_seconds: float = DEFAULT_POLL_SECONDS,
+              once: bool = False) -> None:
+    """
+    Scan, process what has settled, and sleep until the next change or
+    settle deadline. With once, return when nothing is left pending.
+    """
+    while True:
+        watcher.process(watcher.scan())
+        delay = watcher.waiting_for()
+        if once and delay is None:
+            return
+        if isinstance(notifier, PollingNotifier):
+            notifier.wait(min(delay, poll_seconds) if delay is not None else poll_seconds)
+        else:
+            # inotify wakes on changes; the timeout only serves settle deadlines
+            notifier.wait(delay if delay is not None else 3600.0)
+
+
+def main_watch(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='cli.py watch',
+                                     description='Reconcile order files automatically as they land in a directory.')
+    parser.add_argument('directory', nargs='?', default=DEFAULT_WATCH_DIR,
+                        help=f'Directory to watch (default: {DEFAULT_WATCH_DIR})')
+    parser.add_argument('--output-dir', type=str, default=None, help='Directory for results (default: modify order files in place)')
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help=f'Seconds a file must stay unchanged before it is read (default: {DEFAULT_SETTLE_SECONDS})')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_SECONDS,
+                        help=f'Seconds between scans when polling (default: {DEFAULT_POLL_SECONDS})')
+    parser.add_argument('--polling', action='store_true', help='Poll the directory even where inotify is available')
+    parser.add_argument('--once', action='store_true', help='Process the files present now, then exit')
+    parser.add_argument('--chunksize', type=int, default=PAYMENT_CHUNK_ROWS,
+                        help=f'Rows of each payment CSV read at a time (default: {PAYMENT_CHUNK_ROWS})')
+    add_cache_arguments(parser)
+    add_logging_arguments(parser, match_log=False)
+    add_backend_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+    apply_backend_args(args)
+
+    directory = Path(args.directory)
+    if not directory.is_dir():
+        print(f"Error: Directory '{args.directory}' does not exist.")
+        return
+    output_dir = Path(args.output_dir) if args.output_dir else None
+    if output_dir:
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+    watcher = FolderWatcher(directory, output_dir, args.settle, args.chunksize, cache_from_args(args))
+    notifier = PollingNotifier() if args.once else create_notifier(directory, args.polling)
+    if not args.once:
+        mode = 'polling' if isinstance(notifier, PollingNotifier) else 'inotify'
+        print(f"Watching {directory} ({mode}, Ctrl+C to stop)")
+    try:
+        run_watch(watcher, notifier, args.poll_interval, args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        notifier.close()
+
+
+if __name__ == '__main__':
+    main_watch()